@@ -1,13 +1,37 @@
 import os
 import json
+import time
 import logging
+import functools
 from google import genai
 from google.genai import types
 from dotenv import load_dotenv
+from telemetry import registry
 
 load_dotenv()
 logger = logging.getLogger("uvicorn")
 
+ai_extraction_duration = registry.histogram(
+    "sidenote_ai_extraction_duration_seconds", "Gemini extraction latency by input kind and outcome.", ("kind", "outcome"),
+    (0.5, 1.0, 2.0, 3.0, 5.0, 8.0, 13.0, 20.0, 30.0, 60.0)
+)
+
+def timed_extraction(kind: str):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.monotonic()
+            result = None
+            try:
+                result = fn(*args, **kwargs)
+                return result
+            finally:
+                ai_extraction_duration.observe(time.monotonic() - started, kind=kind, outcome="ok" if result is not None else "failed")
+        return wrapper
+    return decorator
+
+
+@timed_extraction("receipt")
 def extract_receipt_data(file_bytes: bytes, mime_type: str) -> dict | None:
     api_key = os.getenv("GEMINI_API_KEY")
     if not api_key:
@@ -52,6 +76,7 @@ def extract_receipt_data(file_bytes: bytes, mime_type: str) -> dict | None:
         logger.error(f" Receipt Parsing Error: {e}")
         return None
     
+@timed_extraction("voice")
 def extract_voice_data(audio_bytes: bytes, mime_type: str = "audio/ogg") -> dict | None:
     """Listens to a WhatsApp voice note and extracts the expense details."""
     api_key = os.getenv("GEMINI_API_KEY")
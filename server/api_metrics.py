@@ -0,0 +1,117 @@
+import os
+import asyncio
+import threading
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from write_buffer import WriteBuffer
+from telemetry import registry
+
+API_METRICS_FLUSH_SECONDS = float(os.getenv("API_METRICS_FLUSH_SECONDS", 15))
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open.
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+BUCKET_COLUMNS = [f"le_{b}" for b in LATENCY_BUCKETS_MS] + ["le_inf"]
+
+IGNORED_SUFFIXES = ('.php', '.env', '.json', '.yml', '.yaml', '.txt', '.git')
+IGNORED_ENDPOINTS = {"/admin/metrics", "/", "/metrics"}
+
+UPSERT_SQL = f"""
+    INSERT INTO api_metrics_minutely (bucket, method, endpoint, status_code, count, total_ms, max_ms, {", ".join(BUCKET_COLUMNS)})
+    VALUES (%s, %s, %s, %s, %s, %s, %s, {", ".join(["%s"] * len(BUCKET_COLUMNS))})
+    ON DUPLICATE KEY UPDATE
+        count = count + VALUES(count),
+        total_ms = total_ms + VALUES(total_ms),
+        max_ms = GREATEST(max_ms, VALUES(max_ms)),
+        {", ".join(f"{c} = {c} + VALUES({c})" for c in BUCKET_COLUMNS)}
+"""
+
+def latency_percentiles(counts: list, max_ms: float, quantiles=(0.5, 0.95, 0.99)) -> dict:
+    """
+    Estimates latency quantiles from summed histogram bucket counts, assuming
+    latencies are spread evenly within a bucket. The open last bucket, and any
+    bucket above the observed max, is capped at max_ms.
+    """
+    counts = [int(c or 0) for c in counts]
+    total = sum(counts)
+    result = {f"p{round(q * 100)}": None for q in quantiles}
+    if not total:
+        return result
+    max_ms = float(max_ms or 0)
+    lowers = (0,) + LATENCY_BUCKETS_MS
+    uppers = LATENCY_BUCKETS_MS + (max_ms,)
+    for q in quantiles:
+        rank = q * total
+        seen = 0
+        for lower, upper, count in zip(lowers, uppers, counts):
+            if count and seen + count >= rank:
+                upper = min(upper, max_ms)
+                lower = min(lower, upper)
+                result[f"p{round(q * 100)}"] = round(lower + (upper - lower) * (rank - seen) / count, 2)
+                break
+            seen += count
+    return result
+
+http_requests = registry.counter("sidenote_http_requests", "HTTP requests by route and status code.", ("method", "route", "status"))
+http_request_duration = registry.histogram(
+    "sidenote_http_request_duration_seconds", "HTTP request latency by route.", ("method", "route"),
+    tuple(b / 1000 for b in LATENCY_BUCKETS_MS)
+)
+
+async def write_minutely_rows(cursor, rows: list):
+    await cursor.executemany(UPSERT_SQL, rows)
+
+class ApiMetrics:
+    """
+    Aggregates request timings in memory per (IST minute, method, endpoint,
+    status): count, total and max latency plus a fixed-bucket histogram. Every
+    flush_seconds the accumulated minutes are handed to a WriteBuffer as one
+    upsert row each, so the DB sees a handful of rows per minute instead of
+    one INSERT per request.
+    """
+    def __init__(self, flush_seconds: float):
+        self.flush_seconds = flush_seconds
+        self._stats: dict = {}
+        self._lock = threading.Lock()
+        self._buffer = WriteBuffer("api_metrics", write_minutely_rows)
+        self._task = None
+
+    def record(self, method: str, endpoint: str, duration_ms: float, status_code: int):
+        if endpoint.endswith(IGNORED_SUFFIXES) or status_code == 404 or endpoint in IGNORED_ENDPOINTS:
+            return
+        http_requests.inc(method=method, route=endpoint, status=status_code)
+        http_request_duration.observe(duration_ms / 1000, method=method, route=endpoint)
+        now_ist = datetime.utcnow() + timedelta(hours=5, minutes=30)
+        key = (now_ist.replace(second=0, microsecond=0), method, endpoint, status_code)
+        with self._lock:
+            entry = self._stats.get(key)
+            if entry is None:
+                entry = self._stats[key] = [0, 0.0, 0.0, [0] * len(BUCKET_COLUMNS)]
+            entry[0] += 1
+            entry[1] += duration_ms
+            entry[2] = max(entry[2], duration_ms)
+            entry[3][bisect_left(LATENCY_BUCKETS_MS, duration_ms)] += 1
+
+    def drain(self):
+        with self._lock:
+            stats, self._stats = self._stats, {}
+        for (bucket, method, endpoint, status_code), (count, total_ms, max_ms, hist) in stats.items():
+            self._buffer.add((bucket, method, endpoint, status_code, count, round(total_ms, 3), round(max_ms, 3), *hist))
+
+    def start(self):
+        self._buffer.start()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.drain()
+        await self._buffer.stop()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            self.drain()
+
+api_metrics = ApiMetrics(API_METRICS_FLUSH_SECONDS)
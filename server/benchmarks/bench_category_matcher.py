@@ -0,0 +1,107 @@
+# server/benchmarks/bench_category_matcher.py
+# DB-free comparison of CategoryMatcher against the per-category linear scan it
+# replaced in whatsapp_handlers/transactions.py, over the real notes in
+# entry_parser_golden.jsonl (the text match_keywords sees after the date is
+# stripped) and a global_categories seed. Pass a JSON export of the live table
+# (SELECT name, type, icon, color, keywords FROM global_categories ORDER BY id)
+# to use its admin-edited keywords instead of the seed below. Run from server/:
+#   python benchmarks/bench_category_matcher.py [repeats] [global_categories.json]
+import os
+import sys
+import json
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+from category_matcher import CategoryMatcher
+
+GOLDEN_PATH = os.path.join(HERE, "entry_parser_golden.jsonl")
+
+# global_categories seed: the default categories (utils.create_default_categories)
+# with the keywords their notes commonly carry.
+SEEDED_CATEGORIES = [
+    ("Food & Dining", "expense", "🍽", "#EF4444", "lunch,dinner,breakfast,snacks,coffee,tea,pizza,burger,biryani,swiggy,zomato,restaurant,cafe,chai,juice,meal"),
+    ("Groceries", "expense", "🛒", "#6366f1", "grocery,groceries,vegetables,fruits,milk,bread,eggs,rice,atta,dal,blinkit,zepto,bigbasket,kirana"),
+    ("Travel & Transport", "expense", "✈️", "#F97316", "uber,ola,rapido,auto,cab,taxi,metro,bus,train,flight,petrol,diesel,fuel,parking,toll,ride"),
+    ("Bills & Utilities", "expense", "💡", "#6366F1", "electricity,bill,water,gas,wifi,internet,broadband,recharge,phone,mobile,dth,postpaid"),
+    ("Shopping", "expense", "🛍️", "#EC4899", "amazon,flipkart,myntra,clothes,shirt,shoes,jeans,gift,watch,bag,electronics"),
+    ("Entertainment", "expense", "🎬", "#8B5CF6", "movie,movies,tickets,netflix,spotify,prime,hotstar,concert,game,games,party"),
+    ("Health & Wellness", "expense", "🧘", "#10B981", "medicine,medicines,doctor,hospital,pharmacy,gym,yoga,clinic,dentist,checkup"),
+    ("Education", "expense", "📚", "#3B82F6", "books,book,course,tuition,fees,school,college,exam,stationery,udemy"),
+    ("Rent & Housing", "expense", "🏠", "#09D2EC", "rent,maintenance,society,deposit,plumber,electrician,repair,furniture"),
+    ("Finance", "expense", "💰", "#6366f1", "emi,loan,insurance,premium,sip,mutual fund,tax,interest,credit card"),
+    ("Salary", "income", "💰", "#10B981", "salary,stipend,payroll,bonus,wages"),
+    ("Freelance", "income", "💻", "#3B82F6", "freelance,client,project,invoice,consulting,gig"),
+    ("Capital Gains", "income", "📈", "#8b5cf6", "dividend,stocks,shares,profit,returns,crypto,gains"),
+]
+
+def load_categories(path: str | None) -> dict[str, list[dict]]:
+    if path:
+        with open(path, encoding="utf-8") as f:
+            rows = json.load(f)
+    else:
+        rows = [dict(zip(("name", "type", "icon", "color", "keywords"), c)) for c in SEEDED_CATEGORIES]
+    by_type: dict[str, list[dict]] = {"expense": [], "income": []}
+    for row in rows:
+        by_type.setdefault(row["type"], []).append(row)
+    return by_type
+
+def load_notes() -> list[tuple[str, str]]:
+    """(transaction type, lowercased note) for every golden line, in corpus order."""
+    with open(GOLDEN_PATH, encoding="utf-8") as f:
+        golden = [json.loads(row) for row in f if row.strip()]
+    return [("income" if g["income"] else "expense", g["note"].lower()) for g in golden if g["note"]]
+
+def linear_scan(cats: list[dict], item_lower: str, word_boundary: bool):
+    """The pre-matcher keyword loop; word_boundary applies the matcher's boundary rule."""
+    for gc in cats:
+        gc_name, gc_keys = gc["name"], gc["keywords"]
+        aliases = [gc_name.lower()]
+        if "&" in gc_name: aliases.extend([a.strip().lower() for a in gc_name.split("&")])
+        kws = aliases
+        if gc_keys and gc_keys.lower() != 'none':
+            kws.extend([k.strip().lower() for k in gc_keys.split(',')])
+        for kw in kws:
+            if not kw:
+                continue
+            start = item_lower.find(kw)
+            while start != -1:
+                if not word_boundary or start == 0 or not item_lower[start - 1].isalnum():
+                    return gc
+                start = item_lower.find(kw, start + 1)
+    return None
+
+def timed(fn, notes: list[tuple[str, str]], repeats: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeats):
+        for tx_type, note in notes:
+            fn(tx_type, note)
+    return time.perf_counter() - started
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    cats = load_categories(sys.argv[2] if len(sys.argv) > 2 else None)
+    notes = load_notes()
+
+    started = time.perf_counter()
+    matchers = {tx_type: CategoryMatcher(type_cats) for tx_type, type_cats in cats.items()}
+    build_ms = (time.perf_counter() - started) * 1000
+
+    hits = 0
+    for tx_type, note in notes:
+        expected = linear_scan(cats[tx_type], note, word_boundary=True)
+        got = matchers[tx_type].match_keywords(note)
+        assert got is expected, f"mismatch on {note!r}: {got and got['name']} != {expected and expected['name']}"
+        hits += got is not None
+
+    old_s = timed(lambda tx_type, note: linear_scan(cats[tx_type], note, word_boundary=False), notes, repeats)
+    new_s = timed(lambda tx_type, note: matchers[tx_type].match_keywords(note), notes, repeats)
+    n_cats = sum(len(c) for c in cats.values())
+    total = len(notes) * repeats
+    print(f"{n_cats} categories, {len(notes)} golden notes ({hits} matched), results identical to the linear scan")
+    print(f"  matcher build:  {build_ms:8.2f} ms (once per rule-cache load)")
+    print(f"  linear scan:    {total / old_s:10.0f} notes/s")
+    print(f"  CategoryMatcher:{total / new_s:10.0f} notes/s  ({old_s / new_s:.1f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# server/benchmarks/bench_geoip.py
+# DB-free lookup throughput of the compiled GeoIP range file: writes a
+# synthetic "start_ip,end_ip,country_code" CSV (IPv4 and IPv6 ranges with
+# gaps, roughly the shape of the DB-IP Lite file), compiles it with
+# geoip.build, checks a sample of lookups against the ranges, then times
+# GeoIPDatabase.country_code over random addresses. Run from server/:
+#   python benchmarks/bench_geoip.py [ranges] [lookups]
+import os
+import sys
+import random
+import tempfile
+import time
+import ipaddress
+from bisect import bisect_right
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from geoip import COUNTRIES, GeoIPDatabase, build
+
+def address(version: int, number: int) -> str:
+    return str(ipaddress.IPv4Address(number) if version == 4 else ipaddress.IPv6Address(number))
+
+def make_ranges(n: int, rng: random.Random) -> list[tuple[int, int, int, str]]:
+    """(version, start, end, code) ranges, sorted and non-overlapping, with gaps between some of them."""
+    codes = sorted(COUNTRIES)
+    ranges = []
+    for version, space in ((4, 2 ** 32), (6, 2 ** 128)):
+        count = n * 3 // 4 if version == 4 else n - n * 3 // 4
+        bounds = sorted(rng.sample(range(space), 2 * count)) if version == 4 else sorted(rng.getrandbits(128) for _ in range(2 * count))
+        for start, end in zip(bounds[::2], bounds[1::2]):
+            ranges.append((version, start, end, rng.choice(codes)))
+    return ranges
+
+def write_csv(path: str, ranges: list[tuple[int, int, int, str]]):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("start_ip,end_ip,country_code\n")
+        for version, start, end, code in ranges:
+            f.write(f"{address(version, start)},{address(version, end)},{code}\n")
+
+def expected_code(ranges: list[tuple[int, int, int, str]], version: int, number: int):
+    i = bisect_right(ranges, (version, number, float("inf"))) - 1
+    if i >= 0 and ranges[i][0] == version and ranges[i][2] >= number:
+        return ranges[i][3]
+    return None
+
+def main():
+    n_ranges = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    n_lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+    rng = random.Random(42)
+    ranges = make_ranges(n_ranges, rng)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path, bin_path = os.path.join(tmp, "geoip.csv"), os.path.join(tmp, "geoip.bin")
+        write_csv(csv_path, ranges)
+        started = time.perf_counter()
+        written = build(csv_path, bin_path)
+        build_s = time.perf_counter() - started
+        database = GeoIPDatabase(bin_path)
+
+        ips = [address(4, rng.getrandbits(32)) for _ in range(n_lookups * 3 // 4)]
+        ips += [address(6, rng.getrandbits(128)) for _ in range(n_lookups - len(ips))]
+        rng.shuffle(ips)
+
+        sample = ips[:200] + [address(version, start) for version, start, _, _ in ranges[::len(ranges) // 50 or 1]]
+        for ip in sample:
+            parsed = ipaddress.ip_address(ip)
+            want = expected_code(ranges, parsed.version, int(parsed))
+            assert database.country_code(ip) == want, f"{ip}: {database.country_code(ip)} != {want}"
+
+        started = time.perf_counter()
+        hits = sum(1 for ip in ips if database.country_code(ip))
+        lookup_s = time.perf_counter() - started
+        database._map.close()
+
+    print(f"{written} ranges ({os.path.basename(bin_path)} built in {build_s:.2f} s), {len(sample)} sampled lookups match the ranges")
+    print(f"  country_code: {n_lookups / lookup_s:10.0f} lookups/s ({lookup_s / n_lookups * 1e6:.2f} us each, {hits} hits)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# server/benchmarks/bench_reports.py
+# Per-handler latency of the bot report queries against the configured
+# database (.env), without sending anything: each report's rollup read
+# (fetch_daily_expenses, or fetch_report_rows for the today listing) next to
+# the per-period queries the summary and weekly handlers used to issue. Run
+# from server/:
+#   python benchmarks/bench_reports.py <mobile> [iterations]
+import os
+import sys
+import time
+import asyncio
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import db
+from utils import get_date_range
+from whatsapp_handlers.reports import fetch_report_rows, fetch_daily_expenses
+
+LEGACY_SUMMARY_SQL = [
+    "SELECT SUM(amount) FROM transactions WHERE user_id=%s AND type='expense' AND DATE(date)=CURDATE()",
+    "SELECT SUM(amount) FROM transactions WHERE user_id=%s AND type='expense' AND YEARWEEK(date, 1)=YEARWEEK(CURDATE(), 1)",
+    "SELECT SUM(amount) FROM transactions WHERE user_id=%s AND type='expense' AND MONTH(date)=MONTH(CURDATE())",
+    "SELECT note, amount FROM transactions WHERE user_id=%s AND type='expense' AND MONTH(date)=MONTH(CURDATE()) ORDER BY amount DESC LIMIT 1",
+]
+LEGACY_WEEKLY_SQL = [
+    "SELECT WEEKDAY(date), SUM(amount) FROM transactions WHERE user_id = %s AND type = 'expense' AND YEARWEEK(date, 1) = YEARWEEK(CURDATE(), 1) GROUP BY WEEKDAY(date)",
+]
+
+async def legacy(phone: str, statements: list[str]):
+    async with db() as conn:
+        cursor = await conn.cursor()
+        await cursor.execute("SELECT id FROM users WHERE mobile = %s", (phone,))
+        row = await cursor.fetchone()
+        if row:
+            for sql in statements:
+                await cursor.execute(sql, (row[0],))
+                await cursor.fetchall()
+        await cursor.close()
+
+def cases(phone: str) -> dict:
+    day, week, month = get_date_range("day"), get_date_range("week"), get_date_range("month")
+    summary_range = (min(week[0], month[0]), max(week[1], month[1]))
+    return {
+        "summary": lambda: fetch_daily_expenses(phone, *summary_range, top_since=month[0]),
+        "summary (legacy, 5 queries)": lambda: legacy(phone, LEGACY_SUMMARY_SQL),
+        "weekly": lambda: fetch_daily_expenses(phone, *week),
+        "weekly (legacy, 2 queries)": lambda: legacy(phone, LEGACY_WEEKLY_SQL),
+        "monthly": lambda: fetch_daily_expenses(phone, *month),
+        "today": lambda: fetch_report_rows(phone, *day, expense_only=False),
+    }
+
+async def main(phone: str, iterations: int):
+    print(f"{'handler':<30}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}")
+    for name, call in cases(phone).items():
+        await call()  # warm the pool and the buffer pool
+        samples = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            await call()
+            samples.append((time.perf_counter() - started) * 1000)
+        samples.sort()
+        p95 = samples[min(int(len(samples) * 0.95), len(samples) - 1)]
+        print(f"{name:<30}{statistics.median(samples):>10.2f}{p95:>10.2f}{statistics.fmean(samples):>10.2f}")
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("usage: python benchmarks/bench_reports.py <mobile> [iterations]")
+    asyncio.run(main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 50))
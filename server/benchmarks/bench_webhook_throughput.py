@@ -0,0 +1,69 @@
+# server/benchmarks/bench_webhook_throughput.py
+# Inbound message throughput with N concurrent senders against the configured
+# database (.env): each sender pushes text messages through
+# process_incoming_message, the same path the webhook workers run, while the
+# Graph API is replaced by an in-process transport that answers after a fixed
+# latency, so nothing is sent. Reports messages/s, per-message latency and
+# async pool waits; run it before and after a pool or handler change. Use
+# read-only commands (the default is "today") against existing users. Run
+# from server/:
+#   python benchmarks/bench_webhook_throughput.py <mobile>[,<mobile>...] [senders] [messages] [text] [graph_ms]
+import os
+import sys
+import time
+import uuid
+import asyncio
+import statistics
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import whatsapp_service
+from database import async_pool
+from main import process_incoming_message
+
+def graph_transport(latency_ms: float) -> httpx.MockTransport:
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(latency_ms / 1000)
+        return httpx.Response(200, json={"messages": [{"id": f"wamid.bench.{uuid.uuid4().hex}"}]})
+    return httpx.MockTransport(handler)
+
+def text(body: str) -> dict:
+    return {"type": "text", "text": {"body": body}, "timestamp": str(int(time.time()))}
+
+async def sender(phone: str, count: int, body: str, samples: list[float]):
+    for _ in range(count):
+        started = time.perf_counter()
+        await process_incoming_message(text(body), phone, f"wamid.bench.{uuid.uuid4().hex}", "Bench")
+        samples.append((time.perf_counter() - started) * 1000)
+
+async def main(phones: list[str], senders: int, messages: int, body: str, graph_ms: float):
+    whatsapp_service.http_client = httpx.AsyncClient(transport=graph_transport(graph_ms))
+
+    await sender(phones[0], 1, body, [])  # warm the pool, user directory and rule cache
+    before = async_pool.monitor.snapshot()
+
+    samples: list[float] = []
+    started = time.perf_counter()
+    await asyncio.gather(*(sender(phones[i % len(phones)], messages, body, samples) for i in range(senders)))
+    elapsed = time.perf_counter() - started
+
+    after = async_pool.monitor.snapshot()
+    checkouts = after["checkouts"] - before["checkouts"]
+    samples.sort()
+    p95 = samples[min(int(len(samples) * 0.95), len(samples) - 1)]
+    print(f"{senders} senders x {messages} messages ({body!r}), Graph API stub {graph_ms:g} ms, async pool size {async_pool.pool_size}")
+    print(f"  throughput:   {len(samples) / elapsed:10.1f} messages/s")
+    print(f"  latency ms:   p50 {statistics.median(samples):.1f}  p95 {p95:.1f}  max {samples[-1]:.1f}")
+    print(f"  pool:         {checkouts} checkouts, {after['failures'] - before['failures']} failures, max wait {after['max_wait_ms']:.1f} ms")
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("usage: python benchmarks/bench_webhook_throughput.py <mobile>[,<mobile>...] [senders] [messages] [text] [graph_ms]")
+    asyncio.run(main(
+        sys.argv[1].split(","),
+        int(sys.argv[2]) if len(sys.argv) > 2 else 20,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 10,
+        sys.argv[4] if len(sys.argv) > 4 else "today",
+        float(sys.argv[5]) if len(sys.argv) > 5 else 150.0
+    ))
@@ -0,0 +1,62 @@
+# server/benchmarks/check_entry_parser.py
+# DB-free golden-corpus check for whatsapp_handlers/entry_parser.py. Each line
+# of entry_parser_golden.jsonl holds a message line and what the parser that
+# lived in bot_utils.py / handle_transaction_entry returned for it (amount,
+# item, income flag, payment mode, then date and note with GOLDEN_TODAY as
+# today). Reports mismatches and parser throughput. Run from server/:
+#   python benchmarks/check_entry_parser.py [repeats]
+import os
+import re
+import sys
+import json
+import time
+from datetime import date
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+from whatsapp_handlers.entry_parser import extract_transaction_details, extract_entry_date, strip_date_fillers
+
+GOLDEN_PATH = os.path.join(HERE, "entry_parser_golden.jsonl")
+GOLDEN_TODAY = date(2025, 6, 15)
+
+def parse(line: str) -> dict:
+    """extract_transaction_details followed by the date step of _prepare_entry."""
+    amount, item, income, mode = extract_transaction_details(line)
+    clean = item.replace('\n', ', ').replace('\r', '')
+    clean = re.sub(r'\s{2,}', ' ', clean).strip("- =:,+")[:240]
+    tx_date, note = extract_entry_date(clean, GOLDEN_TODAY)
+    return {
+        "line": line, "amount": amount, "item": item, "income": income, "mode": mode,
+        "date": tx_date.isoformat(), "note": strip_date_fillers(note)
+    }
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    with open(GOLDEN_PATH, encoding="utf-8") as f:
+        golden = [json.loads(row) for row in f if row.strip()]
+
+    mismatches = [(want, got) for want in golden if (got := parse(want["line"])) != want]
+    for want, got in mismatches[:20]:
+        diff = {k: (want[k], got[k]) for k in want if want[k] != got[k]}
+        print(f"MISMATCH {want['line']!r}: {diff}")
+
+    lines = [g["line"] for g in golden]
+    started = time.perf_counter()
+    for _ in range(repeats):
+        for line in lines:
+            extract_transaction_details(line)
+    details_rate = len(lines) * repeats / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for _ in range(repeats):
+        for line in lines:
+            parse(line)
+    full_rate = len(lines) * repeats / (time.perf_counter() - started)
+
+    print(f"{len(golden) - len(mismatches)}/{len(golden)} lines match the golden corpus")
+    print(f"  extract_transaction_details: {details_rate:10.0f} lines/s")
+    print(f"  details + date + fillers:    {full_rate:10.0f} lines/s")
+    sys.exit(1 if mismatches else 0)
+
+if __name__ == "__main__":
+    main()
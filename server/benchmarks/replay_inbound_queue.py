@@ -0,0 +1,219 @@
+# server/benchmarks/replay_inbound_queue.py
+# DB-free replay of batched webhook deliveries through the inbound path that
+# POST /webhook drives: split_webhook_payload -> dedupe.seen -> enqueue_many ->
+# dedupe.claim, then InboundQueue workers claiming and running each job. The
+# inbound_jobs table is an in-memory store that answers the queue's own SQL
+# (unique message_id, SKIP LOCKED claims, per-sender ordering, retries), and
+# the processor is a stub that fails some first attempts. Deliveries arrive
+# concurrently and some are redelivered, as Meta does under load. Asserts every
+# message is processed exactly once and in order per sender, then reports
+# throughput. Run from server/:
+#   python benchmarks/replay_inbound_queue.py [deliveries] [concurrency] [workers]
+import os
+import sys
+import time
+import types
+import random
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+os.environ["DEDUPE_BACKEND"] = "memory"
+os.environ.setdefault("INBOUND_RETRY_BASE_SECONDS", "0.01")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+QUERY_LATENCY_SECONDS = 0.0005
+
+def _normalize(sql: str) -> str:
+    return " ".join(sql.split())
+
+class JobStore:
+    """inbound_jobs held in a dict; one fake connection per db() block, row locks released on commit/rollback."""
+    def __init__(self):
+        self.rows: dict[int, dict] = {}
+        self.message_ids: set = set()
+        self.next_id = 1
+
+    @asynccontextmanager
+    async def db(self):
+        conn = FakeConnection(self)
+        try:
+            yield conn
+        finally:
+            await conn.rollback()
+
+    def unfinished(self) -> int:
+        return sum(1 for r in self.rows.values() if r["status"] in ("pending", "processing"))
+
+class FakeConnection:
+    def __init__(self, store: JobStore):
+        self.store = store
+
+    async def cursor(self):
+        return FakeCursor(self)
+
+    def _unlock(self):
+        for row in self.store.rows.values():
+            if row["locked_by"] is self:
+                row["locked_by"] = None
+
+    async def commit(self):
+        self._unlock()
+
+    async def rollback(self):
+        self._unlock()
+
+class FakeCursor:
+    def __init__(self, conn: FakeConnection):
+        self.conn = conn
+        self.store = conn.store
+        self.rowcount = 0
+        self._result: list = []
+
+    async def executemany(self, sql: str, seq: list):
+        await asyncio.sleep(QUERY_LATENCY_SECONDS)
+        assert _normalize(sql).startswith("INSERT IGNORE INTO inbound_jobs"), sql
+        self.rowcount = 0
+        for message_id, sender_phone, sender_name, payload in seq:
+            if message_id in self.store.message_ids:
+                continue
+            self.store.message_ids.add(message_id)
+            self.store.rows[self.store.next_id] = {
+                "id": self.store.next_id, "message_id": message_id, "sender_phone": sender_phone,
+                "sender_name": sender_name, "payload": payload, "attempts": 0, "status": "pending",
+                "available_at": 0.0, "locked_at": 0.0, "locked_by": None
+            }
+            self.store.next_id += 1
+            self.rowcount += 1
+
+    async def execute(self, sql: str, params: tuple = ()):
+        await asyncio.sleep(QUERY_LATENCY_SECONDS)
+        q, now, rows = _normalize(sql), time.monotonic(), self.store.rows
+        self.rowcount, self._result = 0, []
+        if q == _normalize(inbound_queue.CLAIM_SQL):
+            for row in sorted(rows.values(), key=lambda r: r["id"]):
+                if row["status"] != "pending" or row["available_at"] > now or row["locked_by"] not in (None, self.conn):
+                    continue
+                if any(p["sender_phone"] == row["sender_phone"] and p["status"] in ("pending", "processing") and p["id"] < row["id"] for p in rows.values()):
+                    continue
+                row["locked_by"] = self.conn
+                self._result = [(row["id"], row["message_id"], row["sender_phone"], row["sender_name"], row["payload"], row["attempts"])]
+                break
+        elif q.startswith("UPDATE inbound_jobs SET status = 'processing'"):
+            row = rows[params[0]]
+            row.update(status="processing", attempts=row["attempts"] + 1, locked_at=now)
+            self.rowcount = 1
+        elif q.startswith("UPDATE inbound_jobs SET status = 'pending' WHERE status = 'processing'"):
+            for row in rows.values():
+                if row["status"] == "processing" and row["locked_at"] < now - params[0]:
+                    row["status"] = "pending"
+                    self.rowcount += 1
+        elif q.startswith("UPDATE inbound_jobs SET"):
+            *values, job_id, attempts = params
+            row = rows.get(job_id)
+            if row is None or row["attempts"] != attempts or ("status = 'processing'" in q and row["status"] != "processing"):
+                return
+            if "status = 'done'" in q: row["status"] = "done"
+            elif "status = 'dead'" in q: row["status"] = "dead"
+            elif "status = 'pending'" in q: row.update(status="pending", available_at=now + values[0])
+            else: row["locked_at"] = now
+            self.rowcount = 1
+        elif q.startswith("DELETE FROM inbound_jobs"):
+            pass  # retention is hours; nothing here is that old
+        elif q.startswith("SELECT COUNT(*) FROM inbound_jobs"):
+            self._result = [(self.store.unfinished(),)]
+        else:
+            raise NotImplementedError(q)
+
+    async def fetchone(self):
+        return self._result[0] if self._result else None
+
+    async def fetchall(self):
+        return list(self._result)
+
+store = JobStore()
+sys.modules["database"] = types.SimpleNamespace(db=store.db)
+import inbound_queue
+from inbound_queue import InboundQueue
+from dedupe import dedupe
+from webhook_payload import split_webhook_payload
+
+logging.getLogger("inbound_queue").setLevel(logging.CRITICAL)  # the injected failures are expected
+
+def delivery(batch: int, senders: list[str], sequence: dict[str, int], rng: random.Random) -> dict:
+    """One webhook POST: a couple of changes, each with a few text messages from random senders."""
+    changes = []
+    for _ in range(rng.randint(1, 3)):
+        messages = []
+        for sender in rng.sample(senders, rng.randint(1, 4)):
+            sequence[sender] += 1
+            messages.append({"from": sender, "id": f"wamid.{sender}.{sequence[sender]}", "type": "text", "text": {"body": f"{sequence[sender]} tea"}})
+        changes.append({"field": "messages", "value": {"contacts": [{"wa_id": s, "profile": {"name": s}} for s in senders], "messages": messages}})
+    return {"object": "whatsapp_business_account", "entry": [{"id": f"waba-{batch}", "changes": changes}]}
+
+async def receive(body: dict, queue: InboundQueue):
+    """The accept step of POST /webhook: skip seen ids, enqueue the batch, claim once durable."""
+    messages, _ = split_webhook_payload(body)
+    jobs = [(message, sender_phone, message_id, sender_name)
+            for message, sender_phone, message_id, sender_name, _ in messages
+            if not await dedupe.seen(message_id)]
+    if jobs:
+        await queue.enqueue_many(jobs)
+        for job in jobs:
+            await dedupe.claim(job[2])
+
+async def main(n_deliveries: int, concurrency: int, workers: int):
+    rng = random.Random(7)
+    senders = [f"9198000{i:05d}" for i in range(40)]
+    sequence = {s: 0 for s in senders}
+    bodies = [delivery(i, senders, sequence, rng) for i in range(n_deliveries)]
+    redelivered = rng.sample(bodies, n_deliveries // 5)  # Meta retries a fifth of the POSTs
+    deliveries = bodies + redelivered
+    rng.shuffle(deliveries)
+
+    attempts: dict[str, int] = {}
+    processed: dict[str, list[int]] = {s: [] for s in senders}
+    async def processor(message: dict, sender_phone: str, message_id: str, sender_name: str):
+        attempts[message_id] = attempts.get(message_id, 0) + 1
+        await asyncio.sleep(rng.uniform(0, 0.002))
+        if attempts[message_id] == 1 and message_id.endswith("0"):
+            raise RuntimeError("transient handler failure")
+        processed[sender_phone].append(int(message["text"]["body"].split()[0]))
+
+    queue = InboundQueue(workers, max_depth=10 ** 9)
+    queue.start(processor)
+    gate = asyncio.Semaphore(concurrency)
+    async def post(body: dict):
+        async with gate:
+            await receive(body, queue)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(post(body) for body in deliveries))
+    accepted = time.perf_counter() - started
+    while store.unfinished():
+        await asyncio.sleep(0.01)
+    drained = time.perf_counter() - started
+    await queue.stop()
+
+    by_sender: dict[str, list[int]] = {s: [] for s in senders}
+    for row in sorted(store.rows.values(), key=lambda r: r["id"]):
+        by_sender[row["sender_phone"]].append(int(row["message_id"].rsplit(".", 1)[1]))
+    total = sum(sequence.values())
+    retried = sum(1 for n in attempts.values() if n > 1)
+    assert len(store.rows) == total, f"{len(store.rows)} jobs queued for {total} distinct messages"
+    assert all(r["status"] == "done" for r in store.rows.values()), "jobs left unfinished or dead"
+    assert all(sorted(processed[s]) == list(range(1, sequence[s] + 1)) for s in senders), "a message was lost or processed twice"
+    assert processed == by_sender, "a sender's messages were processed out of queue order"
+    assert queue.processed == total and queue.failed == retried
+
+    print(f"{len(deliveries)} webhook POSTs ({len(redelivered)} redelivered), {total} messages from {len(senders)} senders, "
+          f"{concurrency} concurrent, {workers} workers")
+    print(f"  every message processed exactly once, in order per sender ({retried} after a failed first attempt)")
+    print(f"  accepted in {accepted:.2f} s ({len(deliveries) / accepted:,.0f} POSTs/s), drained in {drained:.2f} s ({total / drained:,.0f} messages/s)")
+
+if __name__ == "__main__":
+    asyncio.run(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 500,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 50,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 8
+    ))
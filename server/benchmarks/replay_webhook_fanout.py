@@ -0,0 +1,85 @@
+# server/benchmarks/replay_webhook_fanout.py
+# DB-free replay of a batched Meta webhook POST through split_webhook_payload
+# (what POST /webhook runs before enqueueing). Asserts that every message and
+# status comes out once, in payload order, with the right sender name and
+# wa_id, then times the split. Run from server/:
+#   python benchmarks/replay_webhook_fanout.py [entries] [iterations]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from webhook_payload import split_webhook_payload
+
+def text(message_id: str, sender: str, body: str) -> dict:
+    return {"from": sender, "id": message_id, "timestamp": "1760000000", "type": "text", "text": {"body": body}}
+
+def status(wamid: str, recipient: str, state: str) -> dict:
+    return {"id": wamid, "recipient_id": recipient, "status": state, "timestamp": "1760000000"}
+
+def contact(wa_id: str, name: str) -> dict:
+    return {"wa_id": wa_id, "profile": {"name": name}}
+
+def sample_payload() -> dict:
+    """Three entries, one with two changes; a change mixing senders; a lone contact whose wa_id differs from 'from'."""
+    return {"object": "whatsapp_business_account", "entry": [
+        {"id": "waba-1", "changes": [
+            {"field": "messages", "value": {
+                "contacts": [contact("919800000001", "Asha"), contact("919800000002", "Ravi")],
+                "messages": [text("wamid.A1", "919800000001", "100 lunch"), text("wamid.B1", "919800000002", "50 tea"),
+                             text("wamid.A2", "919800000001", "summary")],
+            }},
+            {"field": "messages", "value": {"statuses": [status("wamid.S1", "919800000001", "delivered"),
+                                                         status("wamid.S2", "919800000002", "read")]}},
+        ]},
+        {"id": "waba-1", "changes": [
+            {"field": "messages", "value": {
+                "contacts": [contact("919800000003", "Meera")],
+                "messages": [text("wamid.C1", "+919800000003", "+5000 salary")],
+                "statuses": [status("wamid.S3", "919800000003", "sent")],
+            }},
+        ]},
+        {"id": "waba-1", "changes": [
+            {"field": "messages", "value": {"messages": [text("wamid.D1", "919800000004", "hi")]}},
+        ]},
+    ]}
+
+# (message_id, sender_phone, sender_name, wa_id) and status ids, per entry.
+EXPECTED_BY_ENTRY = [
+    ([("wamid.A1", "919800000001", "Asha", "919800000001"),
+      ("wamid.B1", "919800000002", "Ravi", "919800000002"),
+      ("wamid.A2", "919800000001", "Asha", "919800000001")], ["wamid.S1", "wamid.S2"]),
+    ([("wamid.C1", "+919800000003", "Meera", "919800000003")], ["wamid.S3"]),
+    ([("wamid.D1", "919800000004", "WhatsApp User", None)], []),
+]
+
+def check(body: dict, expected: list[tuple[list, list]]) -> tuple[int, int]:
+    messages, statuses = split_webhook_payload(body)
+    want_messages = [m for entry_messages, _ in expected for m in entry_messages]
+    want_statuses = [s for _, entry_statuses in expected for s in entry_statuses]
+    got = [(m[2], m[1], m[3], m[4]) for m in messages]
+    assert got == want_messages, f"message fan-out mismatch:\n  got      {got}\n  expected {want_messages}"
+    assert all(m[0]["id"] == m[2] for m in messages), "message dict does not match its id"
+    assert [s["id"] for s in statuses] == want_statuses, f"status fan-out mismatch: {[s['id'] for s in statuses]}"
+    return len(messages), len(statuses)
+
+def main():
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    n_messages, n_statuses = check(sample_payload(), EXPECTED_BY_ENTRY)
+    print(f"sample payload: {n_messages} messages and {n_statuses} statuses, in order")
+
+    base = sample_payload()["entry"]
+    batch = {"object": "whatsapp_business_account", "entry": [base[i % len(base)] for i in range(entries)]}
+    n_messages, n_statuses = check(batch, [EXPECTED_BY_ENTRY[i % len(base)] for i in range(entries)])
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        split_webhook_payload(batch)
+    elapsed = time.perf_counter() - started
+    print(f"{entries}-entry batch: {n_messages} messages, {n_statuses} statuses, in order")
+    print(f"  {iterations / elapsed:,.0f} payloads/s, {iterations * n_messages / elapsed:,.0f} messages/s")
+
+if __name__ == "__main__":
+    main()
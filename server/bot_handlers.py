@@ -4,14 +4,13 @@ from ai_service import extract_receipt_data, extract_voice_data
 from constants import CMD_MENU, CMD_UNDO, CMD_SUMMARY, CMD_WEEK, CMD_MONTH, CMD_TODAY, CMD_MORE, CMD_HELP, CMD_SET_BUDGET, INCOME_KEYWORDS, CMD_SET_NAME, CMD_SET_NICKNAME
 from whatsapp_handlers.search_handlers import handle_search_command, handle_search_interactive
 
-from whatsapp_handlers.bot_utils import is_duplicate, extract_transaction_details, log_bot_command, ensure_user_exists
+from whatsapp_handlers.bot_utils import log_bot_command, ensure_user_exists
+from whatsapp_handlers.entry_parser import extract_transaction_details
 from whatsapp_handlers.reports import handle_summary_request, handle_weekly_request, handle_monthly_request, handle_today_request, handle_menu_request, handle_more_request, handle_dashboard_request
-from whatsapp_handlers.transactions import handle_transaction_entry, handle_undo_request, handle_undo_action, handle_budget_set, handle_dynamic_replies, handle_fallback, handle_set_profile
+from whatsapp_handlers.transactions import handle_transaction_entry, handle_bulk_entries, handle_undo_request, handle_undo_action, handle_budget_set, handle_dynamic_replies, handle_fallback, handle_set_profile
 from whatsapp_handlers.groups_bot import handle_group_commands
 
 async def process_whatsapp_text(phone: str, text: str, message_id: Optional[str] = None, sender_name: str = "WhatsApp User"):
-    if is_duplicate(message_id): return
-    
     is_new = await ensure_user_exists(phone, sender_name)
     text = text.strip().lower()
     
@@ -20,24 +19,24 @@ async def process_whatsapp_text(phone: str, text: str, message_id: Optional[str]
     if await handle_group_commands(phone, text):
         return
         
-    if text == CMD_MENU: log_bot_command(phone, 'menu'); await handle_menu_request(phone)
-    elif text == CMD_UNDO: log_bot_command(phone, 'undo'); await handle_undo_request(phone)
-    elif text == CMD_SUMMARY: log_bot_command(phone, 'summary'); await handle_summary_request(phone)
-    elif text == CMD_WEEK: log_bot_command(phone, 'week'); await handle_weekly_request(phone)
-    elif text == CMD_MONTH: log_bot_command(phone, 'month'); await handle_monthly_request(phone)
-    elif text == CMD_TODAY: log_bot_command(phone, 'today'); await handle_today_request(phone)
-    elif text == CMD_MORE: log_bot_command(phone, 'more'); await handle_more_request(phone)
+    if text == CMD_MENU: await log_bot_command(phone, 'menu'); await handle_menu_request(phone)
+    elif text == CMD_UNDO: await log_bot_command(phone, 'undo'); await handle_undo_request(phone)
+    elif text == CMD_SUMMARY: await log_bot_command(phone, 'summary'); await handle_summary_request(phone)
+    elif text == CMD_WEEK: await log_bot_command(phone, 'week'); await handle_weekly_request(phone)
+    elif text == CMD_MONTH: await log_bot_command(phone, 'month'); await handle_monthly_request(phone)
+    elif text == CMD_TODAY: await log_bot_command(phone, 'today'); await handle_today_request(phone)
+    elif text == CMD_MORE: await log_bot_command(phone, 'more'); await handle_more_request(phone)
     elif text == CMD_HELP: 
-        log_bot_command(phone, 'help')
+        await log_bot_command(phone, 'help')
         await send_whatsapp_text(phone, "💡 *Tips:*\n- Type `100 food` to add an expense.\n- Type `undo` to delete a mistake.\n- Send a photo of a receipt!\n- Send a Voice Note!")
     elif text.startswith("search ") or text.startswith("find "): 
-        log_bot_command(phone, 'search')
+        await log_bot_command(phone, 'search')
         await handle_search_command(phone, text)
     elif text.startswith(CMD_SET_BUDGET): 
-        log_bot_command(phone, 'set_budget')
+        await log_bot_command(phone, 'set_budget')
         await handle_budget_set(phone, text)
     elif text.startswith(CMD_SET_NAME) or text.startswith(CMD_SET_NICKNAME):
-        log_bot_command(phone, 'set_profile')
+        await log_bot_command(phone, 'set_profile')
         await handle_set_profile(phone, text)
     else:
         if '\n' in text:
@@ -47,22 +46,26 @@ async def process_whatsapp_text(phone: str, text: str, message_id: Optional[str]
             total_income = 0.0
             failed_lines = []
             
+            parsed_lines = []
             for line in lines:
                 if not line.strip(): continue
                 amount, item, explicit_inc, p_mode = extract_transaction_details(line)
                 
                 if amount is not None and item and any(c.isalnum() for c in item):
-                    is_saved = await handle_transaction_entry(phone, amount, item, silent=True, sender_name=sender_name, explicit_income=explicit_inc, payment_mode=p_mode)
-                    if is_saved:
-                        if explicit_inc or any(keyword in item.lower() for keyword in INCOME_KEYWORDS):
-                            total_income += amount
-                        else:
-                            total_expense += amount
-                        added_count += 1
-                    else:
-                        failed_lines.append(line)
+                    parsed_lines.append((line, (amount, item, explicit_inc, p_mode)))
                 else:
                     if any(c.isdigit() for c in line): failed_lines.append(line)
+            
+            saved_flags = await handle_bulk_entries(phone, [entry for _, entry in parsed_lines], sender_name=sender_name, source_message_id=message_id)
+            for (line, (amount, item, explicit_inc, _)), is_saved in zip(parsed_lines, saved_flags):
+                if is_saved:
+                    if explicit_inc or any(keyword in item.lower() for keyword in INCOME_KEYWORDS):
+                        total_income += amount
+                    else:
+                        total_expense += amount
+                    added_count += 1
+                else:
+                    failed_lines.append(line)
                     
             if added_count > 0 or failed_lines:
                 summary_msg = ""
@@ -83,14 +86,12 @@ async def process_whatsapp_text(phone: str, text: str, message_id: Optional[str]
             amount, item, explicit_inc, p_mode = extract_transaction_details(text)
             
             if amount is not None and item and any(c.isalnum() for c in item):
-                await handle_transaction_entry(phone, amount, item, sender_name=sender_name, explicit_income=explicit_inc, payment_mode=p_mode)
+                await handle_transaction_entry(phone, amount, item, sender_name=sender_name, explicit_income=explicit_inc, payment_mode=p_mode, source_message_id=message_id)
             else:
                 if not await handle_dynamic_replies(phone, text):
                     await handle_fallback(phone, text)
 
 async def process_whatsapp_image(phone: str, media_id: str, mime_type: str, message_id: Optional[str] = None, sender_name: str = "WhatsApp User"):
-    if is_duplicate(message_id): return
-    
     await ensure_user_exists(phone, sender_name)
     await send_whatsapp_text(phone, "⏳ Reading your receipt ...")
     
@@ -106,13 +107,11 @@ async def process_whatsapp_image(phone: str, media_id: str, mime_type: str, mess
         amount = float(receipt_data['amount'])
         item = str(receipt_data['item'])
         print(f"Data Successfully Extracted: ₹{amount} for {item}")
-        await handle_transaction_entry(phone, amount, item, sender_name=sender_name)
+        await handle_transaction_entry(phone, amount, item, sender_name=sender_name, source_message_id=message_id)
     else:
         await send_whatsapp_text(phone, "❌ Sorry, I couldn't clearly read that receipt.")
 
 async def process_whatsapp_audio(phone: str, media_id: str, message_id: Optional[str] = None, sender_name: str = "WhatsApp User"):
-    if is_duplicate(message_id): return
-    
     await ensure_user_exists(phone, sender_name)
     await send_whatsapp_text(phone, "🎧 Listening to your voice note...")
     
@@ -128,34 +127,32 @@ async def process_whatsapp_audio(phone: str, media_id: str, message_id: Optional
         amount = float(voice_data['amount'])
         item = str(voice_data['item'])
         print(f"🎙️ Voice Extracted: ₹{amount} for {item}")
-        await handle_transaction_entry(phone, amount, item, sender_name=sender_name)
+        await handle_transaction_entry(phone, amount, item, sender_name=sender_name, source_message_id=message_id)
     else:
         await send_whatsapp_text(phone, "❓ I couldn't hear a specific amount or item. Could you try speaking a bit clearer?")   
 
 async def process_whatsapp_interactive(phone: str, button_id: str, message_id: Optional[str] = None, sender_name: str = "WhatsApp User"):
-    if is_duplicate(message_id): return
-    
     await ensure_user_exists(phone, sender_name)
 
     if button_id.startswith("group "):
         await handle_group_commands(phone, button_id)
         return
 
-    if button_id == "cmd_summary": log_bot_command(phone, 'summary'); await handle_summary_request(phone)
-    elif button_id == "cmd_today": log_bot_command(phone, 'today'); await handle_today_request(phone)
-    elif button_id == "cmd_more": log_bot_command(phone, 'more'); await handle_more_request(phone)
-    elif button_id == "cmd_dashboard": log_bot_command(phone, 'dashboard'); await handle_dashboard_request(phone)
-    elif button_id == "cmd_month": log_bot_command(phone, 'month'); await handle_monthly_request(phone)
-    elif button_id == "cmd_week": log_bot_command(phone, 'week'); await handle_weekly_request(phone)
+    if button_id == "cmd_summary": await log_bot_command(phone, 'summary'); await handle_summary_request(phone)
+    elif button_id == "cmd_today": await log_bot_command(phone, 'today'); await handle_today_request(phone)
+    elif button_id == "cmd_more": await log_bot_command(phone, 'more'); await handle_more_request(phone)
+    elif button_id == "cmd_dashboard": await log_bot_command(phone, 'dashboard'); await handle_dashboard_request(phone)
+    elif button_id == "cmd_month": await log_bot_command(phone, 'month'); await handle_monthly_request(phone)
+    elif button_id == "cmd_week": await log_bot_command(phone, 'week'); await handle_weekly_request(phone)
     elif button_id == "cmd_help": 
-        log_bot_command(phone, 'help')
+        await log_bot_command(phone, 'help')
         await send_whatsapp_text(phone, "💡 *Tips:*\n- Type `100 food` to add an expense.\n- Type `undo` to delete a mistake.\n- Send a photo of a receipt!")
     elif button_id.startswith("del_"):
         tx_id = int(button_id.split("_")[1])
-        log_bot_command(phone, 'undo')
+        await log_bot_command(phone, 'undo')
         await handle_undo_action(phone, tx_id)
     elif button_id.startswith("srch_"):
-        log_bot_command(phone, 'search')
+        await log_bot_command(phone, 'search')
         await handle_search_interactive(phone, button_id)
     else:
         await handle_dynamic_replies(phone, button_id)
\ No newline at end of file
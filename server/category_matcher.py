@@ -0,0 +1,87 @@
+from typing import Optional
+
+def _aliases(name: str) -> list[str]:
+    aliases = [name.lower()]
+    if "&" in name: aliases.extend([a.strip().lower() for a in name.split("&")])
+    return [a for a in aliases if a]
+
+class CategoryMatcher:
+    """
+    Precompiled global_categories matcher for one transaction type.
+
+    match_explicit() resolves a category named by the first/last word of a note
+    with two dict lookups. match_keywords() runs an Aho-Corasick automaton over
+    every alias and keyword, so the note is scanned once no matter how many
+    categories exist. A keyword only counts when it starts on a word boundary
+    ("bus" matches "bus ticket" but not "airbus"). Where several categories hit,
+    the one listed first wins, as with the old per-category loop.
+    """
+    def __init__(self, categories: list[dict]):
+        self.categories = categories
+        self._by_alias: dict[str, int] = {}
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[list[tuple[int, int]]] = [[]]
+
+        for idx, cat in enumerate(categories):
+            aliases = _aliases(str(cat["name"]))
+            for alias in aliases:
+                self._by_alias.setdefault(alias, idx)
+
+            keywords = list(aliases)
+            raw = cat.get("keywords")
+            if raw and str(raw).lower() != 'none':
+                keywords.extend(k.strip().lower() for k in str(raw).split(','))
+            for kw in keywords:
+                if kw: self._add(kw, idx)
+        self._link()
+
+    def _add(self, pattern: str, idx: int):
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append((len(pattern), idx))
+
+    def _link(self):
+        queue = list(self._goto[0].values())
+        for node in queue:
+            for ch, child in self._goto[node].items():
+                fallback = self._fail[node]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+                queue.append(child)
+
+    def match_explicit(self, first_word: str, last_word: str) -> Optional[tuple[dict, bool]]:
+        """Returns (category, matched_first_word) when the note starts or ends with a category name."""
+        first = self._by_alias.get(first_word) if first_word else None
+        last = self._by_alias.get(last_word) if last_word else None
+        if first is None and last is None:
+            return None
+        if last is None or (first is not None and first <= last):
+            return self.categories[first], True
+        return self.categories[last], False
+
+    def match_keywords(self, text: str) -> Optional[dict]:
+        best = None
+        node = 0
+        for pos, ch in enumerate(text):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            for length, idx in self._out[node]:
+                if best is not None and idx >= best:
+                    continue
+                start = pos - length + 1
+                if start == 0 or not text[start - 1].isalnum():
+                    best = idx
+        return self.categories[best] if best is not None else None
@@ -0,0 +1,133 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Optional
+from database import get_db, db
+
+logger = logging.getLogger(__name__)
+
+COUNTRY_GATE_TTL = float(os.getenv("COUNTRY_GATE_TTL", 300))
+# After a failed reload, checks keep using the previous rules (or fail fast if
+# there are none) for this long before the database is asked again.
+COUNTRY_GATE_RETRY_SECONDS = float(os.getenv("COUNTRY_GATE_RETRY_SECONDS", 15))
+
+ALLOWED_COUNTRIES_SQL = "SELECT country_code, country_name FROM allowed_countries WHERE status = 1"
+
+_END = ""  # trie key marking that the digits so far are a complete calling code
+
+class CountryGate:
+    """
+    In-memory copy of the active allowed_countries rows: a digit trie of calling
+    codes for phone numbers, and the code/name set the IP geo block compares
+    against. The /admin/countries endpoints call bump() so this worker reloads
+    on the next check; other workers pick changes up within the TTL. If a reload
+    fails the previous rules keep being served and the next attempt waits
+    retry_after seconds, so an unhealthy database is not queried per request.
+    """
+    def __init__(self, ttl: float, retry_after: float):
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self.version = 0
+        self._loaded_version = -1
+        self._loaded_at = 0.0
+        self._retry_at = 0.0
+        self._trie: dict = {}
+        self._allowed_set: set = set()
+        self._lock = asyncio.Lock()
+
+    def bump(self):
+        self.version += 1
+
+    def _is_fresh(self) -> bool:
+        return self._loaded_version == self.version and time.monotonic() - self._loaded_at < self.ttl
+
+    def _apply(self, rows: list, version: int):
+        trie: dict = {}
+        allowed_set = set()
+        for row in rows:
+            code, name = (row["country_code"], row["country_name"]) if isinstance(row, dict) else tuple(row)
+            code = str(code or "").strip().lstrip('+')
+            if code:
+                node = trie
+                for digit in code:
+                    node = node.setdefault(digit, {})
+                node[_END] = code
+                allowed_set.add(code)
+            if name:
+                allowed_set.add(str(name).strip().lower())
+        self._trie = trie
+        self._allowed_set = allowed_set
+        self._loaded_version = version
+        self._loaded_at = time.monotonic()
+
+    def _loaded(self) -> bool:
+        return self._loaded_version >= 0
+
+    def _needs_reload(self) -> bool:
+        if self._is_fresh():
+            return False
+        if time.monotonic() < self._retry_at:
+            if not self._loaded():
+                raise RuntimeError("allowed countries unavailable; last load failed")
+            return False
+        return True
+
+    def _failed(self, e: Exception):
+        self._retry_at = time.monotonic() + self.retry_after
+        if not self._loaded():
+            raise e
+        logger.error(f"Failed to reload allowed countries, keeping previous rules for {self.retry_after:g}s: {e}")
+
+    def ensure_loaded(self, cursor: Any = None):
+        if not self._needs_reload():
+            return
+        version = self.version
+        conn = None
+        try:
+            if cursor is None:
+                conn = get_db()
+                cursor = conn.cursor()
+            cursor.execute(ALLOWED_COUNTRIES_SQL)
+            self._apply(cursor.fetchall(), version)
+        except Exception as e:
+            self._failed(e)
+        finally:
+            if conn is not None:
+                conn.close()
+
+    async def ensure_loaded_async(self, cursor: Any = None):
+        if not self._needs_reload():
+            return
+        async with self._lock:
+            if not self._needs_reload():
+                return
+            version = self.version
+            try:
+                if cursor is not None:
+                    await cursor.execute(ALLOWED_COUNTRIES_SQL)
+                    self._apply(await cursor.fetchall(), version)
+                else:
+                    async with db() as conn:
+                        cursor = await conn.cursor()
+                        await cursor.execute(ALLOWED_COUNTRIES_SQL)
+                        self._apply(await cursor.fetchall(), version)
+                        await cursor.close()
+            except Exception as e:
+                self._failed(e)
+
+    def match(self, mobile: str) -> Optional[str]:
+        """Longest allowed calling code that prefixes mobile (E.164, '+' optional), or None."""
+        node = self._trie
+        matched = None
+        for digit in mobile.strip().lstrip('+'):
+            node = node.get(digit)
+            if node is None:
+                break
+            matched = node.get(_END, matched)
+        return matched
+
+    def allowed_set(self) -> set:
+        return self._allowed_set
+
+country_gate = CountryGate(COUNTRY_GATE_TTL, COUNTRY_GATE_RETRY_SECONDS)
@@ -1,6 +1,7 @@
 from database import get_db
 import logging
 from whatsapp_service import send_whatsapp_template
+from outbound_scheduler import LANE_BULK
 import asyncio
 
 logging.basicConfig(level=logging.INFO)
@@ -64,7 +65,8 @@ async def send_weekly_proactive_insights():
                 await send_whatsapp_template(
                     to_number=mobile, 
                     template_name="weekly_insight_v1_1", 
-                    variables=[f"{week_total:g}", top_category, f"{top_amount:g}"] 
+                    variables=[f"{week_total:g}", top_category, f"{top_amount:g}"],
+                    lane=LANE_BULK
                 )
                 logger.info(f"Insight sent to {mobile}: {top_category} (₹{top_amount:g})")
                 
@@ -1,9 +1,11 @@
-import logging, os, asyncio
+import logging, os, asyncio, time
 from datetime import datetime, timedelta, date
 import calendar
 from typing import Any
-from database import get_db
+from database import db
+from telemetry import registry
 from whatsapp_service import send_whatsapp_template
+from outbound_scheduler import LANE_BULK
 from bot_handlers import handle_monthly_request
 
 if not os.path.exists('logs'):
@@ -32,209 +34,226 @@ if not logger.handlers:
     console_handler.setFormatter(formatter)
     logger.addHandler(console_handler)
 
+nudge_run_duration = registry.histogram(
+    "sidenote_nudge_run_duration_seconds", "Nudge engine run time by outcome.", ("outcome",),
+    (1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 900.0)
+)
+
+async def record_nudge(user_id: int, template_name: str, trigger_reason: str):
+    async with db() as conn:
+        cursor = await conn.cursor()
+        await cursor.execute("INSERT INTO automated_messages (user_id, template_name, trigger_reason, sent_at) VALUES (%s, %s, %s, NOW())", (user_id, template_name, trigger_reason))
+        await conn.commit()
+
 async def run_daily_nudges(target_rule: str = "all"):
     logger.info(f"Starting Bulk-Optimized Nudge Engine. Target: {target_rule}")
     now = datetime.utcnow() + timedelta(hours=5, minutes=30)
-    conn = get_db()
-    cursor = conn.cursor(dictionary=True)
-    
+    started = time.monotonic()
+    outcome = "ok"
+    # (user_id, mobile, template_name, trigger_reason, variables or None for the monthly report).
+    # Everything is read under one connection; the sends and their
+    # automated_messages rows happen after it is back in the pool.
+    planned: list[tuple] = []
     try:
-        today = now.date()
-        current_day_name = calendar.day_name[today.weekday()]
-        current_day_num = today.day
-        last_day_of_month = calendar.monthrange(today.year, today.month)[1]
+        async with db() as conn:
+            cursor = await conn.cursor(dictionary=True)
+
+            today = now.date()
+            current_day_name = calendar.day_name[today.weekday()]
+            current_day_num = today.day
+            last_day_of_month = calendar.monthrange(today.year, today.month)[1]
         
-        cursor.execute("SELECT * FROM nudge_settings WHERE is_active = TRUE ORDER BY hours_min DESC")
-        active_rules = cursor.fetchall()
-
-        cursor.execute("SELECT id, name, mobile, created_at FROM users WHERE is_verified = TRUE AND mobile IS NOT NULL")
-        users = cursor.fetchall()
-
-
-        cursor.execute("""
-            SELECT 
-                user_id,
-                MAX(date) as last_active,
-                SUM(CASE WHEN type = 'expense' AND MONTH(date) = MONTH(CURDATE()) AND YEAR(date) = YEAR(CURDATE()) THEN amount ELSE 0 END) as month_total,
-                SUM(CASE WHEN type = 'expense' AND date >= DATE_SUB(CURDATE(), INTERVAL 7 DAY) THEN amount ELSE 0 END) as week_total,
-                SUM(CASE WHEN type = 'expense' AND DATE(date) = CURDATE() THEN amount ELSE 0 END) as today_total
-            FROM transactions
-            GROUP BY user_id
-        """)
-        tx_stats_raw = cursor.fetchall()
-        tx_map = {row['user_id']: row for row in tx_stats_raw}
-
-        cursor.execute("""
-            SELECT user_id, template_name, sent_at 
-            FROM automated_messages 
-            WHERE sent_at >= DATE_SUB(NOW(), INTERVAL 7 DAY)
-        """)
-        msg_history_raw = cursor.fetchall()
+            await cursor.execute("SELECT * FROM nudge_settings WHERE is_active = TRUE ORDER BY hours_min DESC")
+            active_rules = await cursor.fetchall()
+
+            await cursor.execute("SELECT id, name, mobile, created_at FROM users WHERE is_verified = TRUE AND mobile IS NOT NULL")
+            users = await cursor.fetchall()
+
+
+            await cursor.execute("SELECT user_id, MAX(date) as last_active FROM transactions GROUP BY user_id")
+            tx_map = {row['user_id']: row for row in await cursor.fetchall()}
+
+            await cursor.execute("""
+                SELECT 
+                    user_id,
+                    SUM(CASE WHEN day >= DATE_FORMAT(CURDATE(), '%Y-%m-01') THEN total ELSE 0 END) as month_total,
+                    SUM(CASE WHEN day >= DATE_SUB(CURDATE(), INTERVAL 7 DAY) THEN total ELSE 0 END) as week_total,
+                    SUM(CASE WHEN day = CURDATE() THEN total ELSE 0 END) as today_total
+                FROM user_daily_totals
+                WHERE type = 'expense' AND day >= LEAST(DATE_FORMAT(CURDATE(), '%Y-%m-01'), DATE_SUB(CURDATE(), INTERVAL 7 DAY))
+                GROUP BY user_id
+            """)
+            for row in await cursor.fetchall():
+                tx_map.setdefault(row['user_id'], {}).update(row)
+
+            await cursor.execute("""
+                SELECT user_id, template_name, sent_at 
+                FROM automated_messages 
+                WHERE sent_at >= DATE_SUB(NOW(), INTERVAL 7 DAY)
+            """)
+            msg_history_raw = await cursor.fetchall()
         
-        msg_map = {}
-        for msg in msg_history_raw:
-            uid = msg['user_id']
-            if uid not in msg_map:
-                msg_map[uid] = {'daily_count': 0, 'weekly_count': 0, 'sent_today': set()}
+            msg_map = {}
+            for msg in msg_history_raw:
+                uid = msg['user_id']
+                if uid not in msg_map:
+                    msg_map[uid] = {'daily_count': 0, 'weekly_count': 0, 'sent_today': set()}
             
-            msg_map[uid]['weekly_count'] += 1
-            if msg['sent_at'].date() == today:
-                msg_map[uid]['daily_count'] += 1
-                msg_map[uid]['sent_today'].add(msg['template_name'])
+                msg_map[uid]['weekly_count'] += 1
+                if msg['sent_at'].date() == today:
+                    msg_map[uid]['daily_count'] += 1
+                    msg_map[uid]['sent_today'].add(msg['template_name'])
 
 
-        for user in users:
-            await asyncio.sleep(0.001)
+            for user in users:
+                await asyncio.sleep(0.001)
             
-            user_id, mobile = int(user['id']), str(user['mobile'])
+                user_id, mobile = int(user['id']), str(user['mobile'])
             
-            user_tx = tx_map.get(user_id, {})
-            user_msgs = msg_map.get(user_id, {'daily_count': 0, 'weekly_count': 0, 'sent_today': set()})
+                user_tx = tx_map.get(user_id, {})
+                user_msgs = msg_map.get(user_id, {'daily_count': 0, 'weekly_count': 0, 'sent_today': set()})
                 
-            last_val = user_tx.get('last_active') or user.get('created_at')
-            has_transactions = bool(user_tx.get('last_active'))
+                last_val = user_tx.get('last_active') or user.get('created_at')
+                has_transactions = bool(user_tx.get('last_active'))
                 
-            if not last_val: continue
+                if not last_val: continue
                 
-            if isinstance(last_val, datetime): last_active = last_val
-            elif isinstance(last_val, date): last_active = datetime.combine(last_val, datetime.min.time())
-            elif isinstance(last_val, str):
-                try: last_active = datetime.strptime(last_val, '%Y-%m-%d %H:%M:%S')
-                except ValueError: last_active = datetime.strptime(last_val.split('.')[0], '%Y-%m-%d %H:%M:%S')
-            else: continue
+                if isinstance(last_val, datetime): last_active = last_val
+                elif isinstance(last_val, date): last_active = datetime.combine(last_val, datetime.min.time())
+                elif isinstance(last_val, str):
+                    try: last_active = datetime.strptime(last_val, '%Y-%m-%d %H:%M:%S')
+                    except ValueError: last_active = datetime.strptime(last_val.split('.')[0], '%Y-%m-%d %H:%M:%S')
+                else: continue
                 
-            hours_inactive = (now - last_active).total_seconds() / 3600.0
+                hours_inactive = (now - last_active).total_seconds() / 3600.0
 
-            daily_limit_reached = user_msgs['daily_count'] >= 1
-            weekly_limit_reached = user_msgs['weekly_count'] >= 3
-            month_total = float(user_tx.get('month_total') or 0.0)
+                daily_limit_reached = user_msgs['daily_count'] >= 1
+                weekly_limit_reached = user_msgs['weekly_count'] >= 3
+                month_total = float(user_tx.get('month_total') or 0.0)
 
-            template_to_send, trigger_reason, dynamic_vars_string = None, "", ""
+                template_to_send, trigger_reason, dynamic_vars_string = None, "", ""
 
-            for rule in active_rules:
-                if target_rule != "all" and target_rule != rule['rule_name']: continue
+                for rule in active_rules:
+                    if target_rule != "all" and target_rule != rule['rule_name']: continue
                 
-                template_name = rule['template_name']
+                    template_name = rule['template_name']
                 
-                # Check memory if already sent today
-                if template_name in user_msgs['sent_today']:
-                    continue
+                    # Check memory if already sent today
+                    if template_name in user_msgs['sent_today']:
+                        continue
                 
-                var_req = rule.get('variables_required') or ""
-                rule_type = rule.get('rule_type', 'inactivity')
+                    var_req = rule.get('variables_required') or ""
+                    rule_type = rule.get('rule_type', 'inactivity')
                 
-                try:
-                    time_str = str(rule.get('schedule_time', '10:00'))
-                    target_hour = int(time_str.split(':')[0])
-                    target_minute = int(time_str.split(':')[1]) if ':' in time_str else 0
-                except:
-                    target_hour, target_minute = 10, 0
-
-                target_mins = (target_hour * 60) + target_minute
-                now_mins = (now.hour * 60) + now.minute
+                    try:
+                        time_str = str(rule.get('schedule_time', '10:00'))
+                        target_hour = int(time_str.split(':')[0])
+                        target_minute = int(time_str.split(':')[1]) if ':' in time_str else 0
+                    except:
+                        target_hour, target_minute = 10, 0
+
+                    target_mins = (target_hour * 60) + target_minute
+                    now_mins = (now.hour * 60) + now.minute
                 
-                time_diff = now_mins - target_mins
-                if time_diff < 0: time_diff += 24 * 60 
-                is_time_match = 0 <= time_diff < 30
-
-                if rule_type == 'monthly':
-                    try: target_day = int(rule.get('schedule_day', last_day_of_month))
-                    except: target_day = last_day_of_month
-                    is_target_day = (current_day_num == target_day) or (target_day >= last_day_of_month and current_day_num == last_day_of_month)
+                    time_diff = now_mins - target_mins
+                    if time_diff < 0: time_diff += 24 * 60 
+                    is_time_match = 0 <= time_diff < 30
+
+                    if rule_type == 'monthly':
+                        try: target_day = int(rule.get('schedule_day', last_day_of_month))
+                        except: target_day = last_day_of_month
+                        is_target_day = (current_day_num == target_day) or (target_day >= last_day_of_month and current_day_num == last_day_of_month)
                     
-                    if is_target_day and is_time_match:
-                        try:
-                            await handle_monthly_request(mobile, is_end_of_month=True, template_name=template_name)
-                            cursor.execute("INSERT INTO automated_messages (user_id, template_name, trigger_reason, sent_at) VALUES (%s, %s, %s, NOW())", (user_id, template_name, rule['rule_name']))
-                            conn.commit()
-                            logger.info(f"Fired {template_name} (Monthly) to User {user_id}")
-                        except Exception as e:
-                            logger.error(f"Failed to send {template_name} to User {user_id}: {e}")
-                            conn.rollback()
-                        break
+                        if is_target_day and is_time_match:
+                            planned.append((user_id, mobile, template_name, rule['rule_name'], None))
+                            break
                         
-                elif rule_type == 'weekly':
-                    if current_day_name == rule.get('schedule_day', 'Monday') and is_time_match:
-                        template_to_send, trigger_reason, dynamic_vars_string = template_name, rule['rule_name'], var_req
-                        break
+                    elif rule_type == 'weekly':
+                        if current_day_name == rule.get('schedule_day', 'Monday') and is_time_match:
+                            template_to_send, trigger_reason, dynamic_vars_string = template_name, rule['rule_name'], var_req
+                            break
                 
-                elif rule_type == 'daily':
-                    if is_time_match:
-                        template_to_send, trigger_reason, dynamic_vars_string = template_name, rule['rule_name'], var_req
-                        break
+                    elif rule_type == 'daily':
+                        if is_time_match:
+                            template_to_send, trigger_reason, dynamic_vars_string = template_name, rule['rule_name'], var_req
+                            break
                 
-                if hours_inactive > 200 or hours_inactive <= 0: continue
-
-                if rule_type == 'onboarding' and not has_transactions:
-                    if rule['hours_min'] <= hours_inactive < rule['hours_max']:
-                        if not rule['bypass_limits'] and (daily_limit_reached or weekly_limit_reached): continue
-                        template_to_send, trigger_reason, dynamic_vars_string = template_name, rule['rule_name'], var_req
-                        break
-
-                elif rule_type == 'inactivity':
-                    if rule['hours_min'] <= hours_inactive < rule['hours_max']:
-                        if not rule['bypass_limits'] and (daily_limit_reached or weekly_limit_reached): continue
-                        template_to_send, trigger_reason, dynamic_vars_string = template_name, rule['rule_name'], var_req
-                        break
-
-            # Execute sending logic if a rule matched
-            if template_to_send:
-                variables_payload = []
-                raw_vars = dynamic_vars_string.replace('[', '').replace(']', '').strip()
+                    if hours_inactive > 200 or hours_inactive <= 0: continue
+
+                    if rule_type == 'onboarding' and not has_transactions:
+                        if rule['hours_min'] <= hours_inactive < rule['hours_max']:
+                            if not rule['bypass_limits'] and (daily_limit_reached or weekly_limit_reached): continue
+                            template_to_send, trigger_reason, dynamic_vars_string = template_name, rule['rule_name'], var_req
+                            break
+
+                    elif rule_type == 'inactivity':
+                        if rule['hours_min'] <= hours_inactive < rule['hours_max']:
+                            if not rule['bypass_limits'] and (daily_limit_reached or weekly_limit_reached): continue
+                            template_to_send, trigger_reason, dynamic_vars_string = template_name, rule['rule_name'], var_req
+                            break
+
+                # Execute sending logic if a rule matched
+                if template_to_send:
+                    variables_payload = []
+                    raw_vars = dynamic_vars_string.replace('[', '').replace(']', '').strip()
                 
-                if raw_vars:
-                    var_keys = [v.strip() for v in raw_vars.split(',') if v.strip()]
-                    for v_key in var_keys:
-                        if v_key == 'user_name': variables_payload.append(str(user.get('name', '')))
-                        elif v_key == 'month_total': variables_payload.append(f"{month_total:g}")
-                        elif v_key == 'avg_per_day': variables_payload.append(f"{(month_total / today.day if today.day > 0 else 0):.0f}")
+                    if raw_vars:
+                        var_keys = [v.strip() for v in raw_vars.split(',') if v.strip()]
+                        for v_key in var_keys:
+                            if v_key == 'user_name': variables_payload.append(str(user.get('name', '')))
+                            elif v_key == 'month_total': variables_payload.append(f"{month_total:g}")
+                            elif v_key == 'avg_per_day': variables_payload.append(f"{(month_total / today.day if today.day > 0 else 0):.0f}")
                         
-                        elif v_key == 'week_total': variables_payload.append(f"{(float(user_tx.get('week_total') or 0.0)):g}")
-                        elif v_key == 'today_total': variables_payload.append(f"{(float(user_tx.get('today_total') or 0.0)):g}")
+                            elif v_key == 'week_total': variables_payload.append(f"{(float(user_tx.get('week_total') or 0.0)):g}")
+                            elif v_key == 'today_total': variables_payload.append(f"{(float(user_tx.get('today_total') or 0.0)):g}")
                         
-                        elif v_key == 'top_category':
-                            cursor.execute("SELECT c.name FROM transactions t JOIN categories c ON t.category_id = c.id WHERE t.user_id = %s AND t.type = 'expense' AND t.date >= DATE_SUB(CURDATE(), INTERVAL 7 DAY) GROUP BY c.name ORDER BY SUM(t.amount) DESC LIMIT 1", (user_id,))
-                            c_row = cursor.fetchone()
-                            variables_payload.append(str(c_row['name']) if c_row else "Various")
-                        elif v_key == 'top_category_amount':
-                            cursor.execute("SELECT SUM(t.amount) as total FROM transactions t JOIN categories c ON t.category_id = c.id WHERE t.user_id = %s AND t.type = 'expense' AND t.date >= DATE_SUB(CURDATE(), INTERVAL 7 DAY) GROUP BY c.name ORDER BY total DESC LIMIT 1", (user_id,))
-                            c_row = cursor.fetchone()
-                            variables_payload.append(f"{(float(c_row['total']) if c_row and c_row.get('total') is not None else 0.0):g}")
-                        elif v_key == 'last_category':
-                            cursor.execute("SELECT c.name FROM transactions t JOIN categories c ON t.category_id = c.id WHERE t.user_id = %s ORDER BY t.date DESC LIMIT 1", (user_id,))
-                            c_row = cursor.fetchone()
-                            variables_payload.append(str(c_row['name']) if c_row else "Various")
-                        else:
-                            variables_payload.append("")
+                            elif v_key == 'top_category':
+                                await cursor.execute("SELECT c.name FROM user_daily_totals d JOIN categories c ON d.category_id = c.id WHERE d.user_id = %s AND d.type = 'expense' AND d.day >= DATE_SUB(CURDATE(), INTERVAL 7 DAY) GROUP BY c.name ORDER BY SUM(d.total) DESC LIMIT 1", (user_id,))
+                                c_row = await cursor.fetchone()
+                                variables_payload.append(str(c_row['name']) if c_row else "Various")
+                            elif v_key == 'top_category_amount':
+                                await cursor.execute("SELECT SUM(d.total) as total FROM user_daily_totals d JOIN categories c ON d.category_id = c.id WHERE d.user_id = %s AND d.type = 'expense' AND d.day >= DATE_SUB(CURDATE(), INTERVAL 7 DAY) GROUP BY c.name ORDER BY total DESC LIMIT 1", (user_id,))
+                                c_row = await cursor.fetchone()
+                                variables_payload.append(f"{(float(c_row['total']) if c_row and c_row.get('total') is not None else 0.0):g}")
+                            elif v_key == 'last_category':
+                                await cursor.execute("SELECT c.name FROM transactions t JOIN categories c ON t.category_id = c.id WHERE t.user_id = %s ORDER BY t.date DESC LIMIT 1", (user_id,))
+                                c_row = await cursor.fetchone()
+                                variables_payload.append(str(c_row['name']) if c_row else "Various")
+                            else:
+                                variables_payload.append("")
                             
-                try:
-                    await send_whatsapp_template(mobile, template_to_send, variables_payload)
-                    cursor.execute("INSERT INTO automated_messages (user_id, template_name, trigger_reason, sent_at) VALUES (%s, %s, %s, NOW())", (user_id, template_to_send, trigger_reason))
-                    conn.commit()
-                    logger.info(f"Fired {template_to_send} to User {user_id}")
-                except Exception as e:
-                    logger.error(f"Failed to send {template_to_send} to User {user_id}: {e}")
-                    conn.rollback()
+                    planned.append((user_id, mobile, template_to_send, trigger_reason, variables_payload))
+
+        for user_id, mobile, template_name, trigger_reason, variables_payload in planned:
+            try:
+                if variables_payload is None:
+                    await handle_monthly_request(mobile, is_end_of_month=True, template_name=template_name, lane=LANE_BULK)
+                else:
+                    await send_whatsapp_template(mobile, template_name, variables_payload, lane=LANE_BULK)
+                await record_nudge(user_id, template_name, trigger_reason)
+                logger.info(f"Fired {template_name}{' (Monthly)' if variables_payload is None else ''} to User {user_id}")
+            except Exception as e:
+                logger.error(f"Failed to send {template_name} to User {user_id}: {e}")
 
     except Exception as e: 
+        outcome = "error"
         logger.error(f"Nudge Engine Error: {e}")
     finally:
-        conn.close()
         logger.info("Nudge Engine Evaluation Complete.")
+        nudge_run_duration.observe(time.monotonic() - started, outcome=outcome)
         
         try:
-            settings_conn = get_db()
-            settings_cursor = settings_conn.cursor()
-            
-            now_str = now.strftime('%Y-%m-%d %H:%M:%S')
-            
-            settings_cursor.execute("""
-                INSERT INTO system_settings (setting_key, setting_value) 
-                VALUES ('last_cron_run', %s) 
-                ON DUPLICATE KEY UPDATE setting_value = %s
-            """, (now_str, now_str))
-            
-            settings_conn.commit()
-            settings_conn.close()
+            async with db() as settings_conn:
+                settings_cursor = await settings_conn.cursor()
+                
+                now_str = now.strftime('%Y-%m-%d %H:%M:%S')
+                
+                await settings_cursor.execute("""
+                    INSERT INTO system_settings (setting_key, setting_value) 
+                    VALUES ('last_cron_run', %s) 
+                    ON DUPLICATE KEY UPDATE setting_value = %s
+                """, (now_str, now_str))
+                
+                await settings_conn.commit()
         except Exception as log_e:
             logger.error(f"Failed to save last_cron_run state: {log_e}")
\ No newline at end of file
@@ -1,13 +1,27 @@
 import mysql.connector
-from mysql.connector import pooling
+import mysql.connector.aio
+from mysql.connector import pooling, errors
 import os
+import sys
+import time
+import asyncio
+import threading
+import traceback
+import contextlib
+from itertools import islice
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
+from telemetry import registry
 import logging
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Run by the client on every (re)connect, so session settings survive pool
+# reuse and server-side reconnects without a per-checkout round trip.
+SESSION_INIT_SQL = "SET time_zone = '+05:30'"
+
 db_config = {
     "host": os.getenv("DB_HOST"),
     "user": os.getenv("DB_USER"),
@@ -17,14 +31,168 @@ db_config = {
     "ssl_verify_cert": False,
     "ssl_verify_identity": False,
     "ssl_ca": "/etc/ssl/certs/ca-certificates.crt",
-    "ssl_disabled": False
+    "ssl_disabled": False,
+    "init_command": SESSION_INIT_SQL
+}
+
+read_db_config = {
+    **db_config,
+    "host": os.getenv("DB_READ_HOST") or db_config["host"],
+    "user": os.getenv("DB_READ_USER") or db_config["user"],
+    "password": os.getenv("DB_READ_PASSWORD") or db_config["password"],
+    "port": int(os.getenv("DB_READ_PORT", db_config["port"]))
 }
 
+ASYNC_POOL_SIZE = int(os.getenv("DB_ASYNC_POOL_SIZE", 20))
+READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", 10))
+ASYNC_ACQUIRE_TIMEOUT_SECONDS = float(os.getenv("DB_ASYNC_ACQUIRE_TIMEOUT_SECONDS", 10))
+# Assumed replica lag when it cannot be measured (no REPLICATION CLIENT grant,
+# or a managed reader endpoint that reports no replica status), the lag above
+# which reads stop going to the replica, and how often lag is re-measured.
+REPLICA_LAG_WINDOW_SECONDS = float(os.getenv("DB_REPLICA_LAG_WINDOW_SECONDS", 5))
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", 30))
+REPLICA_LAG_PROBE_SECONDS = float(os.getenv("DB_REPLICA_LAG_PROBE_SECONDS", 2))
+
+LEAK_THRESHOLD_SECONDS = float(os.getenv("DB_LEAK_THRESHOLD_SECONDS", 30))
+
+_INTERNAL_FILES = {__file__, contextlib.__file__}
+
+def _call_site():
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_code.co_filename in _INTERNAL_FILES:
+        frame = frame.f_back
+    if frame is None:
+        return "unknown", ()
+    # Plain (filename, lineno, name) tuples taken now: a held frame would report
+    # its current line, lose f_back once it returns, and pin the caller's locals.
+    stack = tuple((f.f_code.co_filename, lineno, f.f_code.co_name) for f, lineno in islice(traceback.walk_stack(frame), 8))
+    return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}", stack
+
+def _format_stack(stack) -> list:
+    # Only called for slow holds and leak reports; source lines are read here, not at checkout.
+    return traceback.format_list([traceback.FrameSummary(*entry) for entry in reversed(stack)])
+
+class PoolMonitor:
+    """
+    Checkout telemetry for one pool: wait time to get a connection, hold time
+    per acquiring call site, in-use/idle gauges, and connections held longer
+    than LEAK_THRESHOLD_SECONDS together with the stack of the acquiring call,
+    formatted only when such a hold is reported.
+    """
+    def __init__(self, name: str, pool_size: int):
+        self.name = name
+        self.pool_size = pool_size
+        self._lock = threading.Lock()
+        self._active: dict = {}
+        self._sites: dict = {}
+        self.checkouts = 0
+        self.failures = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+
+    def checked_out(self, key, wait_ms: float):
+        site, stack = _call_site()
+        with self._lock:
+            self._active[key] = (time.monotonic(), site, stack)
+            self.checkouts += 1
+            self.total_wait_ms += wait_ms
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+
+    def checkout_failed(self):
+        with self._lock:
+            self.failures += 1
+
+    def released(self, key):
+        with self._lock:
+            entry = self._active.pop(key, None)
+            if entry is None:
+                return
+            started, site, stack = entry
+            hold_ms = (time.monotonic() - started) * 1000
+            stats = self._sites.setdefault(site, {"checkouts": 0, "total_hold_ms": 0.0, "max_hold_ms": 0.0})
+            stats["checkouts"] += 1
+            stats["total_hold_ms"] += hold_ms
+            stats["max_hold_ms"] = max(stats["max_hold_ms"], hold_ms)
+
+        if hold_ms > LEAK_THRESHOLD_SECONDS * 1000:
+            logger.warning(
+                f"DB Pool [{self.name}]: connection held {hold_ms / 1000:.1f}s by {site}\n"
+                + "".join(_format_stack(stack))
+            )
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            active = list(self._active.values())
+            sites = {k: dict(v) for k, v in self._sites.items()}
+            checkouts, failures = self.checkouts, self.failures
+            total_wait_ms, max_wait_ms = self.total_wait_ms, self.max_wait_ms
+
+        leaks = [
+            {"call_site": site, "held_seconds": round(now - started, 1), "stack": _format_stack(stack)}
+            for started, site, stack in active
+            if now - started > LEAK_THRESHOLD_SECONDS
+        ]
+        call_sites = [
+            {
+                "call_site": site,
+                "checkouts": v["checkouts"],
+                "avg_hold_ms": round(v["total_hold_ms"] / v["checkouts"], 2),
+                "max_hold_ms": round(v["max_hold_ms"], 2)
+            }
+            for site, v in sorted(sites.items(), key=lambda item: item[1]["total_hold_ms"], reverse=True)
+        ]
+        return {
+            "pool": self.name,
+            "size": self.pool_size,
+            "in_use": len(active),
+            "idle": max(self.pool_size - len(active), 0),
+            "checkouts": checkouts,
+            "failures": failures,
+            "avg_wait_ms": round(total_wait_ms / checkouts, 2) if checkouts else 0,
+            "max_wait_ms": round(max_wait_ms, 2),
+            "call_sites": call_sites,
+            "leaks": leaks
+        }
+
+class SessionPool(pooling.MySQLConnectionPool):
+    """
+    MySQLConnectionPool that keeps session state across checkouts instead of
+    resetting it on every return. Session settings come from init_command in
+    db_config; any open transaction is rolled back when a connection comes back
+    to the pool.
+    """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.monitor = PoolMonitor(self.pool_name, self.pool_size)
+
+    def add_connection(self, cnx=None):
+        if cnx is not None:
+            self.monitor.released(id(cnx))
+            try:
+                if cnx.unread_result:
+                    cnx.consume_results()
+                if cnx.in_transaction:
+                    cnx.rollback()
+            except Exception as e:
+                logger.warning(f"DB Pool: failed to clean returned connection: {e}")
+        super().add_connection(cnx)
+
+    def get_connection(self):
+        started = time.monotonic()
+        try:
+            conn = super().get_connection()
+        except Exception:
+            self.monitor.checkout_failed()
+            raise
+        self.monitor.checked_out(id(conn._cnx), (time.monotonic() - started) * 1000)
+        return conn
+
 try:
-    connection_pool = mysql.connector.pooling.MySQLConnectionPool(
+    connection_pool = SessionPool(
         pool_name="sidenote_pool",
         pool_size=20,
-        pool_reset_session=True,
+        pool_reset_session=False,
         **db_config
     )
     logger.info("Database connection pool created successfully.")
@@ -32,14 +200,224 @@ except Exception as e:
     logger.error(f"Failed to create database connection pool: {e}")
     raise e
 
-def get_db():
+read_pool = connection_pool
+if os.getenv("DB_READ_HOST"):
     try:
-        conn = connection_pool.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SET time_zone = '+05:30'")
-        cursor.close()
-        
-        return conn
+        read_pool = SessionPool(
+            pool_name="sidenote_read_pool",
+            pool_size=READ_POOL_SIZE,
+            pool_reset_session=False,
+            **read_db_config
+        )
+        logger.info("Read replica connection pool created successfully.")
+    except Exception as e:
+        logger.error(f"Failed to create read replica pool, reads will use the primary: {e}")
+
+class ReplicaLagProbe:
+    """
+    Replica lag as reported by the replica itself (Seconds_Behind_Source),
+    re-measured at most every REPLICA_LAG_PROBE_SECONDS and shared by every
+    thread in the process. seconds() is None when replication is stopped.
+    """
+    def __init__(self, pool, interval: float, fallback: float):
+        self.pool = pool
+        self.interval = interval
+        self.fallback = fallback
+        self._lag = fallback
+        self._measured_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def _measure(self):
+        conn = self.pool.get_connection()
+        try:
+            cursor = conn.cursor(dictionary=True)
+            try:
+                cursor.execute("SHOW REPLICA STATUS")
+            except errors.ProgrammingError:
+                cursor.execute("SHOW SLAVE STATUS")  # MySQL < 8.0.22
+            row = cursor.fetchone()
+            cursor.close()
+        finally:
+            conn.close()
+        if not row:
+            return self.fallback
+        lag = row.get("Seconds_Behind_Source", row.get("Seconds_Behind_Master"))
+        return float(lag) if lag is not None else None
+
+    def seconds(self):
+        if time.monotonic() - self._measured_at < self.interval:
+            return self._lag
+        if not self._lock.acquire(blocking=False):
+            return self._lag  # another thread is measuring; use the last value
+        try:
+            try:
+                self._lag = self._measure()
+            except Exception as e:
+                logger.warning(f"Replica lag probe failed, assuming {self.fallback:g}s: {e}")
+                self._lag = self.fallback
+            self._measured_at = time.monotonic()
+            return self._lag
+        finally:
+            self._lock.release()
+
+replica_lag = ReplicaLagProbe(read_pool, REPLICA_LAG_PROBE_SECONDS, REPLICA_LAG_WINDOW_SECONDS)
+
+# Per-user time of the last committed write to transactions, goals or the
+# daily rollup, kept on the primary so every worker sees it. Written inside the
+# same transaction as the change it marks.
+MARK_WRITE_SQL = """
+    INSERT INTO user_write_marks (user_id, written_at) VALUES (%s, NOW(3))
+    ON DUPLICATE KEY UPDATE written_at = NOW(3)
+"""
+WRITE_AGE_SQL = "SELECT TIMESTAMPDIFF(MICROSECOND, written_at, NOW(3)) / 1000000 FROM user_write_marks WHERE user_id = %s"
+
+def mark_user_write(cursor, user_id):
+    """Call before commit on any write a user's replica reads would otherwise miss."""
+    if user_id is None or read_pool is connection_pool:
+        return
+    cursor.execute(MARK_WRITE_SQL, (user_id,))
+
+async def mark_user_write_async(cursor, user_id):
+    if user_id is None or read_pool is connection_pool:
+        return
+    await cursor.execute(MARK_WRITE_SQL, (user_id,))
+
+def get_db(readonly: bool = False, user_id=None):
+    """
+    Checks out a pooled connection. readonly=True routes to the read replica
+    (when DB_READ_HOST is configured) while its measured lag is under
+    REPLICA_MAX_LAG_SECONDS, unless user_id's last marked write may not have
+    replicated yet. If the replica is unavailable the primary is used instead.
+    """
+    if readonly and read_pool is not connection_pool:
+        lag = replica_lag.seconds()
+        if lag is not None and lag <= REPLICA_MAX_LAG_SECONDS:
+            if user_id is not None:
+                # The write mark lives on the primary; if the user is pinned the
+                # connection used to check it serves the read as well.
+                conn = _primary_connection()
+                cursor = conn.cursor()
+                cursor.execute(WRITE_AGE_SQL, (user_id,))
+                row = cursor.fetchone()
+                cursor.close()
+                if row and row[0] is not None and float(row[0]) < lag + 1:
+                    return conn
+                conn.close()
+            try:
+                return read_pool.get_connection()
+            except Exception as e:
+                logger.warning(f"Read replica unavailable, falling back to primary: {e}")
+    return _primary_connection()
+
+def _primary_connection():
+    try:
+        return connection_pool.get_connection()
     except Exception as e:
         logger.error(f"DB Pool Exhaustion Error: {e}")
-        raise e
\ No newline at end of file
+        raise e
+
+class AsyncConnectionPool:
+    """
+    Fixed-size pool of mysql.connector.aio connections for coroutine code paths.
+    Each slot starts as an empty token; connections are opened lazily the first
+    time a slot is handed out and re-opened if the server dropped them. Like the
+    sync pool, a checkout that cannot get a slot within acquire_timeout raises
+    PoolError instead of queueing forever.
+    """
+    def __init__(self, pool_size: int, acquire_timeout: float, **config):
+        self.pool_size = pool_size
+        self.acquire_timeout = acquire_timeout
+        self._config = config
+        self._slots: asyncio.LifoQueue = asyncio.LifoQueue()
+        for _ in range(pool_size):
+            self._slots.put_nowait(None)
+        self.monitor = PoolMonitor("sidenote_async_pool", pool_size)
+
+    async def _open(self):
+        return await mysql.connector.aio.connect(**self._config)
+
+    async def _discard(self, conn):
+        try: await conn.close()
+        except Exception: pass
+
+    async def acquire(self):
+        started = time.monotonic()
+        try:
+            conn = await asyncio.wait_for(self._slots.get(), timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.monitor.checkout_failed()
+            logger.error(f"Async DB Pool Exhaustion: no connection free after {self.acquire_timeout:g}s")
+            raise errors.PoolError(f"Failed getting connection; async pool exhausted after {self.acquire_timeout:g}s")
+        try:
+            if conn is not None and not await conn.is_connected():
+                await self._discard(conn)
+                conn = None
+            if conn is None:
+                conn = await self._open()
+            self.monitor.checked_out(id(conn), (time.monotonic() - started) * 1000)
+            return conn
+        except Exception as e:
+            self._slots.put_nowait(None)
+            self.monitor.checkout_failed()
+            logger.error(f"Async DB Pool Error: {e}")
+            raise e
+
+    async def release(self, conn):
+        self.monitor.released(id(conn))
+        try:
+            if conn.in_transaction:
+                await conn.rollback()
+            self._slots.put_nowait(conn)
+        except Exception:
+            await self._discard(conn)
+            self._slots.put_nowait(None)
+
+async_pool = AsyncConnectionPool(ASYNC_POOL_SIZE, ASYNC_ACQUIRE_TIMEOUT_SECONDS, **db_config)
+
+@asynccontextmanager
+async def db():
+    """
+    Async counterpart of get_db() for handlers running on the event loop:
+
+        async with db() as conn:
+            cursor = await conn.cursor(dictionary=True)
+            await cursor.execute(...)
+
+    Any transaction left open when the block exits is rolled back before the
+    connection goes back to the pool. Do not send WhatsApp messages or open a
+    nested db() while holding the connection; queue sends on an outbox()
+    (whatsapp_service) so they go out after it is released.
+    """
+    conn = await async_pool.acquire()
+    try:
+        yield conn
+    finally:
+        await async_pool.release(conn)
+
+def _pool_monitors() -> list[PoolMonitor]:
+    monitors = [connection_pool.monitor, async_pool.monitor]
+    if read_pool is not connection_pool:
+        monitors.append(read_pool.monitor)
+    return monitors
+
+registry.gauge_callback(
+    "sidenote_db_pool_connections", "Pooled DB connections by state.", ("pool", "state"),
+    lambda: [((m.name, state), n) for m in _pool_monitors() for state, n in (("in_use", len(m._active)), ("idle", max(m.pool_size - len(m._active), 0)))]
+)
+registry.counter_callback(
+    "sidenote_db_pool_checkouts", "Connection checkouts by outcome.", ("pool", "outcome"),
+    lambda: [((m.name, outcome), n) for m in _pool_monitors() for outcome, n in (("ok", m.checkouts), ("failed", m.failures))]
+)
+registry.counter_callback(
+    "sidenote_db_pool_wait_seconds", "Total time spent waiting for a pooled connection.", ("pool",),
+    lambda: [((m.name,), m.total_wait_ms / 1000) for m in _pool_monitors()]
+)
+
+def pool_stats() -> dict:
+    stats = {
+        "sync": connection_pool.monitor.snapshot(),
+        "async": async_pool.monitor.snapshot()
+    }
+    if read_pool is not connection_pool:
+        stats["read"] = read_pool.monitor.snapshot()
+    return stats
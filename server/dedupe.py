@@ -0,0 +1,109 @@
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+from database import db
+
+logger = logging.getLogger(__name__)
+
+DEDUPE_BACKEND = os.getenv("DEDUPE_BACKEND", "mysql").lower()
+DEDUPE_TTL_SECONDS = float(os.getenv("DEDUPE_TTL_SECONDS", 600))
+DEDUPE_MAX_ENTRIES = int(os.getenv("DEDUPE_MAX_ENTRIES", 50000))
+PRUNE_EVERY_CLAIMS = 500
+
+class LocalDedupe:
+    """
+    Per-process seen-set. Ids sit in insertion order with their claim time, so
+    expiry only ever pops from the front: amortized O(1) per claim, and never
+    more than max_entries ids held.
+    """
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._seen: OrderedDict[str, float] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float):
+        while self._seen:
+            oldest, claimed_at = next(iter(self._seen.items()))
+            if now - claimed_at <= self.ttl and len(self._seen) <= self.max_entries:
+                break
+            del self._seen[oldest]
+
+    def seen(self, message_id: str) -> bool:
+        with self._lock:
+            self._expire(time.monotonic())
+            return message_id in self._seen
+
+    def claim(self, message_id: str) -> bool:
+        """True when this is the first claim of message_id within the TTL."""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            if message_id in self._seen:
+                return False
+            self._seen[message_id] = now
+            return True
+
+class MySQLDedupe:
+    """
+    Cross-worker dedupe backed by the processed_messages primary key: the
+    INSERT IGNORE that lands the row wins the claim. A LocalDedupe in front
+    answers repeats seen by this worker without a round trip.
+    """
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.local = LocalDedupe(ttl, max_entries)
+        self._claims = 0
+
+    async def seen(self, message_id: str) -> bool:
+        if self.local.seen(message_id):
+            return True
+        try:
+            async with db() as conn:
+                cursor = await conn.cursor()
+                await cursor.execute(
+                    "SELECT 1 FROM processed_messages WHERE message_id = %s AND claimed_at >= NOW() - INTERVAL %s SECOND",
+                    (message_id, int(self.ttl))
+                )
+                return await cursor.fetchone() is not None
+        except Exception as e:
+            logger.warning(f"Dedupe store unavailable, using local state: {e}")
+            return False
+
+    async def claim(self, message_id: str) -> bool:
+        if self.local.seen(message_id):
+            return False
+        try:
+            async with db() as conn:
+                cursor = await conn.cursor()
+                await cursor.execute("INSERT IGNORE INTO processed_messages (message_id) VALUES (%s)", (message_id,))
+                claimed = cursor.rowcount == 1
+                self._claims += 1
+                if self._claims % PRUNE_EVERY_CLAIMS == 0:
+                    await cursor.execute(
+                        "DELETE FROM processed_messages WHERE claimed_at < NOW() - INTERVAL %s SECOND LIMIT 5000",
+                        (int(self.ttl),)
+                    )
+                await conn.commit()
+        except Exception as e:
+            logger.warning(f"Dedupe store unavailable, using local state: {e}")
+            return self.local.claim(message_id)
+
+        self.local.claim(message_id)
+        return claimed
+
+class MemoryDedupe:
+    def __init__(self, ttl: float, max_entries: int):
+        self.local = LocalDedupe(ttl, max_entries)
+
+    async def seen(self, message_id: str) -> bool:
+        return self.local.seen(message_id)
+
+    async def claim(self, message_id: str) -> bool:
+        return self.local.claim(message_id)
+
+BACKENDS = {"mysql": MySQLDedupe, "memory": MemoryDedupe}
+
+dedupe = BACKENDS.get(DEDUPE_BACKEND, MySQLDedupe)(DEDUPE_TTL_SECONDS, DEDUPE_MAX_ENTRIES)
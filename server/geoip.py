@@ -0,0 +1,264 @@
+import os
+import io
+import csv
+import gzip
+import mmap
+import struct
+import logging
+import tempfile
+import threading
+import ipaddress
+from bisect import bisect_right
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Local IP range -> country lookups for the geo block. The source is a
+# "start_ip,end_ip,country_code" CSV (e.g. the monthly DB-IP "IP to Country
+# Lite" download, optionally .gz). It is compiled once into a compact binary
+# file next to it (or built explicitly with `python geoip.py build in.csv out.bin`),
+# which is memory-mapped and binary searched, so lookups never leave the process.
+GEOIP_DB_PATH = os.getenv("GEOIP_DB_PATH", os.path.join(os.path.dirname(__file__), "data", "geoip.csv.gz"))
+
+MAGIC = b"SNGEOIP1"
+HEADER = struct.Struct(">8sIIH")
+FAMILIES = ((4, 4), (6, 16))  # (ip version, key width in bytes)
+
+# ISO 3166 alpha-2 -> (country name as reported by ipwho.is, lowercased; calling code)
+COUNTRIES = {
+    "AD": ("andorra", "376"), "AE": ("united arab emirates", "971"), "AF": ("afghanistan", "93"),
+    "AG": ("antigua and barbuda", "1"), "AI": ("anguilla", "1"), "AL": ("albania", "355"),
+    "AM": ("armenia", "374"), "AO": ("angola", "244"), "AR": ("argentina", "54"),
+    "AS": ("american samoa", "1"), "AT": ("austria", "43"), "AU": ("australia", "61"),
+    "AW": ("aruba", "297"), "AX": ("aland islands", "358"), "AZ": ("azerbaijan", "994"),
+    "BA": ("bosnia and herzegovina", "387"), "BB": ("barbados", "1"), "BD": ("bangladesh", "880"),
+    "BE": ("belgium", "32"), "BF": ("burkina faso", "226"), "BG": ("bulgaria", "359"),
+    "BH": ("bahrain", "973"), "BI": ("burundi", "257"), "BJ": ("benin", "229"),
+    "BL": ("saint barthelemy", "590"), "BM": ("bermuda", "1"), "BN": ("brunei", "673"),
+    "BO": ("bolivia", "591"), "BQ": ("bonaire, sint eustatius and saba", "599"), "BR": ("brazil", "55"),
+    "BS": ("bahamas", "1"), "BT": ("bhutan", "975"), "BW": ("botswana", "267"),
+    "BY": ("belarus", "375"), "BZ": ("belize", "501"), "CA": ("canada", "1"),
+    "CD": ("dr congo", "243"), "CF": ("central african republic", "236"), "CG": ("congo", "242"),
+    "CH": ("switzerland", "41"), "CI": ("ivory coast", "225"), "CK": ("cook islands", "682"),
+    "CL": ("chile", "56"), "CM": ("cameroon", "237"), "CN": ("china", "86"),
+    "CO": ("colombia", "57"), "CR": ("costa rica", "506"), "CU": ("cuba", "53"),
+    "CV": ("cape verde", "238"), "CW": ("curacao", "599"), "CY": ("cyprus", "357"),
+    "CZ": ("czechia", "420"), "DE": ("germany", "49"), "DJ": ("djibouti", "253"),
+    "DK": ("denmark", "45"), "DM": ("dominica", "1"), "DO": ("dominican republic", "1"),
+    "DZ": ("algeria", "213"), "EC": ("ecuador", "593"), "EE": ("estonia", "372"),
+    "EG": ("egypt", "20"), "ER": ("eritrea", "291"), "ES": ("spain", "34"),
+    "ET": ("ethiopia", "251"), "FI": ("finland", "358"), "FJ": ("fiji", "679"),
+    "FK": ("falkland islands", "500"), "FM": ("micronesia", "691"), "FO": ("faroe islands", "298"),
+    "FR": ("france", "33"), "GA": ("gabon", "241"), "GB": ("united kingdom", "44"),
+    "GD": ("grenada", "1"), "GE": ("georgia", "995"), "GF": ("french guiana", "594"),
+    "GG": ("guernsey", "44"), "GH": ("ghana", "233"), "GI": ("gibraltar", "350"),
+    "GL": ("greenland", "299"), "GM": ("gambia", "220"), "GN": ("guinea", "224"),
+    "GP": ("guadeloupe", "590"), "GQ": ("equatorial guinea", "240"), "GR": ("greece", "30"),
+    "GT": ("guatemala", "502"), "GU": ("guam", "1"), "GW": ("guinea-bissau", "245"),
+    "GY": ("guyana", "592"), "HK": ("hong kong", "852"), "HN": ("honduras", "504"),
+    "HR": ("croatia", "385"), "HT": ("haiti", "509"), "HU": ("hungary", "36"),
+    "ID": ("indonesia", "62"), "IE": ("ireland", "353"), "IL": ("israel", "972"),
+    "IM": ("isle of man", "44"), "IN": ("india", "91"), "IQ": ("iraq", "964"),
+    "IR": ("iran", "98"), "IS": ("iceland", "354"), "IT": ("italy", "39"),
+    "JE": ("jersey", "44"), "JM": ("jamaica", "1"), "JO": ("jordan", "962"),
+    "JP": ("japan", "81"), "KE": ("kenya", "254"), "KG": ("kyrgyzstan", "996"),
+    "KH": ("cambodia", "855"), "KI": ("kiribati", "686"), "KM": ("comoros", "269"),
+    "KN": ("saint kitts and nevis", "1"), "KP": ("north korea", "850"), "KR": ("south korea", "82"),
+    "KW": ("kuwait", "965"), "KY": ("cayman islands", "1"), "KZ": ("kazakhstan", "7"),
+    "LA": ("laos", "856"), "LB": ("lebanon", "961"), "LC": ("saint lucia", "1"),
+    "LI": ("liechtenstein", "423"), "LK": ("sri lanka", "94"), "LR": ("liberia", "231"),
+    "LS": ("lesotho", "266"), "LT": ("lithuania", "370"), "LU": ("luxembourg", "352"),
+    "LV": ("latvia", "371"), "LY": ("libya", "218"), "MA": ("morocco", "212"),
+    "MC": ("monaco", "377"), "MD": ("moldova", "373"), "ME": ("montenegro", "382"),
+    "MF": ("saint martin", "590"), "MG": ("madagascar", "261"), "MH": ("marshall islands", "692"),
+    "MK": ("north macedonia", "389"), "ML": ("mali", "223"), "MM": ("myanmar", "95"),
+    "MN": ("mongolia", "976"), "MO": ("macao", "853"), "MP": ("northern mariana islands", "1"),
+    "MQ": ("martinique", "596"), "MR": ("mauritania", "222"), "MS": ("montserrat", "1"),
+    "MT": ("malta", "356"), "MU": ("mauritius", "230"), "MV": ("maldives", "960"),
+    "MW": ("malawi", "265"), "MX": ("mexico", "52"), "MY": ("malaysia", "60"),
+    "MZ": ("mozambique", "258"), "NA": ("namibia", "264"), "NC": ("new caledonia", "687"),
+    "NE": ("niger", "227"), "NF": ("norfolk island", "672"), "NG": ("nigeria", "234"),
+    "NI": ("nicaragua", "505"), "NL": ("netherlands", "31"), "NO": ("norway", "47"),
+    "NP": ("nepal", "977"), "NR": ("nauru", "674"), "NU": ("niue", "683"),
+    "NZ": ("new zealand", "64"), "OM": ("oman", "968"), "PA": ("panama", "507"),
+    "PE": ("peru", "51"), "PF": ("french polynesia", "689"), "PG": ("papua new guinea", "675"),
+    "PH": ("philippines", "63"), "PK": ("pakistan", "92"), "PL": ("poland", "48"),
+    "PM": ("saint pierre and miquelon", "508"), "PR": ("puerto rico", "1"), "PS": ("palestine", "970"),
+    "PT": ("portugal", "351"), "PW": ("palau", "680"), "PY": ("paraguay", "595"),
+    "QA": ("qatar", "974"), "RE": ("reunion", "262"), "RO": ("romania", "40"),
+    "RS": ("serbia", "381"), "RU": ("russia", "7"), "RW": ("rwanda", "250"),
+    "SA": ("saudi arabia", "966"), "SB": ("solomon islands", "677"), "SC": ("seychelles", "248"),
+    "SD": ("sudan", "249"), "SE": ("sweden", "46"), "SG": ("singapore", "65"),
+    "SI": ("slovenia", "386"), "SK": ("slovakia", "421"), "SL": ("sierra leone", "232"),
+    "SM": ("san marino", "378"), "SN": ("senegal", "221"), "SO": ("somalia", "252"),
+    "SR": ("suriname", "597"), "SS": ("south sudan", "211"), "ST": ("sao tome and principe", "239"),
+    "SV": ("el salvador", "503"), "SX": ("sint maarten", "1"), "SY": ("syria", "963"),
+    "SZ": ("eswatini", "268"), "TC": ("turks and caicos islands", "1"), "TD": ("chad", "235"),
+    "TG": ("togo", "228"), "TH": ("thailand", "66"), "TJ": ("tajikistan", "992"),
+    "TL": ("timor-leste", "670"), "TM": ("turkmenistan", "993"), "TN": ("tunisia", "216"),
+    "TO": ("tonga", "676"), "TR": ("turkey", "90"), "TT": ("trinidad and tobago", "1"),
+    "TV": ("tuvalu", "688"), "TW": ("taiwan", "886"), "TZ": ("tanzania", "255"),
+    "UA": ("ukraine", "380"), "UG": ("uganda", "256"), "US": ("united states", "1"),
+    "UY": ("uruguay", "598"), "UZ": ("uzbekistan", "998"), "VA": ("vatican city", "39"),
+    "VC": ("saint vincent and the grenadines", "1"), "VE": ("venezuela", "58"), "VG": ("british virgin islands", "1"),
+    "VI": ("u.s. virgin islands", "1"), "VN": ("vietnam", "84"), "VU": ("vanuatu", "678"),
+    "WF": ("wallis and futuna", "681"), "WS": ("samoa", "685"), "XK": ("kosovo", "383"),
+    "YE": ("yemen", "967"), "YT": ("mayotte", "262"), "ZA": ("south africa", "27"),
+    "ZM": ("zambia", "260"), "ZW": ("zimbabwe", "263"),
+}
+
+def _parse_ip(value: str) -> tuple[int, int]:
+    """(version, integer) for a dotted/colon address or a decimal integer column."""
+    value = value.strip()
+    if value.isdigit():
+        number = int(value)
+        return (4 if number < 2 ** 32 else 6), number
+    address = ipaddress.ip_address(value)
+    return address.version, int(address)
+
+def build(source_path: str, target_path: str) -> int:
+    """Compiles a range CSV into the binary lookup file. Returns the number of ranges written."""
+    ranges: dict[int, list] = {4: [], 6: []}
+    codes: list[str] = []
+    code_index: dict[str, int] = {}
+    opener = gzip.open if source_path.endswith(".gz") else open
+    with opener(source_path, "rt", encoding="utf-8", newline="") as f:
+        for row in csv.reader(f):
+            if len(row) < 3 or not row[2].strip() or row[2].strip() in ("-", "ZZ"):
+                continue
+            try:
+                version, start = _parse_ip(row[0])
+                _, end = _parse_ip(row[1])
+            except ValueError:
+                continue  # header line or garbage
+            code = row[2].strip().upper()
+            if code not in code_index:
+                code_index[code] = len(codes)
+                codes.append(code)
+            ranges[version].append((start, end, code_index[code]))
+
+    out = io.BytesIO()
+    out.write(HEADER.pack(MAGIC, len(ranges[4]), len(ranges[6]), len(codes)))
+    out.write("".join(codes).encode("ascii"))
+    for version, width in FAMILIES:
+        rows = sorted(ranges[version])
+        out.write(b"".join(start.to_bytes(width, "big") for start, _, _ in rows))
+        out.write(b"".join(end.to_bytes(width, "big") for _, end, _ in rows))
+        out.write(b"".join(struct.pack(">H", idx) for _, _, idx in rows))
+
+    # Every worker may compile at startup; each writes its own temp file in the
+    # target directory, so os.replace only ever publishes a complete file.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(target_path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(out.getvalue())
+        os.chmod(tmp_path, 0o644)  # mkstemp creates 0600
+        os.replace(tmp_path, target_path)
+    except BaseException:
+        try: os.unlink(tmp_path)
+        except OSError: pass
+        raise
+    return len(ranges[4]) + len(ranges[6])
+
+class _Column:
+    """Fixed-width big-endian keys inside the mapped file, as a sequence bisect can search."""
+    def __init__(self, buf, offset: int, count: int, width: int):
+        self.buf = buf
+        self.offset = offset
+        self.count = count
+        self.width = width
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i: int) -> bytes:
+        start = self.offset + i * self.width
+        return self.buf[start:start + self.width]
+
+class GeoIPDatabase:
+    """
+    Read-only view over a compiled range file. Per IP family there are three
+    parallel columns (range starts, range ends, country index) sorted by start;
+    a lookup is one bisect over the starts plus an end check, straight off the
+    memory map, so the file is shared between workers via the page cache.
+    """
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, v4_count, v6_count, country_count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a compiled GeoIP file")
+        offset = HEADER.size
+        self.codes = [self._map[offset + 2 * i:offset + 2 * i + 2].decode("ascii") for i in range(country_count)]
+        offset += 2 * country_count
+        self.tables = {}
+        for (version, width), count in zip(FAMILIES, (v4_count, v6_count)):
+            starts = _Column(self._map, offset, count, width)
+            ends = _Column(self._map, offset + count * width, count, width)
+            indexes = _Column(self._map, offset + 2 * count * width, count, 2)
+            self.tables[version] = (starts, ends, indexes, width)
+            offset += count * (2 * width + 2)
+        self.size = v4_count + v6_count
+
+    def country_code(self, ip: str) -> Optional[str]:
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        starts, ends, indexes, width = self.tables[address.version]
+        key = int(address).to_bytes(width, "big")
+        i = bisect_right(starts, key) - 1
+        if i < 0 or ends[i] < key:
+            return None
+        return self.codes[int.from_bytes(indexes[i], "big")]
+
+    def lookup(self, ip: str) -> Optional[dict]:
+        """Same shape as the ipwho.is result in utils.fetch_geoip_data, or None if the IP is not covered."""
+        info = COUNTRIES.get(self.country_code(ip) or "")
+        if info is None:
+            return None
+        return {"country_name": info[0], "calling_code": info[1]}
+
+_lock = threading.Lock()
+_db: Optional[GeoIPDatabase] = None
+_load_attempted = False
+
+def _compiled_path(path: str) -> str:
+    if path.endswith((".csv", ".csv.gz")):
+        compiled = path[:-len(".csv.gz")] if path.endswith(".gz") else path[:-len(".csv")]
+        compiled += ".bin"
+        if not os.path.exists(compiled) or os.path.getmtime(compiled) < os.path.getmtime(path):
+            count = build(path, compiled)
+            logger.info(f"Compiled {count} GeoIP ranges from {path} into {compiled}")
+        return compiled
+    return path
+
+def get_database() -> Optional[GeoIPDatabase]:
+    """Opens GEOIP_DB_PATH on first use. Returns None when no database is installed."""
+    global _db, _load_attempted
+    if _load_attempted:
+        return _db
+    with _lock:
+        if not _load_attempted:
+            try:
+                if os.path.exists(GEOIP_DB_PATH):
+                    _db = GeoIPDatabase(_compiled_path(GEOIP_DB_PATH))
+                    logger.info(f"GeoIP database loaded: {_db.size} ranges from {GEOIP_DB_PATH}")
+                else:
+                    logger.warning(f"No GeoIP database at {GEOIP_DB_PATH}; geo checks will use the remote lookup.")
+            except Exception as e:
+                logger.error(f"Failed to load GeoIP database {GEOIP_DB_PATH}: {e}")
+            _load_attempted = True
+    return _db
+
+def lookup(ip: str) -> Optional[dict]:
+    database = get_database()
+    return database.lookup(ip) if database else None
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) != 4 or sys.argv[1] != "build":
+        sys.exit("usage: python geoip.py build <ranges.csv[.gz]> <output.bin>")
+    print(f"Wrote {build(sys.argv[2], sys.argv[3])} ranges to {sys.argv[3]}")
@@ -0,0 +1,242 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Optional
+from database import db
+from telemetry import registry
+
+logger = logging.getLogger(__name__)
+
+INBOUND_WORKERS = int(os.getenv("INBOUND_WORKERS", 4))
+INBOUND_MAX_DEPTH = int(os.getenv("INBOUND_MAX_DEPTH", 5000))
+INBOUND_MAX_ATTEMPTS = int(os.getenv("INBOUND_MAX_ATTEMPTS", 5))
+INBOUND_RETRY_BASE_SECONDS = float(os.getenv("INBOUND_RETRY_BASE_SECONDS", 2))
+INBOUND_RETRY_MAX_SECONDS = float(os.getenv("INBOUND_RETRY_MAX_SECONDS", 300))
+INBOUND_VISIBILITY_TIMEOUT_SECONDS = int(os.getenv("INBOUND_VISIBILITY_TIMEOUT_SECONDS", 300))
+INBOUND_RETENTION_HOURS = int(os.getenv("INBOUND_RETENTION_HOURS", 24))
+# A running job refreshes locked_at this often, so only jobs whose worker has
+# actually gone away cross the visibility timeout and get requeued.
+HEARTBEAT_SECONDS = max(INBOUND_VISIBILITY_TIMEOUT_SECONDS / 3, 1.0)
+IDLE_POLL_SECONDS = 1.0
+MAINTENANCE_EVERY_SECONDS = 30.0
+
+# Oldest runnable job whose sender has nothing earlier still pending or in
+# flight, so each sender's messages are handled one at a time and in order.
+CLAIM_SQL = """
+    SELECT j.id, j.message_id, j.sender_phone, j.sender_name, j.payload, j.attempts
+    FROM inbound_jobs j
+    WHERE j.status = 'pending' AND j.available_at <= NOW(3)
+      AND NOT EXISTS (
+          SELECT 1 FROM inbound_jobs p
+          WHERE p.sender_phone = j.sender_phone AND p.status IN ('pending', 'processing') AND p.id < j.id
+      )
+    ORDER BY j.id
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED
+"""
+
+class QueueFull(Exception):
+    pass
+
+class InboundQueue:
+    """
+    MySQL-backed queue between the webhook and the message router. Failed jobs
+    are retried with exponential backoff and moved to 'dead' after
+    INBOUND_MAX_ATTEMPTS; jobs whose worker stopped heartbeating for the
+    visibility timeout (it died mid-job) are put back to 'pending'. A retry
+    re-runs the whole handler, so its writes must be keyed on message_id.
+    """
+    def __init__(self, workers: int, max_depth: int):
+        self.workers = workers
+        self.max_depth = max_depth
+        self.depth = 0
+        self.processed = 0
+        self.failed = 0
+        self.dead_lettered = 0
+        self._wakeup = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+        self._handler: Optional[Callable[..., Awaitable[Any]]] = None
+        self._last_maintenance = 0.0
+
+    def is_saturated(self) -> bool:
+        return self.depth >= self.max_depth
+
+    async def enqueue(self, message: dict, sender_phone: str, message_id: Optional[str], sender_name: str) -> bool:
+        """Persists a message for the workers. Returns False when message_id is already queued."""
+        return await self.enqueue_many([(message, sender_phone, message_id, sender_name)]) == 1
+
+    async def enqueue_many(self, jobs: list[tuple[dict, str, Optional[str], str]]) -> int:
+        """Batch enqueue() for (message, sender_phone, message_id, sender_name) tuples in one round trip."""
+        if self.is_saturated():
+            raise QueueFull(f"inbound queue depth {self.depth} >= {self.max_depth}")
+        async with db() as conn:
+            cursor = await conn.cursor()
+            await cursor.executemany(
+                "INSERT IGNORE INTO inbound_jobs (message_id, sender_phone, sender_name, payload) VALUES (%s, %s, %s, %s)",
+                [(message_id, sender_phone, sender_name, json.dumps(message)) for message, sender_phone, message_id, sender_name in jobs]
+            )
+            queued = max(cursor.rowcount, 0)
+            await conn.commit()
+        if queued:
+            self.depth += queued
+            self._wakeup.set()
+        return queued
+
+    def start(self, handler: Callable[..., Awaitable[Any]]):
+        self._handler = handler
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info(f"Inbound queue started with {self.workers} workers.")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _claim(self) -> Optional[tuple]:
+        async with db() as conn:
+            cursor = await conn.cursor()
+            await cursor.execute(CLAIM_SQL)
+            row = await cursor.fetchone()
+            if row is None:
+                await conn.rollback()
+                return None
+            await cursor.execute(
+                "UPDATE inbound_jobs SET status = 'processing', attempts = attempts + 1, locked_at = NOW(3) WHERE id = %s",
+                (row[0],)
+            )
+            await conn.commit()
+            return tuple(row)
+
+    async def _heartbeat(self, job_id: int, attempts: int):
+        while True:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            try:
+                async with db() as conn:
+                    cursor = await conn.cursor()
+                    await cursor.execute(
+                        "UPDATE inbound_jobs SET locked_at = NOW(3) WHERE id = %s AND status = 'processing' AND attempts = %s",
+                        (job_id, attempts)
+                    )
+                    await conn.commit()
+            except Exception as e:
+                logger.warning(f"Inbound job {job_id} heartbeat failed: {e}")
+
+    async def _finish(self, job_id: int, attempts: int, error: Optional[Exception]):
+        # Matching on attempts means a worker whose job was requeued and claimed
+        # again elsewhere cannot overwrite the newer attempt's state.
+        async with db() as conn:
+            cursor = await conn.cursor()
+            if error is None:
+                await cursor.execute(
+                    "UPDATE inbound_jobs SET status = 'done', finished_at = NOW(3), last_error = NULL WHERE id = %s AND attempts = %s",
+                    (job_id, attempts)
+                )
+            elif attempts >= INBOUND_MAX_ATTEMPTS:
+                await cursor.execute(
+                    "UPDATE inbound_jobs SET status = 'dead', finished_at = NOW(3), last_error = %s WHERE id = %s AND attempts = %s",
+                    (repr(error)[:2000], job_id, attempts)
+                )
+            else:
+                delay = min(INBOUND_RETRY_BASE_SECONDS * (2 ** (attempts - 1)), INBOUND_RETRY_MAX_SECONDS)
+                await cursor.execute(
+                    "UPDATE inbound_jobs SET status = 'pending', available_at = NOW(3) + INTERVAL %s SECOND, last_error = %s WHERE id = %s AND attempts = %s",
+                    (delay, repr(error)[:2000], job_id, attempts)
+                )
+            await conn.commit()
+
+    async def _maintain(self):
+        now = time.monotonic()
+        if now - self._last_maintenance < MAINTENANCE_EVERY_SECONDS:
+            return
+        self._last_maintenance = now
+        async with db() as conn:
+            cursor = await conn.cursor()
+            await cursor.execute(
+                "UPDATE inbound_jobs SET status = 'pending' WHERE status = 'processing' AND locked_at < NOW(3) - INTERVAL %s SECOND",
+                (INBOUND_VISIBILITY_TIMEOUT_SECONDS,)
+            )
+            if cursor.rowcount:
+                logger.warning(f"Inbound queue: requeued {cursor.rowcount} stalled jobs.")
+            await cursor.execute(
+                "DELETE FROM inbound_jobs WHERE status = 'done' AND finished_at < NOW(3) - INTERVAL %s HOUR LIMIT 5000",
+                (INBOUND_RETENTION_HOURS,)
+            )
+            await cursor.execute("SELECT COUNT(*) FROM inbound_jobs WHERE status IN ('pending', 'processing')")
+            self.depth = int((await cursor.fetchone())[0])
+            await conn.commit()
+
+    async def _worker(self, worker_id: int):
+        while True:
+            try:
+                await self._maintain()
+                job = await self._claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Inbound worker {worker_id} claim error: {e}")
+                await asyncio.sleep(IDLE_POLL_SECONDS)
+                continue
+
+            if job is None:
+                self._wakeup.clear()
+                try: await asyncio.wait_for(self._wakeup.wait(), timeout=IDLE_POLL_SECONDS)
+                except asyncio.TimeoutError: pass
+                continue
+
+            job_id, message_id, sender_phone, sender_name, payload, attempts = job
+            attempts += 1
+            error = None
+            heartbeat = asyncio.create_task(self._heartbeat(job_id, attempts))
+            try:
+                await self._handler(json.loads(payload), sender_phone, message_id, sender_name)
+                self.processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = e
+                self.failed += 1
+                if attempts >= INBOUND_MAX_ATTEMPTS: self.dead_lettered += 1
+                logger.error(f"Inbound job {job_id} failed (attempt {attempts}): {e}")
+            finally:
+                heartbeat.cancel()
+
+            try:
+                await self._finish(job_id, attempts, error)
+                if error is None or attempts >= INBOUND_MAX_ATTEMPTS:
+                    self.depth = max(self.depth - 1, 0)
+            except Exception as e:
+                logger.error(f"Inbound worker {worker_id} could not record job {job_id}: {e}")
+
+    async def stats(self) -> dict:
+        async with db() as conn:
+            cursor = await conn.cursor()
+            await cursor.execute("""
+                SELECT status, COUNT(*), TIMESTAMPDIFF(MICROSECOND, MIN(created_at), NOW(3)) / 1000000
+                FROM inbound_jobs
+                WHERE status IN ('pending', 'processing', 'dead')
+                GROUP BY status
+            """)
+            rows = await cursor.fetchall()
+        by_status = {status: (int(count), float(age or 0)) for status, count, age in rows}
+        return {
+            "workers": len(self._tasks),
+            "pending": by_status.get("pending", (0, 0))[0],
+            "processing": by_status.get("processing", (0, 0))[0],
+            "dead": by_status.get("dead", (0, 0))[0],
+            "lag_seconds": round(by_status.get("pending", (0, 0.0))[1], 3),
+            "max_depth": self.max_depth,
+            "processed": self.processed,
+            "failed": self.failed,
+            "dead_lettered": self.dead_lettered
+        }
+
+inbound_queue = InboundQueue(INBOUND_WORKERS, INBOUND_MAX_DEPTH)
+
+registry.gauge_callback("sidenote_inbound_queue_depth", "Inbound webhook jobs pending or in flight.", (), lambda: [((), inbound_queue.depth)])
+registry.counter_callback(
+    "sidenote_inbound_jobs", "Inbound webhook jobs handled by this worker, by outcome.", ("outcome",),
+    lambda: [(("processed",), inbound_queue.processed), (("failed",), inbound_queue.failed), (("dead",), inbound_queue.dead_lettered)]
+)
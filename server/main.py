@@ -3,7 +3,7 @@ from fastapi import FastAPI, APIRouter, Depends, Query, HTTPException, Response,
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 import logging, json, os, hmac, hashlib, threading, time
-from database import get_db
+from database import get_db, db
 from routers import auth, transactions, features, analytics, admin, groups, help
 from bot_handlers import process_whatsapp_text, process_whatsapp_interactive, process_whatsapp_image, process_whatsapp_audio
 from security import get_current_user, verify_meta_signature
@@ -12,12 +12,19 @@ from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from cron_nudges import run_daily_nudges
 from pydantic import BaseModel
 from typing import Optional
-from starlette.background import BackgroundTask
 from zoneinfo import ZoneInfo
-from utils import is_country_allowed, get_client_ip, fetch_geoip_data, get_allowed_countries_from_db 
+from utils import is_country_allowed_async, get_client_ip, fetch_geoip_data, get_allowed_countries_from_db 
 from db_init import initialize_database
+from user_directory import user_directory
+from inbound_queue import inbound_queue
+from write_buffer import WriteBuffer
+from api_metrics import api_metrics
+from telemetry import registry, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from whatsapp_handlers.bot_utils import is_duplicate, claim_message
+from webhook_payload import split_webhook_payload
+import geoip
+from throttle import throttle
 
-blocked_notified_cache = {}
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 ist_timezone = ZoneInfo('Asia/Kolkata')
@@ -35,6 +42,7 @@ app = FastAPI(
 
 VERIFY_TOKEN = os.getenv("WA_WEBHOOK_VERIFY_TOKEN")
 META_APP_SECRET = os.getenv("META_APP_SECRET", "").strip()
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "").strip()
 
 # CORS Setup
 origins = [
@@ -64,6 +72,12 @@ app.include_router(help.router)
 def health_check():
     return {"status": "ok", "message": "API is running"}
 
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics(request: Request):
+    if METRICS_TOKEN and not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return Response(content=registry.render(), media_type=METRICS_CONTENT_TYPE)
+
 @app.on_event("startup")
 def startup_db_init():
     logger.info("Application starting up. Checking database schema...")
@@ -104,19 +118,54 @@ def start_scheduler():
     scheduler.start()
     app.state.scheduler = scheduler
 
+@app.on_event("startup")
+def load_geoip_database():
+    geoip.get_database()
+
+@app.on_event("startup")
+async def start_inbound_workers():
+    inbound_queue.start(process_incoming_message)
+    webhook_event_buffer.start()
+    message_status_buffer.start()
+    api_metrics.start()
+
+@app.on_event("shutdown")
+async def stop_inbound_workers():
+    await inbound_queue.stop()
+    await webhook_event_buffer.stop()
+    await message_status_buffer.stop()
+    await api_metrics.stop()
+
 
 async def process_incoming_message(message: dict, sender_phone: str, message_id: Optional[str], sender_name: str):
-    log_inbound_message(message, sender_phone, message_id)
-    conn = get_db()
-    cursor = conn.cursor(dictionary=True)
+    await log_inbound_message(message, sender_phone, message_id)
     
     try:
-        if not is_country_allowed(sender_phone, cursor):
+        # Decide under the connection, send after it is released: the sends and
+        # the throttle check below each need their own pool slot.
+        consent_reply = None
+        async with db() as conn:
+            cursor = await conn.cursor(dictionary=True)
+            allowed = await is_country_allowed_async(sender_phone, cursor)
+            user = await user_directory.get(sender_phone, cursor) if allowed else None
+        
+            if user and not user.get('has_consented'):
+                consent_reply = "prompt"
+                if message.get("type") == "interactive":
+                    button_id = message["interactive"]["button_reply"]["id"]
+                
+                    if button_id == "accept_tnc":
+                        await cursor.execute("UPDATE users SET has_consented = TRUE WHERE id = %s", (user['id'],))
+                        await conn.commit()
+                        user_directory.invalidate(phone=sender_phone)
+                        consent_reply = "accepted"
+                    elif button_id == "decline_tnc":
+                        consent_reply = "declined"
+
+        if not allowed:
             print(f"🚫 Geo-Blocked: Message from unauthorized country code ({sender_phone})")
-            
-            current_time = time.time()
-            last_notified_time = blocked_notified_cache.get(sender_phone, 0)
-            if current_time - last_notified_time > 86400:
+        
+            if await throttle.acquire("geo_block_notice", sender_phone, 86400):
                 block_msg = (
                     "⚠️ *Service Unavailable*\n\n"
                     f"Hi {sender_name}, thank you for your interest! "
@@ -124,42 +173,26 @@ async def process_incoming_message(message: dict, sender_phone: str, message_id:
                     "We hope to expand to your country soon! 🌍"
                 )
                 await send_whatsapp_text(sender_phone, block_msg)
-                
-                blocked_notified_cache[sender_phone] = current_time
                 print(f"📤 Sent rejection notice to {sender_phone}")
             else:
                 print(f"🤫 Silently dropping repeated message from {sender_phone} to save API costs.")
-                
+            
+            return
+
+        if consent_reply == "accepted":
+            await send_whatsapp_text(
+                sender_phone, 
+                "✅ *Thank you!* You have successfully accepted the updated Terms and Privacy Policy.\n\nYou can now continue logging your expenses!"
+            )
+            return
+        if consent_reply == "declined":
+            await send_whatsapp_text(
+                sender_phone, 
+                "⚠️ You must accept the updated Terms and Privacy Policy to continue using SideNote."
+            )
+        if consent_reply:
+            await send_policy_consent_prompt(sender_phone)
             return
-        cursor.execute("SELECT id, has_consented FROM users WHERE mobile = %s", (sender_phone,))
-        user = cursor.fetchone()
-        
-        if user:
-            if not user.get('has_consented'):
-                is_interactive = message.get("type") == "interactive"
-                
-                if is_interactive:
-                    button_id = message["interactive"]["button_reply"]["id"]
-                    
-                    if button_id == "accept_tnc":
-                        cursor.execute("UPDATE users SET has_consented = TRUE WHERE id = %s", (user['id'],))
-                        conn.commit()
-                        await send_whatsapp_text(
-                            sender_phone, 
-                            "✅ *Thank you!* You have successfully accepted the updated Terms and Privacy Policy.\n\nYou can now continue logging your expenses!"
-                        )
-                        return
-                        
-                    elif button_id == "decline_tnc":
-                        await send_whatsapp_text(
-                            sender_phone, 
-                            "⚠️ You must accept the updated Terms and Privacy Policy to continue using SideNote."
-                        )
-                        await send_policy_consent_prompt(sender_phone)
-                        return
-                
-                await send_policy_consent_prompt(sender_phone)
-                return
 
         if message['type'] == 'text':
             text_body = message['text']['body']
@@ -185,93 +218,103 @@ async def process_incoming_message(message: dict, sender_phone: str, message_id:
 
     except Exception as e:
         logger.error(f"Error in Master Message Router: {e}")
-    finally:
-        conn.close()
+        raise
 
-def log_inbound_message(message: dict, sender_phone: str, message_id: Optional[str]):
+async def log_inbound_message(message: dict, sender_phone: str, message_id: Optional[str]):
     if not message_id:
         return
         
-    conn = get_db()
-    cursor = conn.cursor()
     try:
-        msg_type = message.get("type", "unknown")
-        msg_body = None
+        async with db() as conn:
+            cursor = await conn.cursor()
+            msg_type = message.get("type", "unknown")
+            msg_body = None
         
-        if msg_type == "text":
-            msg_body = message.get("text", {}).get("body", "")
-        elif msg_type == "interactive":
-            interactive = message.get("interactive", {})
-            int_type = interactive.get("type", "")
-            if int_type == "button_reply":
-                msg_body = interactive.get("button_reply", {}).get("title", "")
-            elif int_type == "list_reply":
-                msg_body = interactive.get("list_reply", {}).get("title", "")
-        elif msg_type in ["image", "document", "audio", "video", "sticker"]:
-            media_data = message.get(msg_type, {})
-            msg_body = media_data.get("caption") or f"[{msg_type.upper()}]"
+            if msg_type == "text":
+                msg_body = message.get("text", {}).get("body", "")
+            elif msg_type == "interactive":
+                interactive = message.get("interactive", {})
+                int_type = interactive.get("type", "")
+                if int_type == "button_reply":
+                    msg_body = interactive.get("button_reply", {}).get("title", "")
+                elif int_type == "list_reply":
+                    msg_body = interactive.get("list_reply", {}).get("title", "")
+            elif msg_type in ["image", "document", "audio", "video", "sticker"]:
+                media_data = message.get(msg_type, {})
+                msg_body = media_data.get("caption") or f"[{msg_type.upper()}]"
             
-            media_id = media_data.get("id")
-            if media_id:
-                cursor.execute("""
-                    INSERT INTO whatsapp_media 
-                    (message_id, whatsapp_media_id, media_type, mime_type, file_name, file_size)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                """, (
-                    message_id,
-                    media_id,
-                    msg_type,
-                    media_data.get("mime_type"),
-                    media_data.get("filename"),
-                    media_data.get("file_size")
-                ))
-        elif msg_type == "location":
-            loc = message.get("location", {})
-            msg_body = f"Location: {loc.get('latitude')}, {loc.get('longitude')} ({loc.get('name', '')})"
-        elif msg_type == "contacts":
-            msg_body = "[Contact Card Shared]"
-
-        ts_raw = message.get("timestamp")
-        if ts_raw:
-            msg_time = datetime.fromtimestamp(int(ts_raw), tz=ist_timezone).strftime('%Y-%m-%d %H:%M:%S')
-        else:
-            msg_time = datetime.now(ist_timezone).strftime('%Y-%m-%d %H:%M:%S')
-
-        cursor.execute("""
-            INSERT INTO whatsapp_messages 
-            (whatsapp_message_id, phone_number, direction, message_type, message_body, status, timestamp)
-            VALUES (%s, %s, 'inbound', %s, %s, 'received', %s)
-            ON DUPLICATE KEY UPDATE
-                message_type = VALUES(message_type),
-                message_body = VALUES(message_body),
-                status = VALUES(status),
-                timestamp = VALUES(timestamp),
-                updated_at = CURRENT_TIMESTAMP
-        """, (message_id, sender_phone, msg_type, msg_body, msg_time))
-
-        conn.commit()
+                media_id = media_data.get("id")
+                if media_id:
+                    await cursor.execute("""
+                        INSERT IGNORE INTO whatsapp_media 
+                        (message_id, whatsapp_media_id, media_type, mime_type, file_name, file_size)
+                        VALUES (%s, %s, %s, %s, %s, %s)
+                    """, (
+                        message_id,
+                        media_id,
+                        msg_type,
+                        media_data.get("mime_type"),
+                        media_data.get("filename"),
+                        media_data.get("file_size")
+                    ))
+            elif msg_type == "location":
+                loc = message.get("location", {})
+                msg_body = f"Location: {loc.get('latitude')}, {loc.get('longitude')} ({loc.get('name', '')})"
+            elif msg_type == "contacts":
+                msg_body = "[Contact Card Shared]"
+
+            ts_raw = message.get("timestamp")
+            if ts_raw:
+                msg_time = datetime.fromtimestamp(int(ts_raw), tz=ist_timezone).strftime('%Y-%m-%d %H:%M:%S')
+            else:
+                msg_time = datetime.now(ist_timezone).strftime('%Y-%m-%d %H:%M:%S')
+
+            await cursor.execute("""
+                INSERT INTO whatsapp_messages 
+                (whatsapp_message_id, phone_number, direction, message_type, message_body, status, timestamp)
+                VALUES (%s, %s, 'inbound', %s, %s, 'received', %s)
+                ON DUPLICATE KEY UPDATE
+                    message_type = VALUES(message_type),
+                    message_body = VALUES(message_body),
+                    status = VALUES(status),
+                    timestamp = VALUES(timestamp),
+                    updated_at = CURRENT_TIMESTAMP
+            """, (message_id, sender_phone, msg_type, msg_body, msg_time))
+
+            await conn.commit()
     except Exception as e:
         logger.error(f"Failed to log inbound message {message_id}: {e}")
-    finally:
-        conn.close()
+
+async def write_webhook_events(cursor, rows: list):
+    await cursor.executemany(
+        "INSERT INTO whatsapp_webhook_events (event_type, payload, processing_status) VALUES (%s, %s, %s)",
+        rows
+    )
+
+async def write_message_statuses(cursor, rows: list):
+    await cursor.executemany("""
+        INSERT INTO whatsapp_messages (whatsapp_message_id, phone_number, direction, status, timestamp, error_code, error_message)
+        VALUES (%s, %s, 'outbound', %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE 
+            status = VALUES(status), 
+            timestamp = VALUES(timestamp),
+            error_code = VALUES(error_code),
+            error_message = VALUES(error_message),
+            updated_at = CURRENT_TIMESTAMP
+    """, [row[:6] for row in rows])
+    
+    await cursor.executemany("""
+        INSERT INTO whatsapp_message_events (whatsapp_message_id, status, timestamp, raw_event)
+        VALUES (%s, %s, %s, %s)
+    """, [(wamid, status, timestamp, raw_event) for wamid, _, status, timestamp, _, _, raw_event in rows])
+
+webhook_event_buffer = WriteBuffer("webhook_events", write_webhook_events)
+message_status_buffer = WriteBuffer("message_statuses", write_message_statuses)
 
 def log_webhook_event(payload_str: str):
-    conn = get_db()
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            "INSERT INTO whatsapp_webhook_events (event_type, payload, processing_status) VALUES (%s, %s, %s)",
-            ('webhook_received', payload_str, 'processed')
-        )
-        conn.commit()
-    except Exception as e:
-        logger.error(f"Failed to log webhook: {e}")
-    finally:
-        conn.close()
+    webhook_event_buffer.add(('webhook_received', payload_str, 'processed'))
 
 def process_message_status(status_dict: dict):
-    conn = get_db()
-    cursor = conn.cursor()
     try:
         wamid = status_dict.get('id')
         status = status_dict.get('status')
@@ -287,28 +330,10 @@ def process_message_status(status_dict: dict):
             err_code = err.get('code')
             err_msg = f"{err.get('title', '')} - {err.get('error_data', {}).get('details', '')}"
 
-        cursor.execute("""
-            INSERT INTO whatsapp_messages (whatsapp_message_id, phone_number, direction, status, timestamp, error_code, error_message)
-            VALUES (%s, %s, 'outbound', %s, %s, %s, %s)
-            ON DUPLICATE KEY UPDATE 
-                status = VALUES(status), 
-                timestamp = VALUES(timestamp),
-                error_code = VALUES(error_code),
-                error_message = VALUES(error_message),
-                updated_at = CURRENT_TIMESTAMP
-        """, (wamid, phone, status, timestamp, err_code, err_msg))
-        
-        cursor.execute("""
-            INSERT INTO whatsapp_message_events (whatsapp_message_id, status, timestamp, raw_event)
-            VALUES (%s, %s, %s, %s)
-        """, (wamid, status, timestamp, json.dumps(status_dict)))
-        
-        conn.commit()
+        message_status_buffer.add((wamid, phone, status, timestamp, err_code, err_msg, json.dumps(status_dict)))
     except Exception as e:
         logger.error(f"Status Processing Error: {e}")
-    finally:
-        conn.close()
-            
+
 @app.get("/webhook")
 async def verify_webhook(
     mode: str = Query(None, alias="hub.mode"),
@@ -345,33 +370,42 @@ async def receive_whatsapp_message(request: Request, background_tasks: Backgroun
 
     try:
         body = json.loads(raw_body)
-        background_tasks.add_task(log_webhook_event, raw_body.decode('utf-8'))
+        log_webhook_event(raw_body.decode('utf-8'))
         
-        entry = body.get('entry', [])[0]
-        changes = entry.get('changes', [])[0]
-        value = changes.get('value', {})
+        messages, statuses = split_webhook_payload(body)
         
-        contacts = value.get('contacts', [])
-        sender_name = contacts[0].get('profile', {}).get('name', 'WhatsApp User') if contacts else 'WhatsApp User'
-        wa_id = contacts[0].get('wa_id') if contacts else None
+        if messages and inbound_queue.is_saturated():
+            print(f"⏳ Inbound queue full, asking Meta to retry {len(messages)} messages")
+            return JSONResponse(status_code=503, content={"status": "busy"})
         
-        if 'messages' in value:
-            message = value['messages'][0]
-            sender_phone = message['from']
-            message_id = message.get('id')
-            
+        jobs = []
+        for message, sender_phone, message_id, sender_name, wa_id in messages:
             if wa_id:
                 background_tasks.add_task(update_user_wa_id, sender_phone, wa_id)
-            
-            background_tasks.add_task(process_incoming_message, message, sender_phone, message_id, sender_name)
+            if not await is_duplicate(message_id):
+                jobs.append((message, sender_phone, message_id, sender_name))
+        
+        # Claim only once the message is durable in the queue (whose unique
+        # message_id also drops concurrent redeliveries); if the enqueue fails
+        # Meta's retry must still find it unclaimed.
+        if jobs:
+            try:
+                await inbound_queue.enqueue_many(jobs)
+            except Exception as e:
+                logger.error(f"Inbound queue unavailable, processing {len(jobs)} messages inline: {e}")
+                for job in jobs:
+                    if await claim_message(job[2]):
+                        background_tasks.add_task(process_incoming_message, *job)
+            else:
+                for job in jobs:
+                    await claim_message(job[2])
 
-        elif 'statuses' in value:
-            for status in value['statuses']:
-                background_tasks.add_task(process_message_status, status)
-                
-                if status.get('status') == 'failed':
-                    errors = status.get('errors', [{}])[0]
-                    print(f"❌ META DELIVERY FAILED [Code {errors.get('code')}]: {errors.get('title')} -> {errors.get('error_data', {}).get('details')}")
+        for status in statuses:
+            process_message_status(status)
+            
+            if status.get('status') == 'failed':
+                errors = status.get('errors', [{}])[0]
+                print(f"❌ META DELIVERY FAILED [Code {errors.get('code')}]: {errors.get('title')} -> {errors.get('error_data', {}).get('details')}")
                 
     except Exception as e:
         print(f"⚠️ Webhook Processing Error: {e}")
@@ -388,32 +422,6 @@ def update_user_wa_id(mobile: str, wa_id: str):
     finally: conn.close()
 
 
-def log_api_metric(method: str, endpoint: str, duration_ms: float, status_code: int):
-    if any(endpoint.endswith(ext) for ext in ['.php', '.env', '.json', '.yml', '.yaml', '.txt', '.git']):
-        return
-        
-    if status_code == 404:
-        return
-
-    if endpoint == "/admin/metrics" or endpoint == "/": 
-        return
-        
-    conn = None
-    try:
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO api_metrics (method, endpoint, response_time_ms, status_code) VALUES (%s, %s, %s, %s)", 
-            (method, endpoint, duration_ms, status_code)
-        )
-        conn.commit()
-    except Exception as e:
-        print(f"Metrics Error: {e}")
-    finally:
-        if conn:
-            try: conn.close() 
-            except: pass
-
 @app.middleware("http")
 async def add_process_time_header(request: Request, call_next):
     start_time = time.time()
@@ -424,13 +432,7 @@ async def add_process_time_header(request: Request, call_next):
     route = request.scope.get("route")
     endpoint_pattern = route.path if route else request.url.path
     
-    response.background = BackgroundTask(
-        log_api_metric,
-        request.method,
-        endpoint_pattern,
-        process_time_ms,
-        response.status_code
-    )
+    api_metrics.record(request.method, endpoint_pattern, process_time_ms, response.status_code)
     
     return response
 
@@ -470,7 +472,7 @@ def get_user_feedback_history(user_id: int = Depends(get_current_user)):
         
 @app.middleware("http")
 async def geo_ip_block_middleware(request: Request, call_next):
-    exempt_paths = ["/", "/webhook", "/docs", "/openapi.json", "/redoc"]
+    exempt_paths = ["/", "/webhook", "/metrics", "/docs", "/openapi.json", "/redoc"]
     if request.method == "OPTIONS" or request.url.path in exempt_paths:
         return await call_next(request)
 
@@ -479,7 +481,7 @@ async def geo_ip_block_middleware(request: Request, call_next):
     geo_data = await fetch_geoip_data(client_ip)
 
     if geo_data:
-        allowed_countries = get_allowed_countries_from_db()
+        allowed_countries = await get_allowed_countries_from_db()
         country_code = geo_data.get("calling_code")
         country_name = geo_data.get("country_name")
 
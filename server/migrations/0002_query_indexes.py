@@ -0,0 +1,13 @@
+# Composite indexes for the hot per-user and per-phone lookups.
+# Built online so the webhook and dashboard keep writing while they are added;
+# the runner skips any that already exist, so a partial run can be retried.
+
+STATEMENTS = []
+
+INDEXES = [
+    ("transactions", "idx_tx_user_type_date", "user_id, type, date, amount"),
+    ("transactions", "idx_tx_user_date", "user_id, date"),
+    ("whatsapp_messages", "idx_wa_phone_dir_ts", "phone_number, direction, timestamp"),
+    ("api_metrics", "idx_api_metrics_created", "created_at"),
+    ("automated_messages", "idx_auto_msg_sent", "sent_at"),
+]
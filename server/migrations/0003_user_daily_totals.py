@@ -0,0 +1,25 @@
+# Per-user, per-day, per-category spend rollup kept current by the transaction
+# write paths (see rollups.py). category_id 0 holds uncategorised transactions.
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS user_daily_totals (
+        user_id INT NOT NULL,
+        day DATE NOT NULL,
+        category_id INT NOT NULL DEFAULT 0,
+        type ENUM('income', 'expense') NOT NULL,
+        total DECIMAL(15,2) NOT NULL DEFAULT 0,
+        count INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, day, type, category_id),
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """,
+    """
+    INSERT INTO user_daily_totals (user_id, day, category_id, type, total, count)
+    SELECT user_id, DATE(date), COALESCE(category_id, 0), type, SUM(amount), COUNT(*)
+    FROM transactions
+    WHERE user_id IS NOT NULL
+    GROUP BY user_id, DATE(date), COALESCE(category_id, 0), type
+    ON DUPLICATE KEY UPDATE total = VALUES(total), count = VALUES(count)
+    """
+]
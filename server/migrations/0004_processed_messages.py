@@ -0,0 +1,12 @@
+# Claim table for webhook message ids so every worker sees the same dedupe
+# state (see dedupe.py). Rows older than the dedupe TTL are pruned as it runs.
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS processed_messages (
+        message_id VARCHAR(128) NOT NULL PRIMARY KEY,
+        claimed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        INDEX idx_processed_claimed_at (claimed_at)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """
+]
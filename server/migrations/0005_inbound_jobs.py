@@ -0,0 +1,25 @@
+# Durable queue for inbound WhatsApp messages (see inbound_queue.py). The
+# webhook inserts a pending row and returns; workers claim rows oldest first,
+# one in flight per sender.
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS inbound_jobs (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        message_id VARCHAR(128) NULL,
+        sender_phone VARCHAR(32) NOT NULL,
+        sender_name VARCHAR(255) NULL,
+        payload LONGTEXT NOT NULL,
+        status ENUM('pending', 'processing', 'done', 'dead') NOT NULL DEFAULT 'pending',
+        attempts INT NOT NULL DEFAULT 0,
+        available_at DATETIME(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3),
+        locked_at DATETIME(3) NULL,
+        last_error TEXT NULL,
+        created_at DATETIME(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3),
+        finished_at DATETIME(3) NULL,
+        UNIQUE KEY uq_inbound_message_id (message_id),
+        INDEX idx_inbound_status_available (status, available_at),
+        INDEX idx_inbound_sender_status (sender_phone, status, id)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """
+]
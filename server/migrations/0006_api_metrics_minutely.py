@@ -0,0 +1,22 @@
+# Per-minute request rollup written by api_metrics.py in place of one
+# api_metrics row per request. le_* columns are non-cumulative latency
+# histogram buckets (upper bound in ms). Rows from several workers for the
+# same minute are summed on upsert.
+
+BUCKET_COLUMNS = ["le_5", "le_10", "le_25", "le_50", "le_100", "le_250", "le_500", "le_1000", "le_2500", "le_5000", "le_10000", "le_inf"]
+
+STATEMENTS = [
+    f"""
+    CREATE TABLE IF NOT EXISTS api_metrics_minutely (
+        bucket DATETIME NOT NULL,
+        method VARCHAR(10) NOT NULL,
+        endpoint VARCHAR(255) NOT NULL,
+        status_code INT NOT NULL,
+        count INT NOT NULL DEFAULT 0,
+        total_ms DOUBLE NOT NULL DEFAULT 0,
+        max_ms DOUBLE NOT NULL DEFAULT 0,
+        {", ".join(f"{c} INT NOT NULL DEFAULT 0" for c in BUCKET_COLUMNS)},
+        PRIMARY KEY (bucket, method, endpoint, status_code)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """
+]
@@ -0,0 +1,15 @@
+# Shared suppression windows for per-phone rate limits (see throttle.py), so
+# every worker agrees on when something was last allowed through. Expired rows
+# are pruned as the store runs.
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS throttle_windows (
+        scope VARCHAR(64) NOT NULL,
+        subject VARCHAR(128) NOT NULL,
+        expires_at DATETIME(3) NOT NULL,
+        PRIMARY KEY (scope, subject),
+        INDEX idx_throttle_expires_at (expires_at)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """
+]
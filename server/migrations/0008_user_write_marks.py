@@ -0,0 +1,11 @@
+# Last write time per user on the primary (see database.mark_user_write), so
+# any worker can tell whether a replica read could miss that user's changes.
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS user_write_marks (
+        user_id INT PRIMARY KEY,
+        written_at DATETIME(3) NOT NULL
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """
+]
@@ -0,0 +1,22 @@
+# Keys that let a retried inbound job re-run without repeating its writes:
+# transactions remember which WhatsApp message (and which line of a bulk
+# message) created them, and a media row is stored once per message. Existing
+# duplicate media rows are collapsed first so the unique key can be built.
+
+STATEMENTS = [
+    """
+    DELETE m1 FROM whatsapp_media m1
+    JOIN whatsapp_media m2
+      ON m1.message_id = m2.message_id AND m1.whatsapp_media_id = m2.whatsapp_media_id AND m1.id > m2.id
+    """
+]
+
+COLUMNS = [
+    ("transactions", "source_message_id", "VARCHAR(255) NULL"),
+    ("transactions", "source_line", "SMALLINT NULL"),
+]
+
+UNIQUE_INDEXES = [
+    ("transactions", "uq_tx_source_message", "source_message_id, source_line"),
+    ("whatsapp_media", "uq_media_message", "message_id, whatsapp_media_id"),
+]
@@ -0,0 +1,44 @@
+# Carries the per-request api_metrics history into api_metrics_minutely so the
+# admin dashboards, which only read the rollup, keep their pre-0006 data. Rows
+# are grouped by minute (created_at reads back in IST through the session
+# time zone, matching api_metrics.py) and each latency lands in the same
+# non-cumulative le_* bucket ApiMetrics.record() would pick. Minutes already
+# written by the new code are summed into, not overwritten.
+
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+BUCKET_COLUMNS = [f"le_{b}" for b in LATENCY_BUCKETS_MS] + ["le_inf"]
+
+def _bucket_sums() -> str:
+    lowers = (None,) + LATENCY_BUCKETS_MS
+    uppers = LATENCY_BUCKETS_MS + (None,)
+    sums = []
+    for lower, upper in zip(lowers, uppers):
+        conditions = [f"ms > {lower}" if lower is not None else None, f"ms <= {upper}" if upper is not None else None]
+        sums.append(f"SUM(CASE WHEN {' AND '.join(c for c in conditions if c)} THEN 1 ELSE 0 END)")
+    return ",\n        ".join(sums)
+
+STATEMENTS = [
+    f"""
+    INSERT INTO api_metrics_minutely (bucket, method, endpoint, status_code, count, total_ms, max_ms, {", ".join(BUCKET_COLUMNS)})
+    SELECT
+        minute, method, endpoint, status_code,
+        COUNT(*), SUM(ms), MAX(ms),
+        {_bucket_sums()}
+    FROM (
+        SELECT
+            DATE_FORMAT(created_at, '%Y-%m-%d %H:%i:00') AS minute,
+            COALESCE(method, '') AS method,
+            COALESCE(endpoint, '') AS endpoint,
+            COALESCE(status_code, 200) AS status_code,
+            COALESCE(response_time_ms, 0) AS ms
+        FROM api_metrics
+        WHERE created_at IS NOT NULL
+    ) legacy
+    GROUP BY minute, method, endpoint, status_code
+    ON DUPLICATE KEY UPDATE
+        count = count + VALUES(count),
+        total_ms = total_ms + VALUES(total_ms),
+        max_ms = GREATEST(max_ms, VALUES(max_ms)),
+        {", ".join(f"{c} = {c} + VALUES({c})" for c in BUCKET_COLUMNS)}
+    """
+]
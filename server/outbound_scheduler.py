@@ -0,0 +1,155 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from typing import Optional
+from telemetry import registry
+
+logger = logging.getLogger(__name__)
+
+# Messages per second we allow ourselves against the Cloud API throughput tier
+# of the business number, and how many may go out back to back after idling.
+OUTBOUND_MPS = float(os.getenv("OUTBOUND_MPS", 40))
+OUTBOUND_BURST = float(os.getenv("OUTBOUND_BURST", OUTBOUND_MPS))
+OUTBOUND_MAX_ATTEMPTS = int(os.getenv("OUTBOUND_MAX_ATTEMPTS", 4))
+OUTBOUND_BACKOFF_BASE_SECONDS = float(os.getenv("OUTBOUND_BACKOFF_BASE_SECONDS", 1.0))
+OUTBOUND_BACKOFF_MAX_SECONDS = float(os.getenv("OUTBOUND_BACKOFF_MAX_SECONDS", 60))
+RATE_WINDOW_SECONDS = 60.0
+
+# Lanes in priority order: replies to a user waiting in the chat go before
+# broadcasts, nudges and other scheduled sends.
+LANE_INTERACTIVE = "interactive"
+LANE_BULK = "bulk"
+LANES = (LANE_INTERACTIVE, LANE_BULK)
+
+# Graph API error codes: app/number throughput limits pause every sender,
+# the per-recipient pair limit only delays the one message.
+THROUGHPUT_ERROR_CODES = {4, 80007, 130429}
+PAIR_RATE_LIMIT_ERROR_CODE = 131056
+
+def retry_reason(status_code: int, body: Optional[dict]) -> Optional[str]:
+    """Why a Graph API response is worth retrying, or None if it is final."""
+    error = (body or {}).get("error") if isinstance(body, dict) else None
+    code = error.get("code") if isinstance(error, dict) else None
+    if status_code == 429 or code in THROUGHPUT_ERROR_CODES:
+        return "rate_limited"
+    if code == PAIR_RATE_LIMIT_ERROR_CODE:
+        return "pair_rate_limited"
+    if status_code >= 500:
+        return "server_error"
+    return None
+
+class OutboundScheduler:
+    """
+    Token bucket in front of the Cloud API /messages endpoint. acquire(lane)
+    returns once a send token is available; waiters are served strictly by
+    lane priority, FIFO within a lane, by a single pump task that sleeps until
+    the next token is due. A throughput rejection pauses the whole bucket so
+    every sender backs off together instead of hammering the limit.
+    """
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self._tokens = self.burst
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._waiters: dict[str, deque] = {lane: deque() for lane in LANES}
+        self._pump_task: Optional[asyncio.Task] = None
+        self._sent_at: deque = deque()
+        self.sent = {lane: 0 for lane in LANES}
+        self.retries: dict[str, int] = {}
+
+    def _take(self) -> bool:
+        now = time.monotonic()
+        if now < self._paused_until:
+            return False
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def _granted(self, lane: str):
+        now = time.monotonic()
+        self.sent[lane] += 1
+        self._sent_at.append(now)
+        while self._sent_at and self._sent_at[0] < now - RATE_WINDOW_SECONDS:
+            self._sent_at.popleft()
+
+    async def acquire(self, lane: str = LANE_INTERACTIVE):
+        if lane not in self._waiters:
+            lane = LANE_BULK
+        if not any(self._waiters.values()) and self._take():
+            self._granted(lane)
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[lane].append(future)
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        await future
+
+    async def _pump(self):
+        while True:
+            lane, waiters = next(((lane, q) for lane, q in self._waiters.items() if q), (None, None))
+            if waiters is None:
+                return
+            if waiters[0].done():  # caller cancelled while waiting
+                waiters.popleft()
+                continue
+            if self._take():
+                waiters.popleft().set_result(None)
+                self._granted(lane)
+                continue
+            now = time.monotonic()
+            await asyncio.sleep(max(self._paused_until - now, (1 - self._tokens) / self.rate, 0.001))
+
+    def backoff(self, reason: str, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Seconds to wait before retry number attempt + 1 (full jitter over an exponential cap)."""
+        self.retries[reason] = self.retries.get(reason, 0) + 1
+        delay = random.uniform(0, min(OUTBOUND_BACKOFF_BASE_SECONDS * (2 ** attempt), OUTBOUND_BACKOFF_MAX_SECONDS))
+        try: delay = max(delay, float(retry_after)) if retry_after else delay
+        except ValueError: pass
+        if reason == "rate_limited":
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        return delay
+
+    def depth(self, lane: str) -> int:
+        return sum(1 for f in self._waiters[lane] if not f.done())
+
+    def achieved_rate(self) -> float:
+        now = time.monotonic()
+        recent = sum(1 for t in self._sent_at if t >= now - RATE_WINDOW_SECONDS)
+        return recent / RATE_WINDOW_SECONDS
+
+    def stats(self) -> dict:
+        return {
+            "rate_limit_mps": self.rate,
+            "burst": self.burst,
+            "paused_for_seconds": round(max(self._paused_until - time.monotonic(), 0), 3),
+            "queued": {lane: self.depth(lane) for lane in LANES},
+            "sent": dict(self.sent),
+            "retries": dict(self.retries),
+            "achieved_mps_1m": round(self.achieved_rate(), 3)
+        }
+
+outbound_scheduler = OutboundScheduler(OUTBOUND_MPS, OUTBOUND_BURST)
+
+registry.gauge_callback(
+    "sidenote_whatsapp_outbound_queued", "Outbound messages waiting for a send token, by lane.", ("lane",),
+    lambda: [((lane,), outbound_scheduler.depth(lane)) for lane in LANES]
+)
+registry.counter_callback(
+    "sidenote_whatsapp_outbound_sent", "Outbound send tokens granted, by lane.", ("lane",),
+    lambda: [((lane,), n) for lane, n in outbound_scheduler.sent.items()]
+)
+registry.counter_callback(
+    "sidenote_whatsapp_outbound_retries", "Outbound sends retried, by reason.", ("reason",),
+    lambda: [((reason,), n) for reason, n in list(outbound_scheduler.retries.items())]
+)
+registry.gauge_callback(
+    "sidenote_whatsapp_outbound_rate", "Outbound messages per second achieved over the last minute.", (),
+    lambda: [((), outbound_scheduler.achieved_rate())]
+)
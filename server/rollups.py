@@ -0,0 +1,83 @@
+import sys
+import logging
+from database import get_db, mark_user_write
+
+logger = logging.getLogger(__name__)
+
+# user_daily_totals is maintained incrementally: every transaction insert adds
+# (+amount, +1) to its (user, day, type, category) bucket and every delete adds
+# (-amount, -1). Updates are a delete of the old row plus an insert of the new.
+# Call these inside the same DB transaction as the write they mirror.
+
+UPSERT_SQL = """
+    INSERT INTO user_daily_totals (user_id, day, category_id, type, total, count)
+    VALUES (%s, DATE(%s), %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE total = total + VALUES(total), count = count + VALUES(count)
+"""
+PRUNE_SQL = """
+    DELETE FROM user_daily_totals
+    WHERE user_id = %s AND day = DATE(%s) AND category_id = %s AND type = %s AND count <= 0
+"""
+REBUILD_SQL = """
+    INSERT INTO user_daily_totals (user_id, day, category_id, type, total, count)
+    SELECT user_id, DATE(date), COALESCE(category_id, 0), type, SUM(amount), COUNT(*)
+    FROM transactions
+    WHERE {scope}
+    GROUP BY user_id, DATE(date), COALESCE(category_id, 0), type
+"""
+
+def record_transaction(cursor, user_id, tx_date, category_id, tx_type, amount):
+    if not user_id: return
+    cursor.execute(UPSERT_SQL, (user_id, tx_date, category_id or 0, tx_type, amount, 1))
+
+def remove_transaction(cursor, user_id, tx_date, category_id, tx_type, amount):
+    if not user_id: return
+    cursor.execute(UPSERT_SQL, (user_id, tx_date, category_id or 0, tx_type, -amount, -1))
+    cursor.execute(PRUNE_SQL, (user_id, tx_date, category_id or 0, tx_type))
+
+async def record_transaction_async(cursor, user_id, tx_date, category_id, tx_type, amount):
+    if not user_id: return
+    await cursor.execute(UPSERT_SQL, (user_id, tx_date, category_id or 0, tx_type, amount, 1))
+
+async def record_transactions_async(cursor, user_id, entries):
+    """Batched record_transaction_async for (tx_date, category_id, tx_type, amount) entries; one upsert per bucket."""
+    if not user_id: return
+    buckets: dict = {}
+    for tx_date, category_id, tx_type, amount in entries:
+        key = (tx_date.date(), category_id or 0, tx_type)
+        total, count = buckets.get(key, (0, 0))
+        buckets[key] = (total + amount, count + 1)
+    if buckets:
+        await cursor.executemany(UPSERT_SQL, [(user_id, day, cat, tx_type, total, count) for (day, cat, tx_type), (total, count) in buckets.items()])
+
+async def remove_transaction_async(cursor, user_id, tx_date, category_id, tx_type, amount):
+    if not user_id: return
+    await cursor.execute(UPSERT_SQL, (user_id, tx_date, category_id or 0, tx_type, -amount, -1))
+    await cursor.execute(PRUNE_SQL, (user_id, tx_date, category_id or 0, tx_type))
+
+def rebuild_daily_totals(cursor, user_id: int | None = None):
+    """Recomputes the rollup from transactions for one user, or everyone when user_id is None."""
+    if user_id is None:
+        cursor.execute("DELETE FROM user_daily_totals")
+        cursor.execute(REBUILD_SQL.format(scope="user_id IS NOT NULL"))
+    else:
+        cursor.execute("DELETE FROM user_daily_totals WHERE user_id = %s", (user_id,))
+        cursor.execute(REBUILD_SQL.format(scope="user_id = %s"), (user_id,))
+
+def reconcile_daily_totals(user_id: int | None = None):
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        rebuild_daily_totals(cursor, user_id)
+        mark_user_write(cursor, user_id)
+        conn.commit()
+        logger.info(f"Rebuilt user_daily_totals for {'all users' if user_id is None else f'user {user_id}'}.")
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Daily totals reconcile failed: {e}")
+        raise e
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    reconcile_daily_totals(int(sys.argv[1]) if len(sys.argv) > 1 else None)
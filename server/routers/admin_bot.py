@@ -2,6 +2,7 @@ from fastapi import APIRouter, Depends, HTTPException
 from typing import Any, Optional
 from pydantic import BaseModel
 from database import get_db
+from rule_cache import rule_cache
 from security import require_admin
 import logging
 
@@ -41,6 +42,7 @@ def create_auto_reply(payload: AutoReplyPayload, admin_id: int = Depends(require
             VALUES (%s, %s, %s, %s)
         """, (payload.trigger_keywords.lower(), payload.reply_text, payload.buttons_json, payload.is_active))
         conn.commit()
+        rule_cache.bump()
         return {"message": "Auto-reply created"}
     finally:
         conn.close()
@@ -52,6 +54,7 @@ def delete_auto_reply(reply_id: int, admin_id: int = Depends(require_admin)):
     try:
         cursor.execute("DELETE FROM auto_replies WHERE id = %s", (reply_id,))
         conn.commit()
+        rule_cache.bump()
         return {"message": "Deleted"}
     finally:
         conn.close()
@@ -67,6 +70,7 @@ def update_auto_reply(reply_id: int, payload: AutoReplyPayload, admin_id: int =
             WHERE id=%s
         """, (payload.trigger_keywords.lower(), payload.reply_text, payload.buttons_json, payload.is_active, reply_id))
         conn.commit()
+        rule_cache.bump()
         return {"message": "Auto-reply updated"}
     finally:
         conn.close()
@@ -91,6 +95,7 @@ def create_global_category(payload: GlobalCategoryPayload, admin_id: int = Depen
             VALUES (%s, %s, %s, %s, %s)
         """, (payload.name, payload.type, payload.icon, payload.color, payload.keywords.lower()))
         conn.commit()
+        rule_cache.bump()
         return {"message": "Category created"}
     finally:
         conn.close()
@@ -106,6 +111,7 @@ def update_global_category(cat_id: int, payload: GlobalCategoryPayload, admin_id
             WHERE id=%s
         """, (payload.name, payload.type, payload.icon, payload.color, payload.keywords.lower(), cat_id))
         conn.commit()
+        rule_cache.bump()
         return {"message": "Category updated"}
     finally:
         conn.close()
@@ -117,6 +123,7 @@ def delete_global_category(cat_id: int, admin_id: int = Depends(require_admin)):
     try:
         cursor.execute("DELETE FROM global_categories WHERE id = %s", (cat_id,))
         conn.commit()
+        rule_cache.bump()
         return {"message": "Category deleted"}
     finally:
         conn.close()
@@ -128,7 +135,7 @@ def get_command_analytics(
     search: Optional[str] = None,
     admin_id: int = Depends(require_admin)
 ):
-    conn = get_db()
+    conn = get_db(readonly=True)
     cursor = conn.cursor(dictionary=True)
     try:
         where_clauses = ["1=1"]
@@ -1,16 +1,25 @@
 import csv
 import io
+import asyncio
+from functools import partial
 from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, File, UploadFile, Query
 from typing import Any, Optional
 from pydantic import BaseModel
 from database import get_db
 from security import require_admin
 from whatsapp_service import send_whatsapp_template, send_whatsapp_text, send_whatsapp_media, upload_whatsapp_media
+from outbound_scheduler import LANE_BULK
 import logging
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+async def deliver_broadcast(sends: list):
+    """Starts every send at once; the outbound scheduler paces them at the configured rate behind user replies."""
+    results = await asyncio.gather(*(send() for send in sends), return_exceptions=True)
+    failed = sum(1 for r in results if isinstance(r, BaseException) or (isinstance(r, dict) and r.get("status") != "success"))
+    logger.info(f"Broadcast finished: {len(sends) - failed} sent, {failed} failed.")
+
 class BroadcastPayload(BaseModel):
     message_type: str = "template"
     template_name: Optional[str] = None
@@ -125,7 +134,7 @@ def get_whatsapp_delivery_reports(
     status_filter: str = Query("failed"),
     admin_id: int = Depends(require_admin)
 ):
-    conn = get_db()
+    conn = get_db(readonly=True)
     cursor = conn.cursor(dictionary=True)
     try:
         cursor.execute("""
@@ -232,28 +241,29 @@ async def broadcast_whatsapp_message(
         if not users:
             raise HTTPException(status_code=400, detail="No active users found matching this criteria.")
         
-        queued_count = 0
+        sends = []
         for u in users:
             if isinstance(u, dict) and u.get('mobile'):
                 mobile_number = str(u['mobile'])
                 
                 if payload.message_type == "text":
-                    background_tasks.add_task(send_whatsapp_text, mobile_number, payload.message_text or "")
+                    sends.append(partial(send_whatsapp_text, mobile_number, payload.message_text or "", lane=LANE_BULK))
                 elif payload.message_type == "template":
-                    background_tasks.add_task(send_whatsapp_template, mobile_number, payload.template_name or "", payload.variables)
+                    sends.append(partial(send_whatsapp_template, mobile_number, payload.template_name or "", payload.variables, lane=LANE_BULK))
                 elif payload.message_type in ["image", "video", "audio", "document"]:
-                    background_tasks.add_task(
+                    sends.append(partial(
                         send_whatsapp_media, 
                         to_number=mobile_number, 
                         media_type=payload.message_type, 
                         media_link=payload.media_link, 
                         media_id=payload.media_id,
                         caption=payload.caption,
-                        filename=payload.filename
-                    )
-                    
-                queued_count += 1
+                        filename=payload.filename,
+                        lane=LANE_BULK
+                    ))
                     
+        queued_count = len(sends)
+        background_tasks.add_task(deliver_broadcast, sends)
         return {"message": f"Broadcast successfully queued for {queued_count} users!"}
     except Exception as e:
         logger.error(f"Broadcast Error: {e}")
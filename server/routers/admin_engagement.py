@@ -91,7 +91,7 @@ def get_user_activity_stats(
     db_sort = valid_sort.get(sort_by, "last_active_date")
     order = "ASC" if sort_order.upper() == "ASC" else "DESC"
 
-    conn = get_db()
+    conn = get_db(readonly=True)
     cursor = conn.cursor(dictionary=True)
     try:
         offset = (page - 1) * limit
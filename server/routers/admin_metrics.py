@@ -1,12 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from typing import Any, Optional
-from database import get_db
+from database import get_db, pool_stats
 from security import require_admin
+from inbound_queue import inbound_queue
+from write_buffer import buffer_stats
+from api_metrics import BUCKET_COLUMNS, latency_percentiles
+from utils import ip_geo_cache
+from outbound_scheduler import outbound_scheduler
 import logging
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+HISTOGRAM_SUMS = ", ".join(f"SUM({c}) as {c}" for c in BUCKET_COLUMNS)
+
+def _with_percentiles(row: dict) -> dict:
+    counts = [row.pop(c) for c in BUCKET_COLUMNS]
+    row.update(latency_percentiles(counts, row.get("max_ms")))
+    return row
+
 @router.get("/metrics")
 def get_system_metrics(
     start_date: Optional[str] = None,
@@ -16,19 +28,19 @@ def get_system_metrics(
     conn = get_db()
     cursor = conn.cursor(dictionary=True)
     try:
-        time_filter = "created_at >= NOW() - INTERVAL 24 HOUR"
+        time_filter = "bucket >= NOW() - INTERVAL 24 HOUR"
         params: list[Any] = []
         
         if start_date and end_date:
-            time_filter = "DATE(created_at) >= %s AND DATE(created_at) <= %s"
+            time_filter = "bucket >= %s AND bucket < %s + INTERVAL 1 DAY"
             params = [start_date, end_date]
         elif start_date:
-            time_filter = "DATE(created_at) >= %s"
+            time_filter = "bucket >= %s"
             params = [start_date]
 
         cursor.execute(f"""
-            SELECT method, endpoint, COUNT(*) as total_calls, ROUND(AVG(response_time_ms), 2) as avg_time_ms
-            FROM api_metrics 
+            SELECT method, endpoint, CAST(SUM(count) AS SIGNED) as total_calls, ROUND(SUM(total_ms) / SUM(count), 2) as avg_time_ms
+            FROM api_metrics_minutely 
             WHERE {time_filter} AND status_code = 200
             GROUP BY method, endpoint 
             ORDER BY avg_time_ms DESC LIMIT 10
@@ -36,8 +48,8 @@ def get_system_metrics(
         slowest: list[Any] = cursor.fetchall()
 
         cursor.execute(f"""
-            SELECT method, endpoint, COUNT(*) as total_calls, ROUND(AVG(response_time_ms), 2) as avg_time_ms
-            FROM api_metrics 
+            SELECT method, endpoint, CAST(SUM(count) AS SIGNED) as total_calls, ROUND(SUM(total_ms) / SUM(count), 2) as avg_time_ms
+            FROM api_metrics_minutely 
             WHERE {time_filter}
             GROUP BY method, endpoint 
             ORDER BY total_calls DESC LIMIT 10
@@ -45,8 +57,8 @@ def get_system_metrics(
         most_used: list[Any] = cursor.fetchall()
 
         cursor.execute(f"""
-            SELECT method, endpoint, status_code, COUNT(*) as error_count
-            FROM api_metrics 
+            SELECT method, endpoint, status_code, CAST(SUM(count) AS SIGNED) as error_count
+            FROM api_metrics_minutely 
             WHERE {time_filter} AND status_code >= 400
             GROUP BY method, endpoint, status_code 
             ORDER BY error_count DESC LIMIT 10
@@ -54,35 +66,117 @@ def get_system_metrics(
         errors: list[Any] = cursor.fetchall()
 
         cursor.execute(f"""
-            SELECT COUNT(*) as total_requests, ROUND(AVG(response_time_ms), 2) as global_avg_ms
-            FROM api_metrics 
+            SELECT CAST(SUM(count) AS SIGNED) as total_requests, ROUND(SUM(total_ms) / SUM(count), 2) as global_avg_ms
+            FROM api_metrics_minutely 
             WHERE {time_filter}
         """, params)
         pulse_raw: Any = cursor.fetchone()
         pulse: dict[str, Any] = pulse_raw if isinstance(pulse_raw, dict) else {"total_requests": 0, "global_avg_ms": 0}
 
+        cursor.execute(f"""
+            SELECT method, endpoint, CAST(SUM(count) AS SIGNED) as total_calls, MAX(max_ms) as max_ms, {HISTOGRAM_SUMS}
+            FROM api_metrics_minutely 
+            WHERE {time_filter}
+            GROUP BY method, endpoint
+        """, params)
+        latency_rows: list[Any] = [_with_percentiles(row) for row in cursor.fetchall()]
+        tail_latency = sorted(latency_rows, key=lambda r: r["p95"] or 0, reverse=True)[:10]
+
+        cursor.execute(f"""
+            SELECT MAX(max_ms) as max_ms, {HISTOGRAM_SUMS}
+            FROM api_metrics_minutely 
+            WHERE {time_filter}
+        """, params)
+        global_latency = _with_percentiles(cursor.fetchone() or {c: 0 for c in BUCKET_COLUMNS})
+
         return {
             "slowest": slowest, 
             "most_used": most_used, 
             "errors": errors,
+            "tail_latency": tail_latency,
             "pulse": {
                 "total_requests": pulse.get("total_requests") or 0, 
-                "average_time": pulse.get("global_avg_ms") or 0
+                "average_time": pulse.get("global_avg_ms") or 0,
+                "p50": global_latency["p50"],
+                "p95": global_latency["p95"],
+                "p99": global_latency["p99"],
+                "max": global_latency.get("max_ms") or 0
             }
         }
     except Exception as e:
         logger.error(f"Metrics Error: {e}")
-        return {"slowest": [], "most_used": [], "errors": [], "pulse": {"total_requests": 0, "average_time": 0}}
+        return {"slowest": [], "most_used": [], "errors": [], "tail_latency": [], "pulse": {"total_requests": 0, "average_time": 0}}
     finally:
         conn.close()
 
+@router.get("/metrics/latency")
+def get_latency_series(
+    endpoint: Optional[str] = None,
+    method: Optional[str] = None,
+    hours: int = Query(24, ge=1, le=168),
+    step_minutes: int = Query(5, ge=1, le=1440),
+    admin_id: int = Depends(require_admin)
+):
+    """p50/p95/p99/max per time step for one route (or all traffic) over the last `hours`."""
+    conn = get_db()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        where_clauses = ["bucket >= NOW() - INTERVAL %s HOUR"]
+        params: list[Any] = [hours]
+        if endpoint:
+            where_clauses.append("endpoint = %s")
+            params.append(endpoint)
+        if method:
+            where_clauses.append("method = %s")
+            params.append(method.upper())
+
+        step_seconds = step_minutes * 60
+        cursor.execute(f"""
+            SELECT FROM_UNIXTIME(FLOOR(UNIX_TIMESTAMP(bucket) / %s) * %s) as slot,
+                   CAST(SUM(count) AS SIGNED) as requests, MAX(max_ms) as max_ms, {HISTOGRAM_SUMS}
+            FROM api_metrics_minutely 
+            WHERE {" AND ".join(where_clauses)}
+            GROUP BY slot 
+            ORDER BY slot
+        """, [step_seconds, step_seconds] + params)
+        return {
+            "endpoint": endpoint,
+            "method": method,
+            "step_minutes": step_minutes,
+            "points": [_with_percentiles(row) for row in cursor.fetchall()]
+        }
+    finally:
+        conn.close()
+
+@router.get("/metrics/db-pool")
+def get_db_pool_metrics(admin_id: int = Depends(require_admin)):
+    return pool_stats()
+
+@router.get("/metrics/inbound-queue")
+async def get_inbound_queue_metrics(admin_id: int = Depends(require_admin)):
+    return await inbound_queue.stats()
+
+@router.get("/metrics/write-buffers")
+def get_write_buffer_metrics(admin_id: int = Depends(require_admin)):
+    return buffer_stats()
+
+@router.get("/metrics/geoip-cache")
+def get_geoip_cache_metrics(admin_id: int = Depends(require_admin)):
+    return ip_geo_cache.stats()
+
+@router.get("/metrics/outbound")
+def get_outbound_metrics(admin_id: int = Depends(require_admin)):
+    return outbound_scheduler.stats()
+
 @router.delete("/metrics")
 def truncate_metrics(start_date: str, end_date: str, admin_id: int = Depends(require_admin)):
     conn = get_db()
     cursor = conn.cursor()
     try:
-        cursor.execute("DELETE FROM api_metrics WHERE DATE(created_at) >= %s AND DATE(created_at) <= %s", (start_date, end_date))
+        cursor.execute("DELETE FROM api_metrics_minutely WHERE bucket >= %s AND bucket < %s + INTERVAL 1 DAY", (start_date, end_date))
         deleted_count = cursor.rowcount
+        cursor.execute("DELETE FROM api_metrics WHERE created_at >= %s AND created_at < %s + INTERVAL 1 DAY", (start_date, end_date))
+        deleted_count += cursor.rowcount
         conn.commit()
         return {"message": f"Successfully deleted {deleted_count} records."}
     except Exception as e:
@@ -1,6 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from typing import Any, Optional
 from database import get_db
+from user_directory import user_directory
+from country_gate import country_gate
 from security import require_admin, pwd_context
 from schemas import UserRegister, AdminUpdateUser
 import logging
@@ -140,6 +142,7 @@ def admin_delete_user(user_id: int, admin_id: int = Depends(require_admin)):
 
         cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
         conn.commit()
+        user_directory.invalidate(user_id=user_id)
         return {"message": "User and all data permanently deleted"}
     except Exception as e:
         conn.rollback()
@@ -162,6 +165,7 @@ def admin_update_user(user_id: int, data: AdminUpdateUser, admin_id: int = Depen
             cursor.execute(query, (data.name, data.email, data.mobile, data.role, user_id))
             
         conn.commit()
+        user_directory.invalidate(user_id=user_id)
         return {"message": "User updated successfully"}
     except Exception as e:
         conn.rollback()
@@ -241,6 +245,7 @@ def add_country(data: CountryPayload):
             (data.country_code.lstrip('+'), data.country_name, data.status)
         )
         conn.commit()
+        country_gate.bump()
         return {"message": "Country added successfully"}
     except Exception as e:
         conn.rollback()
@@ -259,6 +264,7 @@ def update_country(country_id: int, data: CountryPayload):
             WHERE id = %s
         """, (data.country_code.lstrip('+'), data.country_name, data.status, country_id))
         conn.commit()
+        country_gate.bump()
         return {"message": "Country updated successfully"}
     finally:
         conn.close()
@@ -270,6 +276,7 @@ def delete_country(country_id: int):
     try:
         cursor.execute("DELETE FROM allowed_countries WHERE id = %s", (country_id,))
         conn.commit()
+        country_gate.bump()
         return {"message": "Country removed successfully"}
     finally:
         conn.close()
\ No newline at end of file
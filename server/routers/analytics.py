@@ -1,8 +1,8 @@
 from fastapi import APIRouter, HTTPException, Query
 from typing import Any
-from database import get_db
+from database import get_db, mark_user_write
 import logging
-from utils import get_date_filter_sql
+from utils import get_date_filter_sql, get_month_start_date
 from fastapi import Query
 
 router = APIRouter(tags=["Analytics & Dashboard"])
@@ -11,24 +11,25 @@ logger = logging.getLogger(__name__)
 @router.get("/dashboard/{user_id}")
 def get_dashboard(user_id: int, view_by: str = Query("month")):
     try:
-        conn = get_db()
+        conn = get_db(readonly=True, user_id=user_id)
         cursor = conn.cursor(dictionary=True)
         
-        date_filter = get_date_filter_sql(cursor, user_id, view_by, "transactions", "date")
+        month_start_date = get_month_start_date(cursor, user_id)
+        day_filter, date_params = get_date_filter_sql(view_by, month_start_date, "d", "day")
         
         # 1. Filter Totals
-        cursor.execute(f"SELECT type, SUM(amount) as total FROM transactions WHERE user_id = %s AND {date_filter} GROUP BY type", (user_id,))
+        cursor.execute(f"SELECT type, SUM(total) as total FROM user_daily_totals d WHERE user_id = %s AND {day_filter} GROUP BY type", (user_id, *date_params))
         totals: list[Any] = cursor.fetchall()
         
         # 2. Filter Recent Transactions
-        date_filter_t = date_filter.replace('transactions.date', 't.date')
+        date_filter_t = day_filter.replace('d.day', 't.date')
         cursor.execute(f"""
             SELECT t.id, t.amount, t.type, t.date, t.note, t.payment_mode, c.name as category
             FROM transactions t
             LEFT JOIN categories c ON t.category_id = c.id
             WHERE t.user_id = %s AND {date_filter_t}
             ORDER BY t.date DESC LIMIT 7
-        """, (user_id,))
+        """, (user_id, *date_params))
         recent: list[Any] = cursor.fetchall()
         
         conn.close()
@@ -39,32 +40,31 @@ def get_dashboard(user_id: int, view_by: str = Query("month")):
 @router.get("/analytics/{user_id}")
 def get_analytics(user_id: int, view_by: str = Query("month")):
     try:
-        conn = get_db()
+        conn = get_db(readonly=True, user_id=user_id)
         cursor = conn.cursor(dictionary=True)
         
-        date_filter = get_date_filter_sql(cursor, user_id, view_by, "t", "date")
+        month_start_date = get_month_start_date(cursor, user_id)
+        day_filter, date_params = get_date_filter_sql(view_by, month_start_date, "d", "day")
         
         
         cursor.execute(f"""
-            SELECT c.name, SUM(t.amount) as value 
-            FROM transactions t
-            JOIN categories c ON t.category_id = c.id
-            WHERE t.user_id = %s AND t.type = 'expense' AND {date_filter}
+            SELECT c.name, SUM(d.total) as value 
+            FROM user_daily_totals d
+            JOIN categories c ON d.category_id = c.id
+            WHERE d.user_id = %s AND d.type = 'expense' AND {day_filter}
             GROUP BY c.name
-        """, (user_id,))
+        """, (user_id, *date_params))
         pie_data: list[Any] = cursor.fetchall()
         
-        cursor.execute("SELECT month_start_date FROM users WHERE id = %s", (user_id,))
-        user: Any = cursor.fetchone()
-        offset = (int(user['month_start_date']) - 1) if user and user.get('month_start_date') else 0
-        adjusted_date = f"DATE_SUB(date, INTERVAL {offset} DAY)"
+        offset = month_start_date - 1
+        adjusted_date = f"DATE_SUB(day, INTERVAL {offset} DAY)"
         
         
         cursor.execute(f"""
             SELECT DATE_FORMAT(DATE_ADD({adjusted_date}, INTERVAL {offset} DAY), '%b') as name, 
-                SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END) as income,
-                SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END) as expense
-            FROM transactions WHERE user_id = %s 
+                SUM(CASE WHEN type = 'income' THEN total ELSE 0 END) as income,
+                SUM(CASE WHEN type = 'expense' THEN total ELSE 0 END) as expense
+            FROM user_daily_totals WHERE user_id = %s 
             GROUP BY YEAR({adjusted_date}), MONTH({adjusted_date}), name
             ORDER BY YEAR({adjusted_date}), MONTH({adjusted_date}) LIMIT 6
         """, (user_id,))
@@ -78,7 +78,7 @@ def get_analytics(user_id: int, view_by: str = Query("month")):
 
 @router.get("/recurring/{user_id}")
 def get_recurring(user_id: int):
-    conn = get_db()
+    conn = get_db(readonly=True, user_id=user_id)
     cursor = conn.cursor(dictionary=True)
     query = """
         SELECT 
@@ -105,7 +105,11 @@ def get_recurring(user_id: int):
 def stop_recurring(id: int):
     conn = get_db()
     cursor = conn.cursor()
+    cursor.execute("SELECT user_id FROM transactions WHERE id = %s", (id,))
+    owner = cursor.fetchone()
     cursor.execute("UPDATE transactions SET is_recurring = FALSE WHERE id = %s", (id,))
+    if owner:
+        mark_user_write(cursor, owner[0])
     conn.commit()
     conn.close()
     return {"message": "Recurring stopped"}
@@ -113,10 +117,10 @@ def stop_recurring(id: int):
 @router.get("/income/daily/{user_id}")
 def get_daily_income(user_id: int):
     try:
-        conn = get_db()
+        conn = get_db(readonly=True, user_id=user_id)
         cursor = conn.cursor(dictionary=True)
         
-        cursor.execute("SELECT date, SUM(amount) as total FROM transactions WHERE user_id = %s AND type = 'income' GROUP BY date ORDER BY date DESC LIMIT 30", (user_id,))
+        cursor.execute("SELECT day as date, SUM(total) as total FROM user_daily_totals WHERE user_id = %s AND type = 'income' GROUP BY day ORDER BY day DESC LIMIT 30", (user_id,))
         data: list[Any] = cursor.fetchall()
         conn.close()
         return data
@@ -127,13 +131,13 @@ def get_daily_income(user_id: int):
 @router.get("/income/monthly/{user_id}")
 def get_monthly_income(user_id: int):
     try:
-        conn = get_db()
+        conn = get_db(readonly=True, user_id=user_id)
         cursor = conn.cursor(dictionary=True)
         
         cursor.execute("""
-            SELECT DATE_FORMAT(MIN(date), '%Y-%m') as month_year, DATE_FORMAT(MIN(date), '%M %Y') as display_name, SUM(amount) as total
-            FROM transactions WHERE user_id = %s AND type = 'income'
-            GROUP BY YEAR(date), MONTH(date) ORDER BY YEAR(date) DESC, MONTH(date) DESC LIMIT 12
+            SELECT DATE_FORMAT(MIN(day), '%Y-%m') as month_year, DATE_FORMAT(MIN(day), '%M %Y') as display_name, SUM(total) as total
+            FROM user_daily_totals WHERE user_id = %s AND type = 'income'
+            GROUP BY YEAR(day), MONTH(day) ORDER BY YEAR(day) DESC, MONTH(day) DESC LIMIT 12
         """, (user_id,))
         data: list[Any] = cursor.fetchall()
         conn.close()
@@ -145,14 +149,14 @@ def get_monthly_income(user_id: int):
 @router.get("/analytics/category-monthly/{user_id}")
 def get_category_monthly_analytics(user_id: int):
     try:
-        conn = get_db()
+        conn = get_db(readonly=True, user_id=user_id)
         cursor = conn.cursor(dictionary=True)
         
         cursor.execute("""
-            SELECT DATE_FORMAT(MIN(t.date), '%b %Y') as month, c.name as category, SUM(t.amount) as total
-            FROM transactions t JOIN categories c ON t.category_id = c.id
-            WHERE t.user_id = %s AND t.type = 'expense'
-            GROUP BY YEAR(t.date), MONTH(t.date), c.name ORDER BY YEAR(t.date), MONTH(t.date)
+            SELECT DATE_FORMAT(MIN(d.day), '%b %Y') as month, c.name as category, SUM(d.total) as total
+            FROM user_daily_totals d JOIN categories c ON d.category_id = c.id
+            WHERE d.user_id = %s AND d.type = 'expense'
+            GROUP BY YEAR(d.day), MONTH(d.day), c.name ORDER BY YEAR(d.day), MONTH(d.day)
         """, (user_id,))
         data: list[Any] = cursor.fetchall()
         conn.close()
@@ -164,17 +168,17 @@ def get_category_monthly_analytics(user_id: int):
 @router.get("/predict/{user_id}")
 def get_prediction(user_id: int):
     try:
-        conn = get_db()
+        conn = get_db(readonly=True, user_id=user_id)
         cursor = conn.cursor(dictionary=True)
         
         # Fetch last 3 months of expenses
         cursor.execute("""
             SELECT 
-                DATE_FORMAT(date, '%Y-%m') as month, 
-                SUM(amount) as total
-            FROM transactions 
+                DATE_FORMAT(day, '%Y-%m') as month, 
+                SUM(total) as total
+            FROM user_daily_totals 
             WHERE user_id = %s AND type = 'expense' 
-            AND date >= DATE_SUB(NOW(), INTERVAL 3 MONTH)
+            AND day >= DATE_SUB(CURDATE(), INTERVAL 3 MONTH)
             GROUP BY month ORDER BY month DESC
         """, (user_id,))
         data: list[Any] = cursor.fetchall()
@@ -203,7 +207,7 @@ def get_prediction(user_id: int):
 # 2. SMART INSIGHTS
 @router.get("/insights/{user_id}")
 def get_insights(user_id: int):
-    conn = get_db()
+    conn = get_db(readonly=True, user_id=user_id)
     cursor = conn.cursor(dictionary=True)
     
     cursor.execute("SELECT currency FROM users WHERE id = %s", (user_id,))
@@ -213,11 +217,11 @@ def get_insights(user_id: int):
     # Compare This Month vs Last Month
     cursor.execute("""
         SELECT 
-            DATE_FORMAT(date, '%Y-%m') as month,
-            SUM(amount) as total
-        FROM transactions 
+            DATE_FORMAT(day, '%Y-%m') as month,
+            SUM(total) as total
+        FROM user_daily_totals 
         WHERE user_id = %s AND type = 'expense'
-        AND date >= DATE_SUB(NOW(), INTERVAL 2 MONTH)
+        AND day >= DATE_SUB(CURDATE(), INTERVAL 2 MONTH)
         GROUP BY month ORDER BY month DESC
     """, (user_id,))
     totals: list[Any] = cursor.fetchall()
@@ -245,10 +249,10 @@ def get_insights(user_id: int):
 
     # 2. Top Category Alert
     cursor.execute("""
-        SELECT c.name, SUM(t.amount) as total
-        FROM transactions t JOIN categories c ON t.category_id = c.id
-        WHERE t.user_id = %s AND t.type = 'expense' 
-        AND MONTH(t.date) = MONTH(CURRENT_DATE())
+        SELECT c.name, SUM(d.total) as total
+        FROM user_daily_totals d JOIN categories c ON d.category_id = c.id
+        WHERE d.user_id = %s AND d.type = 'expense' 
+        AND d.day >= DATE_FORMAT(CURDATE(), '%Y-%m-01')
         GROUP BY c.name ORDER BY total DESC LIMIT 1
     """, (user_id,))
     top_cat: Any = cursor.fetchone()
@@ -268,7 +272,7 @@ def get_dynamic_trends(
     user_id: int, 
     view_by: str = Query("month", description="Options: day, week, month, year")
 ):
-    conn = get_db()
+    conn = get_db(readonly=True, user_id=user_id)
     cursor = conn.cursor(dictionary=True)
     try:
         # 1. Get user preferences
@@ -280,7 +284,7 @@ def get_dynamic_trends(
             start_date_offset = int(user['month_start_date']) - 1
 
         # 2. Shift dates backward by the offset so the 5th becomes the 1st
-        adjusted_date = f"DATE_SUB(t.date, INTERVAL {start_date_offset} DAY)"
+        adjusted_date = f"DATE_SUB(d.day, INTERVAL {start_date_offset} DAY)"
         
         if view_by == "day":
             group_sql = f"DATE({adjusted_date})"
@@ -303,10 +307,10 @@ def get_dynamic_trends(
             SELECT 
                 {label_sql} as period_label,
                 {group_sql} as sort_key,
-                SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END) as income,
-                SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END) as expense
-            FROM transactions t
-            WHERE t.user_id = %s
+                SUM(CASE WHEN type = 'income' THEN total ELSE 0 END) as income,
+                SUM(CASE WHEN type = 'expense' THEN total ELSE 0 END) as expense
+            FROM user_daily_totals d
+            WHERE d.user_id = %s
             GROUP BY {group_sql}, {label_sql}
             ORDER BY sort_key DESC
             LIMIT %s
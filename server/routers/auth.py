@@ -3,6 +3,7 @@ import httpx
 from typing import Any, Optional
 from pydantic import BaseModel
 from database import get_db
+from user_directory import user_directory
 from schemas import *
 from security import pwd_context, create_access_token, get_current_user
 from utils import create_default_categories, is_country_allowed
@@ -34,7 +35,7 @@ async def check_geo_status(request: Request):
     geo_data = await fetch_geoip_data(client_ip)
     
     if geo_data:
-        allowed_set = get_allowed_countries_from_db()
+        allowed_set = await get_allowed_countries_from_db()
         calling_code = geo_data.get("calling_code")
         country_name = geo_data.get("country_name")
         
@@ -120,6 +121,8 @@ async def register(payload: RegisterPayload):
             await generate_and_send_otp(cursor, target_mobile, payload.name)
         
         conn.commit()
+        if field == "mobile":
+            user_directory.invalidate(phone=payload.contact)
             
         return {"message": "OTP sent to your WhatsApp!"}
         
@@ -321,6 +324,7 @@ def update_profile(data: UserUpdateProfile, user_id: int = Depends(get_current_u
         """, (data.name, data.profile_pic, data.email, new_mobile, user_id))
         
         conn.commit()
+        user_directory.invalidate(user_id=user_id)
             
         return {"message": "Profile updated successfully"}
     except Exception as e:
@@ -385,6 +389,7 @@ def complete_profile(request: ProfileCompletionRequest):
             create_default_categories(int(user['id']), cursor)
         
         conn.commit()
+        user_directory.invalidate(phone=request.mobile)
             
         return {"status": "success", "message": "Profile completed! You can now log in."}
 
@@ -411,6 +416,7 @@ def update_preferences(data: UserPreferencesUpdate, user_id: int = Depends(get_c
             WHERE id = %s
         """, (data.currency, data.month_start_date, user_id))
         conn.commit()
+        user_directory.invalidate(user_id=user_id)
         return {"message": "Preferences updated"}
     except Exception as e:
         conn.rollback()
@@ -482,6 +488,7 @@ def verify_link_mobile(data: LinkMobileVerify, user_id: int = Depends(get_curren
             final_user_id = user_id
             
         conn.commit()
+        user_directory.invalidate(phone=data.mobile, user_id=user_id)
         
         cursor.execute("SELECT * FROM users WHERE id = %s", (final_user_id,))
         user_db: dict[str, Any] = cursor.fetchone()
@@ -531,6 +538,7 @@ def soft_delete_account(user_id: int = Depends(get_current_user)):
         """, (new_mobile, new_email, user_id))
         
         conn.commit()
+        user_directory.invalidate(user_id=user_id)
         return {"message": "Account successfully deleted. Your data has been archived."}
     except Exception as e:
         conn.rollback()
@@ -1,12 +1,13 @@
 from fastapi import APIRouter, HTTPException, Depends
 from typing import Any
-from database import get_db
+from database import get_db, mark_user_write
 from schemas import (
     GoalCreate, GoalUpdate, LoanCreate, LoanUpdate, 
     DebtCreate, RepaymentCreate, MarkPaidRequest
 )
 from utils import calculate_interest
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
+from rollups import record_transaction
 import logging
 
 router = APIRouter(tags=["Features (Goals, Loans, Debts)"])
@@ -28,6 +29,7 @@ def add_goal(goal: GoalCreate):
     conn = get_db()
     cursor = conn.cursor()
     cursor.execute("INSERT INTO goals (user_id, name, target_amount, deadline) VALUES (%s, %s, %s, %s)", (goal.user_id, goal.name, goal.target_amount, goal.deadline))
+    mark_user_write(cursor, goal.user_id)
     conn.commit()
     conn.close()
     return {"message": "Goal added"}
@@ -36,7 +38,11 @@ def add_goal(goal: GoalCreate):
 def delete_goal(id: int):
     conn = get_db()
     cursor = conn.cursor()
+    cursor.execute("SELECT user_id FROM goals WHERE id = %s", (id,))
+    owner = cursor.fetchone()
     cursor.execute("DELETE FROM goals WHERE id = %s", (id,))
+    if owner:
+        mark_user_write(cursor, owner[0])
     conn.commit()
     conn.close()
     return {"message": "Goal deleted"}
@@ -65,10 +71,13 @@ def add_money_to_goal(update: GoalUpdate):
         else:
             cat_id = cat['id']
 
+        tx_date = datetime.utcnow() + timedelta(hours=5, minutes=30)
         cursor.execute("""
             INSERT INTO transactions (user_id, amount, type, category_id, payment_mode, date, note, goal_id) 
-            VALUES (%s, %s, %s, %s, 'Transfer', NOW(), %s, %s)
-        """, (goal['user_id'], abs(update.amount_added), tx_type, cat_id, tx_note, update.goal_id))
+            VALUES (%s, %s, %s, %s, 'Transfer', %s, %s, %s)
+        """, (goal['user_id'], abs(update.amount_added), tx_type, cat_id, tx_date, tx_note, update.goal_id))
+        record_transaction(cursor, goal['user_id'], tx_date, cat_id, tx_type, abs(update.amount_added))
+        mark_user_write(cursor, goal['user_id'])
 
         conn.commit()
         print("Money added to goal")
@@ -1,10 +1,11 @@
 from fastapi import APIRouter, HTTPException, Depends, Query
 from typing import Optional, Any
-from database import get_db
+from database import get_db, mark_user_write
 from schemas import TransactionCreate, CategoryCreate, CategoryUpdate, BudgetSchema
 import logging, math
 from datetime import datetime, timedelta
-from utils import get_date_filter_sql
+from utils import get_date_filter_sql, get_month_start_date
+from rollups import record_transaction, remove_transaction, rebuild_daily_totals
 import mysql.connector
 
 router = APIRouter(tags=["Transactions & Categories"])
@@ -31,6 +32,8 @@ def add_transaction(tx: TransactionCreate):
 
         query = "INSERT INTO transactions (user_id, amount, type, category_id, payment_mode, date, note, is_recurring) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"
         cursor.execute(query, (tx.user_id, tx.amount, tx.type, cat_id, tx.payment_mode, tx.date, tx.note, tx.is_recurring))
+        record_transaction(cursor, tx.user_id, tx.date, cat_id, tx.type, tx.amount)
+        mark_user_write(cursor, tx.user_id)
         conn.commit()
     
         return {"message": "Transaction Saved"}
@@ -158,10 +161,13 @@ def delete_transaction(id: int):
     conn = get_db()
     cursor = conn.cursor(dictionary=True, buffered=True)
     try:
-        cursor.execute("SELECT user_id, amount, type FROM transactions WHERE id = %s", (id,))
+        cursor.execute("SELECT user_id, amount, type, date, category_id FROM transactions WHERE id = %s FOR UPDATE", (id,))
         tx_data: Any = cursor.fetchone()
 
         cursor.execute("DELETE FROM transactions WHERE id = %s", (id,))
+        if tx_data:
+            remove_transaction(cursor, tx_data['user_id'], tx_data['date'], tx_data['category_id'], tx_data['type'], tx_data['amount'])
+            mark_user_write(cursor, tx_data['user_id'])
         conn.commit()
 
         return {"message": "Deleted"}
@@ -211,7 +217,13 @@ def delete_category(id: int):
     conn = get_db()
     cursor = conn.cursor(dictionary=True, buffered=True)
     try:
+        cursor.execute("SELECT DISTINCT user_id FROM user_daily_totals WHERE category_id = %s", (id,))
+        affected_users = [row['user_id'] for row in cursor.fetchall()]
+        
         cursor.execute("UPDATE transactions SET category_id = NULL WHERE category_id = %s", (id,))
+        for affected_user in affected_users:
+            rebuild_daily_totals(cursor, affected_user)
+            mark_user_write(cursor, affected_user)
         
         cursor.execute("DELETE FROM categories WHERE id = %s", (id,))
         conn.commit()
@@ -269,7 +281,7 @@ def get_budgets_status(user_id: int, view_by: str = Query("month")):
         conn = get_db()
         cursor = conn.cursor(dictionary=True)
         
-        date_filter = get_date_filter_sql(cursor, user_id, view_by, "t", "date")
+        date_filter, date_params = get_date_filter_sql(view_by, get_month_start_date(cursor, user_id), "t", "date")
 
         query = f"""
             SELECT 
@@ -288,7 +300,7 @@ def get_budgets_status(user_id: int, view_by: str = Query("month")):
             WHERE (c.user_id = %s OR c.user_id IS NULL) AND c.type = 'expense'
             GROUP BY c.id, c.name, c.color, c.icon, b.amount
         """
-        cursor.execute(query, (user_id, user_id, user_id))
+        cursor.execute(query, (user_id, user_id, *date_params, user_id))
         budgets: list[Any] = cursor.fetchall()
 
         for b in budgets:
@@ -390,6 +402,9 @@ def update_transaction(id: int, tx: TransactionCreate):
              
         cat_id = result['id'] if result else None
 
+        cursor.execute("SELECT user_id, amount, type, date, category_id FROM transactions WHERE id = %s FOR UPDATE", (id,))
+        old_tx: Any = cursor.fetchone()
+
         query = """
             UPDATE transactions 
             SET amount = %s, type = %s, category_id = %s, 
@@ -397,6 +412,10 @@ def update_transaction(id: int, tx: TransactionCreate):
             WHERE id = %s
         """
         cursor.execute(query, (tx.amount, tx.type, cat_id, tx.payment_mode, tx.date, tx.note, tx.is_recurring, id))
+        if old_tx:
+            remove_transaction(cursor, old_tx['user_id'], old_tx['date'], old_tx['category_id'], old_tx['type'], old_tx['amount'])
+            record_transaction(cursor, old_tx['user_id'], tx.date, cat_id, tx.type, tx.amount)
+            mark_user_write(cursor, old_tx['user_id'])
         conn.commit()
 
         return {"message": "Transaction updated"}
@@ -416,7 +435,7 @@ def get_user_transactions(user_id: int, view_by: str = Query("month")):
     conn = get_db()
     cursor = conn.cursor(dictionary=True)
     try:
-        date_filter = get_date_filter_sql(cursor, user_id, view_by, "t", "date")
+        date_filter, date_params = get_date_filter_sql(view_by, get_month_start_date(cursor, user_id), "t", "date")
         
         query = f"""
             SELECT t.*, c.name as category_name, c.icon as category_icon 
@@ -425,7 +444,7 @@ def get_user_transactions(user_id: int, view_by: str = Query("month")):
             WHERE t.user_id = %s AND {date_filter}
             ORDER BY t.date DESC
         """
-        cursor.execute(query, (user_id,))
+        cursor.execute(query, (user_id, *date_params))
         return cursor.fetchall()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
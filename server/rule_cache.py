@@ -0,0 +1,85 @@
+import os
+import json
+import time
+import asyncio
+from typing import Any
+from database import db
+from category_matcher import CategoryMatcher
+
+RULE_CACHE_TTL = float(os.getenv("RULE_CACHE_TTL", 30))
+
+AUTO_REPLY_FIELDS = ("id", "trigger_keywords", "reply_text", "buttons_json")
+GLOBAL_CATEGORY_FIELDS = ("id", "name", "type", "keywords", "icon", "color")
+
+class RuleCache:
+    """
+    In-memory copy of the bot's static config (active auto_replies and
+    global_categories). The admin CRUD endpoints call bump() so this worker
+    reloads on the next read; other workers pick changes up within the TTL.
+    """
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.version = 0
+        self._loaded_version = -1
+        self._loaded_at = 0.0
+        self._auto_replies: list[dict] = []
+        self._global_categories: dict[str, list[dict]] = {"expense": [], "income": []}
+        self._matchers: dict[str, CategoryMatcher] = {}
+        self._lock = asyncio.Lock()
+
+    def bump(self):
+        self.version += 1
+
+    def _is_fresh(self) -> bool:
+        return self._loaded_version == self.version and time.monotonic() - self._loaded_at < self.ttl
+
+    async def _ensure_loaded(self, cursor: Any = None):
+        if self._is_fresh():
+            return
+        async with self._lock:
+            if self._is_fresh():
+                return
+            version = self.version
+            if cursor is not None:
+                await self._load(cursor)
+            else:
+                async with db() as conn:
+                    cursor = await conn.cursor()
+                    await self._load(cursor)
+                    await cursor.close()
+            self._loaded_version = version
+            self._loaded_at = time.monotonic()
+
+    async def _load(self, cursor: Any):
+        await cursor.execute(f"SELECT {', '.join(AUTO_REPLY_FIELDS)} FROM auto_replies WHERE is_active = TRUE ORDER BY id")
+        auto_replies = []
+        for row in await cursor.fetchall():
+            rule = row if isinstance(row, dict) else dict(zip(AUTO_REPLY_FIELDS, tuple(row)))
+            rule["keywords"] = [k.strip() for k in str(rule["trigger_keywords"] or "").split(',') if k.strip()]
+            try: rule["buttons"] = json.loads(rule["buttons_json"]) if rule["buttons_json"] else None
+            except ValueError: rule["buttons"] = None
+            auto_replies.append(rule)
+
+        await cursor.execute(f"SELECT {', '.join(GLOBAL_CATEGORY_FIELDS)} FROM global_categories ORDER BY id")
+        global_categories: dict[str, list[dict]] = {"expense": [], "income": []}
+        for row in await cursor.fetchall():
+            cat = row if isinstance(row, dict) else dict(zip(GLOBAL_CATEGORY_FIELDS, tuple(row)))
+            global_categories.setdefault(cat["type"], []).append(cat)
+
+        self._auto_replies = auto_replies
+        self._global_categories = global_categories
+        self._matchers = {tx_type: CategoryMatcher(cats) for tx_type, cats in global_categories.items()}
+
+    async def auto_replies(self, cursor: Any = None) -> list[dict]:
+        await self._ensure_loaded(cursor)
+        return self._auto_replies
+
+    async def global_categories(self, tx_type: str, cursor: Any = None) -> list[dict]:
+        await self._ensure_loaded(cursor)
+        return self._global_categories.get(tx_type, [])
+
+    async def category_matcher(self, tx_type: str, cursor: Any = None) -> CategoryMatcher:
+        await self._ensure_loaded(cursor)
+        return self._matchers.get(tx_type) or CategoryMatcher([])
+
+rule_cache = RuleCache(RULE_CACHE_TTL)
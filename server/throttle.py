@@ -0,0 +1,114 @@
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+from database import db
+from telemetry import registry
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_LOCAL_MAX_ENTRIES = int(os.getenv("THROTTLE_LOCAL_MAX_ENTRIES", 50000))
+PRUNE_EVERY_ACQUIRES = 500
+
+# Reopens an expired window. Rows still inside their window do not match, so
+# rowcount is 1 only for the caller that took the window.
+REOPEN_SQL = """
+    UPDATE throttle_windows SET expires_at = NOW(3) + INTERVAL %s SECOND
+    WHERE scope = %s AND subject = %s AND expires_at <= NOW(3)
+"""
+REMAINING_SQL = """
+    SELECT TIMESTAMPDIFF(MICROSECOND, NOW(3), expires_at) / 1000000
+    FROM throttle_windows WHERE scope = %s AND subject = %s
+"""
+
+class LocalWindows:
+    """
+    Per-process (scope, subject) -> window end, capped at max_entries with the
+    oldest entries dropped first. Only ever used to answer "still suppressed"
+    without a round trip, so losing an entry just costs one query.
+    """
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._windows: OrderedDict[tuple[str, str], float] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def active(self, key: tuple[str, str]) -> bool:
+        with self._lock:
+            expires_at = self._windows.get(key)
+            if expires_at is None:
+                return False
+            if expires_at <= time.monotonic():
+                del self._windows[key]
+                return False
+            return True
+
+    def hold(self, key: tuple[str, str], seconds: float):
+        with self._lock:
+            self._windows.pop(key, None)
+            self._windows[key] = time.monotonic() + seconds
+            while len(self._windows) > self.max_entries:
+                self._windows.popitem(last=False)
+
+    def acquire(self, key: tuple[str, str], seconds: float) -> bool:
+        if self.active(key):
+            return False
+        self.hold(key, seconds)
+        return True
+
+class ThrottleStore:
+    """
+    Cross-worker "at most once per window" gate for per-phone actions such as
+    outbound notices, backed by the throttle_windows primary key. A
+    LocalWindows front answers subjects this worker already knows are
+    suppressed; if MySQL is unavailable the gate degrades to local state.
+    """
+    def __init__(self, max_local_entries: int):
+        self.local = LocalWindows(max_local_entries)
+        self._acquires = 0
+        self.allowed = 0
+        self.suppressed = 0
+
+    async def acquire(self, scope: str, subject: str, window_seconds: float) -> bool:
+        """True if the caller may act now; the window then starts and later calls get False until it ends."""
+        key = (scope, subject)
+        if self.local.active(key):
+            self.suppressed += 1
+            return False
+        try:
+            async with db() as conn:
+                cursor = await conn.cursor()
+                await cursor.execute(REOPEN_SQL, (window_seconds, scope, subject))
+                acquired = cursor.rowcount == 1
+                if not acquired:
+                    await cursor.execute(
+                        "INSERT IGNORE INTO throttle_windows (scope, subject, expires_at) VALUES (%s, %s, NOW(3) + INTERVAL %s SECOND)",
+                        (scope, subject, window_seconds)
+                    )
+                    acquired = cursor.rowcount == 1
+                remaining = float(window_seconds)
+                if not acquired:
+                    await cursor.execute(REMAINING_SQL, (scope, subject))
+                    row = await cursor.fetchone()
+                    remaining = float(row[0]) if row and row[0] is not None else 0.0
+                self._acquires += 1
+                if self._acquires % PRUNE_EVERY_ACQUIRES == 0:
+                    await cursor.execute("DELETE FROM throttle_windows WHERE expires_at < NOW(3) LIMIT 5000")
+                await conn.commit()
+        except Exception as e:
+            logger.warning(f"Throttle store unavailable, using local state: {e}")
+            acquired = self.local.acquire(key, window_seconds)
+            remaining = 0.0
+
+        if remaining > 0:
+            self.local.hold(key, remaining)
+        if acquired: self.allowed += 1
+        else: self.suppressed += 1
+        return acquired
+
+throttle = ThrottleStore(THROTTLE_LOCAL_MAX_ENTRIES)
+
+registry.counter_callback(
+    "sidenote_throttle_decisions", "Throttle store decisions by outcome.", ("outcome",),
+    lambda: [(("allowed",), throttle.allowed), (("suppressed",), throttle.suppressed)]
+)
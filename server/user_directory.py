@@ -0,0 +1,83 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+from database import db
+
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 60))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 5000))
+
+USER_FIELDS = ("id", "name", "has_consented", "monthly_budget", "month_start_date", "currency")
+USER_LOOKUP_SQL = f"SELECT {', '.join(USER_FIELDS)} FROM users WHERE mobile = %s"
+
+class UserDirectory:
+    """
+    Bounded LRU + TTL cache of the users columns the bot needs, keyed by phone.
+    Write paths that touch these columns call invalidate(); the TTL covers
+    updates made by other workers.
+    """
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._phone_by_id: dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def _get_cached(self, phone: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(phone)
+            if entry is None:
+                return None
+            expires_at, user = entry
+            if expires_at < time.monotonic():
+                self._drop(phone)
+                return None
+            self._entries.move_to_end(phone)
+            return user
+
+    def _drop(self, phone: str):
+        _, user = self._entries.pop(phone, (None, None))
+        if user is not None and self._phone_by_id.get(user["id"]) == phone:
+            del self._phone_by_id[user["id"]]
+
+    def put(self, phone: str, user: dict):
+        with self._lock:
+            self._drop(phone)
+            self._entries[phone] = (time.monotonic() + self.ttl, user)
+            self._phone_by_id[user["id"]] = phone
+            while len(self._entries) > self.max_size:
+                self._drop(next(iter(self._entries)))
+
+    async def get(self, phone: str, cursor: Any = None) -> Optional[dict]:
+        """Returns the cached user for phone, loading it (via cursor if given) on a miss."""
+        user = self._get_cached(phone)
+        if user is not None:
+            return user
+
+        if cursor is not None:
+            row = await self._fetch(cursor, phone)
+        else:
+            async with db() as conn:
+                cursor = await conn.cursor()
+                row = await self._fetch(cursor, phone)
+                await cursor.close()
+
+        if row is None:
+            return None
+        user = row if isinstance(row, dict) else dict(zip(USER_FIELDS, tuple(row)))
+        self.put(phone, user)
+        return user
+
+    async def _fetch(self, cursor: Any, phone: str):
+        await cursor.execute(USER_LOOKUP_SQL, (phone,))
+        return await cursor.fetchone()
+
+    def invalidate(self, phone: Optional[str] = None, user_id: Optional[int] = None):
+        with self._lock:
+            if user_id is not None and user_id in self._phone_by_id:
+                self._drop(self._phone_by_id[user_id])
+            if phone is not None:
+                self._drop(phone)
+
+user_directory = UserDirectory(USER_CACHE_SIZE, USER_CACHE_TTL)
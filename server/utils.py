@@ -1,16 +1,100 @@
+import os
 import time
 import httpx
+import asyncio
 import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
 from datetime import datetime, date, timedelta
 from fastapi import Request
-from database import get_db
+import geoip
+from country_gate import country_gate
+from telemetry import registry
 
 logger = logging.getLogger(__name__)
 
-IP_GEO_CACHE = {}
 IP_CACHE_TTL = 86400
-ALLOWED_COUNTRIES_CACHE = {"codes": set(), "updated_at": 0}
-ALLOWED_DB_CACHE_TTL = 300
+IP_CACHE_SIZE = int(os.getenv("IP_CACHE_SIZE", 10000))
+IP_CACHE_NEGATIVE_TTL = float(os.getenv("IP_CACHE_NEGATIVE_TTL", 300))
+# With a local GeoIP database installed, ipwho.is is only asked about IPs the database does not cover.
+GEOIP_REMOTE_FALLBACK = os.getenv("GEOIP_REMOTE_FALLBACK", "false").lower() == "true"
+
+_geo_client = None
+
+class GeoIPCache:
+    """
+    Bounded LRU + TTL cache of remote GeoIP answers keyed by IP. Failed or
+    unsuccessful lookups are cached as None for negative_ttl so a scanner
+    cannot make us re-ask on every request, and concurrent misses for one IP
+    share a single in-flight lookup.
+    """
+    def __init__(self, max_size: int, ttl: float, negative_ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries: OrderedDict[str, tuple[float, Optional[dict]]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def put(self, ip: str, value: Optional[dict]):
+        ttl = self.ttl if value is not None else self.negative_ttl
+        self._entries.pop(ip, None)
+        self._entries[ip] = (time.monotonic() + ttl, value)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get(self, ip: str, loader: Callable[[str], Awaitable[Optional[dict]]]) -> Optional[dict]:
+        entry = self._entries.get(ip)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(ip)
+                if value is None: self.negative_hits += 1
+                else: self.hits += 1
+                return value
+            del self._entries[ip]
+
+        task = self._inflight.get(ip)
+        if task is None:
+            self.misses += 1
+            task = self._inflight[ip] = asyncio.create_task(self._load(ip, loader))
+        else:
+            self.coalesced += 1
+        # shielded so a cancelled request does not abort the lookup others are waiting on
+        return await asyncio.shield(task)
+
+    async def _load(self, ip: str, loader: Callable[[str], Awaitable[Optional[dict]]]) -> Optional[dict]:
+        try:
+            value = await loader(ip)
+            self.put(ip, value)
+            return value
+        finally:
+            self._inflight.pop(ip, None)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "max_size": self.max_size,
+            "in_flight": len(self._inflight),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions
+        }
+
+ip_geo_cache = GeoIPCache(IP_CACHE_SIZE, IP_CACHE_TTL, IP_CACHE_NEGATIVE_TTL)
+
+registry.gauge_callback("sidenote_geoip_cache_entries", "IPs held in the remote GeoIP cache.", (), lambda: [((), len(ip_geo_cache._entries))])
+registry.counter_callback(
+    "sidenote_geoip_cache_lookups", "Remote GeoIP cache lookups by outcome.", ("outcome",),
+    lambda: [((outcome,), getattr(ip_geo_cache, outcome)) for outcome in ("hits", "negative_hits", "misses", "coalesced")]
+)
 
 def calculate_interest(principal, rate, period, start_date_str):
     if not rate or rate == 0:
@@ -56,41 +140,53 @@ def create_default_categories(user_id: int, cursor):
     data = [(user_id, d[0], d[1], d[2], d[3]) for d in defaults]
     cursor.executemany(query, data)
     
-def get_date_filter_sql(cursor, user_id: int, view_by: str, table_alias="t", date_column="date"):
+def get_month_start_date(cursor, user_id: int) -> int:
     cursor.execute("SELECT month_start_date FROM users WHERE id = %s", (user_id,))
     user = cursor.fetchone()
     
-    start_date = 1
     if type(user) is dict:
-         start_date = user.get('month_start_date', 1)
+        return int(user.get('month_start_date') or 1)
     elif type(user) is tuple:
-         start_date = user[0]
+        return int(user[0] or 1)
+    return 1
 
-    offset = int(start_date) - 1
-    
-    adjusted_db_date = f"DATE_SUB({table_alias}.{date_column}, INTERVAL {offset} DAY)"
-    adjusted_now = f"DATE_SUB(NOW(), INTERVAL {offset} DAY)"
+def get_date_range(view_by: str, month_start_date: int = 1, now: datetime | None = None) -> tuple[datetime, datetime]:
+    """
+    Half-open [start, end) IST bounds for the current day/week/month/year.
+    Week, month and year are shifted by (month_start_date - 1) days so a
+    user whose month starts on the 25th gets 25th -> 25th windows.
+    """
+    now = now or (datetime.utcnow() + timedelta(hours=5, minutes=30))
+    offset = timedelta(days=int(month_start_date or 1) - 1)
+    today = datetime.combine(now.date(), datetime.min.time())
     
     if view_by == "day":
-        return f"DATE({table_alias}.{date_column}) = CURDATE()"
-    elif view_by == "week":
-        return f"YEARWEEK({adjusted_db_date}, 1) = YEARWEEK({adjusted_now}, 1)"
+        return today, today + timedelta(days=1)
+    
+    adjusted = today - offset
+    if view_by == "week":
+        start = adjusted - timedelta(days=adjusted.weekday())
+        end = start + timedelta(days=7)
     elif view_by == "year":
-        return f"YEAR({adjusted_db_date}) = YEAR({adjusted_now})"
-    else: 
-        return f"DATE_FORMAT({adjusted_db_date}, '%Y-%m') = DATE_FORMAT({adjusted_now}, '%Y-%m')"
+        start = adjusted.replace(month=1, day=1)
+        end = start.replace(year=start.year + 1)
+    else:
+        start = adjusted.replace(day=1)
+        end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    return start + offset, end + offset
+
+def get_date_filter_sql(view_by: str, month_start_date: int = 1, table_alias="t", date_column="date") -> tuple[str, tuple]:
+    start, end = get_date_range(view_by, month_start_date)
+    column = f"{table_alias}.{date_column}"
+    return f"{column} >= %s AND {column} < %s", (start, end)
     
 def is_country_allowed(mobile: str, cursor) -> bool:
-    clean_mobile = mobile.lstrip('+')
-    
-    cursor.execute("SELECT country_code FROM allowed_countries WHERE status = 1")
-    allowed_codes = [row['country_code'] for row in cursor.fetchall()]
-    
-    for code in allowed_codes:
-        if clean_mobile.startswith(code):
-            return True
-            
-    return False
+    country_gate.ensure_loaded(cursor)
+    return country_gate.match(mobile) is not None
+
+async def is_country_allowed_async(mobile: str, cursor) -> bool:
+    await country_gate.ensure_loaded_async(cursor)
+    return country_gate.match(mobile) is not None
 
 def get_client_ip(request: Request) -> str:
     x_forwarded_for = request.headers.get("X-Forwarded-For")
@@ -98,53 +194,37 @@ def get_client_ip(request: Request) -> str:
         return x_forwarded_for.split(",")[0].strip()
     return request.client.host if request.client else "127.0.0.1"
 
-def get_allowed_countries_from_db() -> set:
-    now = time.time()
-    if now - ALLOWED_COUNTRIES_CACHE["updated_at"] < ALLOWED_DB_CACHE_TTL and ALLOWED_COUNTRIES_CACHE["codes"]:
-        return ALLOWED_COUNTRIES_CACHE["codes"]
-
-    conn = get_db()
-    cursor = conn.cursor(dictionary=True)
+async def get_allowed_countries_from_db() -> set:
     try:
-        cursor.execute("SELECT country_code, country_name FROM allowed_countries WHERE status = 1")
-        rows = cursor.fetchall()
-        
-        allowed_set = set()
-        for row in rows:
-            allowed_set.add(row['country_code'].lstrip('+'))
-            allowed_set.add(row['country_name'].strip().lower())
-
-        ALLOWED_COUNTRIES_CACHE["codes"] = allowed_set
-        ALLOWED_COUNTRIES_CACHE["updated_at"] = now
-        return allowed_set
+        await country_gate.ensure_loaded_async()
     except Exception as e:
         logger.error(f"Failed to load allowed countries from DB: {e}")
-        return ALLOWED_COUNTRIES_CACHE["codes"] or {"91", "india"}
-    finally:
-        conn.close()
+        return {"91", "india"}
+    return country_gate.allowed_set()
 
-async def fetch_geoip_data(ip: str) -> dict:
+async def fetch_geoip_data(ip: str) -> Optional[dict]:
     if ip in ["127.0.0.1", "::1", "localhost"] or ip.startswith(("192.168.", "10.", "172.16.")):
         return {"country_name": "india", "calling_code": "91"}
 
-    now = time.time()
-    if ip in IP_GEO_CACHE:
-        cached_data, cached_time = IP_GEO_CACHE[ip]
-        if now - cached_time < IP_CACHE_TTL:
-            return cached_data
+    result = geoip.lookup(ip)
+    if result or (geoip.get_database() and not GEOIP_REMOTE_FALLBACK):
+        return result
 
+    return await ip_geo_cache.get(ip, _fetch_remote_geoip)
+
+async def _fetch_remote_geoip(ip: str) -> Optional[dict]:
+    global _geo_client
     try:
-        async with httpx.AsyncClient(timeout=3.0) as client:
-            response = await client.get(f"https://ipwho.is/{ip}")
-            data = response.json()
-            
-            if data.get("success"):
-                result = {
-                    "country_name": str(data.get("country", "")).strip().lower(),
-                    "calling_code": str(data.get("calling_code", "")).lstrip("+")
-                }
-                IP_GEO_CACHE[ip] = (result, now)
-                return result
+        if _geo_client is None:
+            _geo_client = httpx.AsyncClient(timeout=3.0)
+        response = await _geo_client.get(f"https://ipwho.is/{ip}")
+        data = response.json()
+        
+        if data.get("success"):
+            return {
+                "country_name": str(data.get("country", "")).strip().lower(),
+                "calling_code": str(data.get("calling_code", "")).lstrip("+")
+            }
     except Exception as e:
         logger.error(f"GeoIP API request failed for IP {ip}: {e}")
-    return None
\ No newline at end of file
+    return None
@@ -0,0 +1,27 @@
+# Pure helpers for Meta webhook bodies; no DB or network imports, so they can
+# be exercised offline (see benchmarks/replay_webhook_fanout.py).
+
+def split_webhook_payload(body: dict) -> tuple[list[tuple], list[dict]]:
+    """
+    Flattens every entry/change of a webhook POST into
+    (message, sender_phone, message_id, sender_name, wa_id) tuples and status
+    dicts. Meta batches several of each under load.
+    """
+    messages = []
+    statuses = []
+    for entry in body.get('entry', []):
+        for change in entry.get('changes', []):
+            value = change.get('value', {})
+            
+            contacts = value.get('contacts', [])
+            names = {c.get('wa_id'): c.get('profile', {}).get('name', 'WhatsApp User') for c in contacts}
+            default_contact = contacts[0] if len(contacts) == 1 else {}
+            
+            for message in value.get('messages', []):
+                sender_phone = message['from']
+                wa_id = sender_phone if sender_phone in names else default_contact.get('wa_id')
+                sender_name = names.get(sender_phone) or default_contact.get('profile', {}).get('name', 'WhatsApp User')
+                messages.append((message, sender_phone, message.get('id'), sender_name, wa_id))
+            
+            statuses.extend(value.get('statuses', []))
+    return messages, statuses
@@ -1,122 +1,52 @@
-import re, time, asyncio
+import asyncio
 from typing import Any, Optional
-from database import get_db
+from database import db
+from user_directory import user_directory
+from dedupe import dedupe
 from whatsapp_service import send_whatsapp_text, send_whatsapp_template, send_policy_consent_prompt
 from constants import TEMPLATE_WELCOME
 
-# Global Semaphore to prevent DB connection exhaustion
-db_semaphore = asyncio.Semaphore(20)
-
-# Memory caches
-processed_message_ids: dict[str, float] = {}
-
-def is_duplicate(message_id: Optional[str]) -> bool:
+async def is_duplicate(message_id: Optional[str]) -> bool:
+    """True when message_id was already accepted. Only checks; claim_message() records it."""
     if not message_id: 
         return False
-    current_time = time.time()
-    
-    keys_to_delete = [k for k, timestamp in processed_message_ids.items() if current_time - timestamp > 60.0]
-    for k in keys_to_delete:
-        del processed_message_ids[k]
-        
-    if message_id in processed_message_ids:
+    if await dedupe.seen(message_id):
         print(f"⚠️ Dropped Duplicate Message: {message_id}")
         return True
-        
-    processed_message_ids[message_id] = current_time
     return False
 
-def extract_transaction_details(text: str):
-    """Smartly extracts the amount, item, and payment mode from a conversational string."""
-    text_lower = text.lower().strip()
-    is_explicit_income = bool(re.search(r'^\s*\+\s*(?:rs\.?|₹|rupees|inr|rupee|paise|paisa|taka)?\s*\d+', text_lower))
-    
-    payment_mode = "UPI"
-    mode_mappings = [('upi', 'UPI'), ('card', 'Card'), ('net banking', 'Net Banking'), ('cash', 'Cash')]
-    
-    for mode, formatted_mode in mode_mappings:
-        if re.search(r'\b' + mode + r'\b', text_lower):
-            payment_mode = formatted_mode
-            text_lower = re.sub(r'\b' + mode + r'\b', '', text_lower, count=1)
-            break
-    
-    text_clean = re.sub(r'(?<=\d)\s+(?=\d)', '', text_lower)
-    text_clean = re.sub(r'(?<=\d),(?=\d)', '', text_clean)
-    
-    currency_match = re.search(r'(?:rs\.?|₹|rupees|inr|rupee|paise|paisa|taka)\s*(\d+(?:\.\d+)?)', text_clean) or \
-                     re.search(r'(\d+(?:\.\d+)?)\s*(?:rs\.?|₹|rupees|inr|rupee|paise|paisa|taka)', text_clean)
-                     
-    if currency_match:
-        amount_str = currency_match.group(1)
-    else:
-        temp_text = text_clean
-        months_regex = r'(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*'
-        temp_text = re.sub(r'\b\d{1,2}[-/]\d{1,2}(?:[-/]\d{2,4})?\b', '', temp_text)
-        temp_text = re.sub(rf'\b\d{{1,2}}(?:st|nd|rd|th)?\s+{months_regex}\s*(?:\d{{2,4}})?\b', '', temp_text, flags=re.IGNORECASE)
-        temp_text = re.sub(rf'\b{months_regex}\s+\d{{1,2}}(?:st|nd|rd|th)?\s*(?:\d{{2,4}})?\b', '', temp_text, flags=re.IGNORECASE)
-        temp_text = re.sub(r'\b20[2-3]\d\b', '', temp_text)
-        
-        numbers = re.findall(r'\d+(?:\.\d+)?', temp_text)
-        
-        if not numbers:
-            numbers = re.findall(r'\d+(?:\.\d+)?', text_clean)
-            if not numbers:
-                return None, text_clean, False, payment_mode
-        amount_str = numbers[0]
-        
-    amount = float(amount_str)
-    
-    item = text_clean.replace(amount_str, "", 1)
-    item = re.sub(r'\b(rs\.?|rupees|inr|rupee|paise|paisa|taka)\b', '', item)
-    item = item.replace('₹', '')
-    item = item.strip("- =:, +")
-    
-    item = re.sub(r'\s{2,}', ' ', item)
-    item = re.sub(r'^(for|on|a|an|the|spent on)\s+', '', item).strip()
-    item = re.sub(r'\s+(for|on)$', '', item).strip()
-    item = item.strip("- =:, +")
-    
-    return amount, item, is_explicit_income, payment_mode
+async def claim_message(message_id: Optional[str]) -> bool:
+    """Records message_id as accepted once it is safely queued or about to be handled; False if already claimed."""
+    if not message_id:
+        return True
+    return await dedupe.claim(message_id)
 
-def get_user_id(cursor: Any, phone: str) -> int | None:
-    cursor.execute("SELECT id FROM users WHERE mobile = %s", (phone,))
-    user_row = cursor.fetchone()
-    if user_row:
-        return int(tuple(user_row)[0])
-    return None
+async def get_user_id(cursor: Any, phone: str) -> int | None:
+    user = await user_directory.get(phone, cursor)
+    return int(user['id']) if user else None
 
 async def ensure_user_exists(phone: str, sender_name: str = "WhatsApp User") -> bool:
-    conn = None
-    cursor = None
     is_new = False
-    async with db_semaphore:
-        try:
-            conn = get_db()
-            cursor = conn.cursor()
-            cursor.execute("SELECT id, name FROM users WHERE mobile = %s", (phone,))
-            existing_user = cursor.fetchone()
+    try:
+        existing_user = await user_directory.get(phone)
+        
+        if existing_user:
+            if existing_user['name'] == 'WhatsApp User' and sender_name != 'WhatsApp User':
+                async with db() as conn:
+                    cursor = await conn.cursor()
+                    await cursor.execute("UPDATE users SET name = %s WHERE id = %s", (sender_name, existing_user['id']))
+                    await conn.commit()
+                user_directory.invalidate(phone=phone)
+            return False
             
-            if existing_user:
-                user_id = existing_user[0]
-                current_name = existing_user[1]
-                if current_name == 'WhatsApp User' and sender_name != 'WhatsApp User':
-                    cursor.execute("UPDATE users SET name = %s WHERE id = %s", (sender_name, user_id))
-                    conn.commit()
-                return False
-                
-            cursor.execute("INSERT INTO users (mobile, name, is_verified) VALUES (%s, %s, TRUE)", (phone, sender_name))
-            conn.commit()
+        async with db() as conn:
+            cursor = await conn.cursor()
+            await cursor.execute("INSERT INTO users (mobile, name, is_verified) VALUES (%s, %s, TRUE)", (phone, sender_name))
+            await conn.commit()
             is_new = True
-        except Exception as e:
-            print(f"Error ensuring user exists: {e}")
-            return False
-        finally:
-            if cursor: 
-                try: cursor.close()
-                except: pass
-            if conn: 
-                try: conn.close()
-                except: pass
+    except Exception as e:
+        print(f"Error ensuring user exists: {e}")
+        return False
             
     if is_new:
         await send_whatsapp_template(phone, TEMPLATE_WELCOME, [])
@@ -125,18 +55,16 @@ async def ensure_user_exists(phone: str, sender_name: str = "WhatsApp User") ->
         
     return False
 
-def log_bot_command(phone: str, command: str):
-    conn = get_db()
-    cursor = conn.cursor()
+async def log_bot_command(phone: str, command: str):
     try:
-        user_id = get_user_id(cursor, phone)
-        if user_id:
-            cursor.execute("INSERT INTO bot_command_logs (user_id, command) VALUES (%s, %s)", (user_id, command))
-            conn.commit()
+        user = await user_directory.get(phone)
+        if user:
+            async with db() as conn:
+                cursor = await conn.cursor()
+                await cursor.execute("INSERT INTO bot_command_logs (user_id, command) VALUES (%s, %s)", (user['id'], command))
+                await conn.commit()
     except Exception as e:
         pass
-    finally:
-        conn.close()
 
 async def send_delayed_message(phone: str, msg: str, delay: int = 10):
     await asyncio.sleep(delay)
@@ -0,0 +1,138 @@
+import re
+from datetime import date, timedelta
+from typing import Optional
+
+# All patterns used to read a transaction line are compiled once at import;
+# bulk messages run them per line, so nothing here is built at call time.
+
+CURRENCY = r'(?:rs\.?|₹|rupees|inr|rupee|paise|paisa|taka)'
+MONTHS = r'(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*'
+MONTH_MAP = {'jan':1, 'feb':2, 'mar':3, 'apr':4, 'may':5, 'jun':6, 'jul':7, 'aug':8, 'sep':9, 'oct':10, 'nov':11, 'dec':12}
+
+EXPLICIT_INCOME_RE = re.compile(rf'^\s*\+\s*{CURRENCY}?\s*\d+')
+PAYMENT_MODES = [
+    (re.compile(r'\bupi\b'), 'UPI'),
+    (re.compile(r'\bcard\b'), 'Card'),
+    (re.compile(r'\bnet banking\b'), 'Net Banking'),
+    (re.compile(r'\bcash\b'), 'Cash')
+]
+DIGIT_SEPARATOR_RE = re.compile(r'(?<=\d)(?:\s+|,)(?=\d)')
+CURRENCY_BEFORE_RE = re.compile(rf'{CURRENCY}\s*(\d+(?:\.\d+)?)')
+CURRENCY_AFTER_RE = re.compile(rf'(\d+(?:\.\d+)?)\s*{CURRENCY}')
+NUMBER_RE = re.compile(r'\d+(?:\.\d+)?')
+AMOUNT_NOISE_RES = [
+    re.compile(r'\b\d{1,2}[-/]\d{1,2}(?:[-/]\d{2,4})?\b'),
+    re.compile(rf'\b\d{{1,2}}(?:st|nd|rd|th)?\s+{MONTHS}\s*(?:\d{{2,4}})?\b', re.IGNORECASE),
+    re.compile(rf'\b{MONTHS}\s+\d{{1,2}}(?:st|nd|rd|th)?\s*(?:\d{{2,4}})?\b', re.IGNORECASE),
+    re.compile(r'\b20[2-3]\d\b')
+]
+CURRENCY_WORD_RE = re.compile(r'\b(rs\.?|rupees|inr|rupee|paise|paisa|taka)\b')
+MULTI_SPACE_RE = re.compile(r'\s{2,}')
+LEADING_FILLER_RE = re.compile(r'^(for|on|a|an|the|spent on)\s+')
+TRAILING_FILLER_RE = re.compile(r'\s+(for|on)$')
+
+DAY_BEFORE_YESTERDAY_RE = re.compile(r'\bday before yesterday\b', re.IGNORECASE)
+YESTERDAY_RE = re.compile(r'\byesterday\b', re.IGNORECASE)
+TODAY_RE = re.compile(r'\btoday\b', re.IGNORECASE)
+TRAILING_ON_RE = re.compile(r'\bon\b\s*$', re.IGNORECASE)
+LEADING_ON_RE = re.compile(r'^\s*\bon\b', re.IGNORECASE)
+
+def _year(y_str: str) -> int:
+    y = int(y_str)
+    return 2000 + y if y < 100 else y
+
+# (pattern, groups -> (year or None, month, day)), tried in order. Formats
+# without a year roll back a year when the date would land in the future.
+DATE_FORMATS = [
+    # YYYY-MM-DD or YYYY/MM/DD
+    (re.compile(r'\b(\d{4})[-/](\d{1,2})[-/](\d{1,2})\b'), lambda g: (int(g[0]), int(g[1]), int(g[2]))),
+    # DD/MM/YYYY or DD-MM-YYYY or DD/MM/YY
+    (re.compile(r'\b(\d{1,2})[-/](\d{1,2})[-/](\d{2,4})\b'), lambda g: (_year(g[2]), int(g[1]), int(g[0]))),
+    # DD Month YYYY (e.g., 15 Jan 2024)
+    (re.compile(rf'\b(\d{{1,2}})(?:st|nd|rd|th)?\s+{MONTHS}\s+(\d{{2,4}})\b', re.IGNORECASE), lambda g: (_year(g[2]), MONTH_MAP[g[1].lower()[:3]], int(g[0]))),
+    # Month DD YYYY (e.g., Jan 15th 2024)
+    (re.compile(rf'\b{MONTHS}\s+(\d{{1,2}})(?:st|nd|rd|th)?\s*,?\s*(\d{{2,4}})\b', re.IGNORECASE), lambda g: (_year(g[2]), MONTH_MAP[g[0].lower()[:3]], int(g[1]))),
+    # DD/MM (No Year)
+    (re.compile(r'\b(\d{1,2})[-/](\d{1,2})\b'), lambda g: (None, int(g[1]), int(g[0]))),
+    # DD Month (No Year)
+    (re.compile(rf'\b(\d{{1,2}})(?:st|nd|rd|th)?\s+{MONTHS}\b', re.IGNORECASE), lambda g: (None, MONTH_MAP[g[1].lower()[:3]], int(g[0]))),
+    # Month DD (No Year)
+    (re.compile(rf'\b{MONTHS}\s+(\d{{1,2}})(?:st|nd|rd|th)?\b', re.IGNORECASE), lambda g: (None, MONTH_MAP[g[0].lower()[:3]], int(g[1])))
+]
+
+def extract_transaction_details(text: str):
+    """Smartly extracts the amount, item, and payment mode from a conversational string."""
+    text_lower = text.lower().strip()
+    is_explicit_income = bool(EXPLICIT_INCOME_RE.search(text_lower))
+
+    payment_mode = "UPI"
+    for pattern, formatted_mode in PAYMENT_MODES:
+        text_lower, found = pattern.subn('', text_lower, count=1)
+        if found:
+            payment_mode = formatted_mode
+            break
+
+    text_clean = DIGIT_SEPARATOR_RE.sub('', text_lower)
+
+    currency_match = CURRENCY_BEFORE_RE.search(text_clean) or CURRENCY_AFTER_RE.search(text_clean)
+
+    if currency_match:
+        amount_str = currency_match.group(1)
+    else:
+        temp_text = text_clean
+        for pattern in AMOUNT_NOISE_RES:
+            temp_text = pattern.sub('', temp_text)
+
+        number = NUMBER_RE.search(temp_text) or NUMBER_RE.search(text_clean)
+        if not number:
+            return None, text_clean, False, payment_mode
+        amount_str = number.group(0)
+
+    amount = float(amount_str)
+
+    item = text_clean.replace(amount_str, "", 1)
+    item = CURRENCY_WORD_RE.sub('', item)
+    item = item.replace('₹', '')
+    item = item.strip("- =:, +")
+
+    item = MULTI_SPACE_RE.sub(' ', item)
+    item = LEADING_FILLER_RE.sub('', item).strip()
+    item = TRAILING_FILLER_RE.sub('', item).strip()
+    item = item.strip("- =:, +")
+
+    return amount, item, is_explicit_income, payment_mode
+
+def extract_entry_date(item: str, today: date) -> tuple[date, str]:
+    """
+    Pulls a relative day word or the first parsable date expression out of a
+    note. Returns the transaction date (today when none is found) and the note
+    with that expression removed.
+    """
+    item, found = DAY_BEFORE_YESTERDAY_RE.subn('', item)
+    if found:
+        return today - timedelta(days=2), item
+    item, found = YESTERDAY_RE.subn('', item)
+    if found:
+        return today - timedelta(days=1), item
+    item, found = TODAY_RE.subn('', item)
+    if found:
+        return today, item
+
+    for pattern, to_ymd in DATE_FORMATS:
+        match: Optional[re.Match] = pattern.search(item)
+        if not match:
+            continue
+        year, month, day = to_ymd(match.groups())
+        try:
+            tx_date = today.replace(year=year or today.year, month=month, day=day)
+            if year is None and tx_date > today: tx_date = tx_date.replace(year=tx_date.year - 1)
+        except ValueError:
+            continue
+        return tx_date, item[:match.start()] + item[match.end():]
+
+    return today, item
+
+def strip_date_fillers(item: str) -> str:
+    item = TRAILING_ON_RE.sub('', item)
+    item = LEADING_ON_RE.sub('', item)
+    return MULTI_SPACE_RE.sub(' ', item).strip("- =:,+ ")
@@ -3,13 +3,12 @@ import string
 import random
 import traceback
 from datetime import datetime, timedelta
-from database import get_db
-from whatsapp_service import send_whatsapp_text, send_whatsapp_interactive_buttons
-from whatsapp_handlers.bot_utils import get_user_id, db_semaphore
+from database import db
+from whatsapp_service import send_whatsapp_text, outbox
+from whatsapp_handlers.bot_utils import get_user_id
 import json
 from whatsapp_handlers.groups_search import handle_group_search_command
 from whatsapp_handlers.split_parser import parse_and_compute_split, SplitError
-import asyncio
 
 def generate_invite_code():
     return ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
@@ -34,143 +33,137 @@ async def handle_group_commands(phone: str, text: str) -> bool:
             max_m = 20
             g_name = custom_name.strip().title() if custom_name else "Split Group"
 
-        async with db_semaphore:
-            conn = get_db()
-            std_cursor = conn.cursor()
-            user_id = get_user_id(std_cursor, phone)
-            std_cursor.close()
+        async with outbox() as out, db() as conn:
+            std_cursor = await conn.cursor()
+            user_id = await get_user_id(std_cursor, phone)
+            await std_cursor.close()
             
             if not user_id: return True
 
-            cursor = conn.cursor(dictionary=True)
+            cursor = await conn.cursor(dictionary=True)
             try:
-                cursor.execute("""
+                await cursor.execute("""
                     SELECT g.name FROM expense_groups g
                     JOIN group_members gm ON g.id = gm.group_id
                     WHERE gm.user_id = %s AND LOWER(g.name) = %s
                 """, (user_id, g_name.lower()))
                 
-                if cursor.fetchone():
-                    await send_whatsapp_text(phone, f"❌ You are already a member of a group named '{g_name}'. Please choose a different name.")
+                if await cursor.fetchone():
+                    out.text(phone, f"❌ You are already a member of a group named '{g_name}'. Please choose a different name.")
                     return True
 
                 code = generate_invite_code()
                 expires_at = datetime.now() + timedelta(minutes=30)
                 
-                cursor.execute("INSERT INTO expense_groups (type, name, created_by, max_members, status) VALUES (%s, %s, %s, %s, 'pending')", (g_type, g_name, user_id, max_m))
+                await cursor.execute("INSERT INTO expense_groups (type, name, created_by, max_members, status) VALUES (%s, %s, %s, %s, 'pending')", (g_type, g_name, user_id, max_m))
                 group_id = cursor.lastrowid
-                cursor.execute("INSERT INTO group_members (group_id, user_id, role) VALUES (%s, %s, 'admin')", (group_id, user_id))
-                cursor.execute("INSERT INTO invite_codes (group_id, code, created_by, expires_at) VALUES (%s, %s, %s, %s)", (group_id, code, user_id, expires_at))
-                conn.commit()
+                await cursor.execute("INSERT INTO group_members (group_id, user_id, role) VALUES (%s, %s, 'admin')", (group_id, user_id))
+                await cursor.execute("INSERT INTO invite_codes (group_id, code, created_by, expires_at) VALUES (%s, %s, %s, %s)", (group_id, code, user_id, expires_at))
+                await conn.commit()
                 
                 msg = f"🎉 {g_type.title()} Group *'{g_name}'* created!\n\nShare this code with your members:\n👉 *join {code}*\n\n_(Code expires in 30 minutes. Max members: {max_m})_"
-                await send_whatsapp_text(phone, msg)
+                out.text(phone, msg)
             except Exception as e:
-                conn.rollback()
+                await conn.rollback()
                 print(f"Create Group Error: {e}")
                 traceback.print_exc()
-                await send_whatsapp_text(phone, "⚠️ Failed to create group.")
+                out.text(phone, "⚠️ Failed to create group.")
             finally:
-                cursor.close()
-                conn.close()
+                await cursor.close()
         return True
 
     # 2. JOIN GROUP
     if text_lower.startswith("join "):
         code = text[5:].strip().upper()
-        async with db_semaphore:
-            conn = get_db()
-            std_cursor = conn.cursor()
-            user_id = get_user_id(std_cursor, phone)
-            std_cursor.close()
+        async with outbox() as out, db() as conn:
+            std_cursor = await conn.cursor()
+            user_id = await get_user_id(std_cursor, phone)
+            await std_cursor.close()
             
             if not user_id: return True
 
-            cursor = conn.cursor(dictionary=True)
+            cursor = await conn.cursor(dictionary=True)
             try:
-                cursor.execute("""
+                await cursor.execute("""
                     SELECT ic.*, g.name, g.type, g.max_members, g.status as group_status 
                     FROM invite_codes ic
                     JOIN expense_groups g ON g.id = ic.group_id
                     WHERE ic.code = %s
                 """, (code,))
-                invite = cursor.fetchone()
+                invite = await cursor.fetchone()
 
                 if not invite:
-                    await send_whatsapp_text(phone, "❌ Invalid invite code.")
+                    out.text(phone, "❌ Invalid invite code.")
                     return True
                 if invite['used']:
-                    await send_whatsapp_text(phone, "❌ This code has already been used.")
+                    out.text(phone, "❌ This code has already been used.")
                     return True
                 if datetime.now() > invite['expires_at']:
-                    await send_whatsapp_text(phone, "❌ Code expired. Ask them to create a new one.")
+                    out.text(phone, "❌ Code expired. Ask them to create a new one.")
                     return True
                 if invite['created_by'] == user_id:
-                    await send_whatsapp_text(phone, "❌ You can't join your own group!")
+                    out.text(phone, "❌ You can't join your own group!")
                     return True
 
-                cursor.execute("SELECT COUNT(*) as count FROM group_members WHERE group_id = %s", (invite['group_id'],))
-                member_count = cursor.fetchone()['count']
+                await cursor.execute("SELECT COUNT(*) as count FROM group_members WHERE group_id = %s", (invite['group_id'],))
+                member_count = (await cursor.fetchone())['count']
                 
                 if member_count >= invite['max_members']:
-                    await send_whatsapp_text(phone, f"❌ This {invite['type']} group is full (Max: {invite['max_members']}).")
+                    out.text(phone, f"❌ This {invite['type']} group is full (Max: {invite['max_members']}).")
                     return True
 
-                cursor.execute("INSERT INTO group_members (group_id, user_id, role) VALUES (%s, %s, 'member')", (invite['group_id'], user_id))
-                cursor.execute("UPDATE invite_codes SET used = TRUE WHERE id = %s", (invite['id'],))
-                cursor.execute("UPDATE expense_groups SET status = 'active' WHERE id = %s", (invite['group_id'],))
+                await cursor.execute("INSERT INTO group_members (group_id, user_id, role) VALUES (%s, %s, 'member')", (invite['group_id'], user_id))
+                await cursor.execute("UPDATE invite_codes SET used = TRUE WHERE id = %s", (invite['id'],))
+                await cursor.execute("UPDATE expense_groups SET status = 'active' WHERE id = %s", (invite['group_id'],))
                 
-                conn.commit()
-                await send_whatsapp_text(phone, f"✅ You're linked! You can now log shared expenses to *{invite['name']}* using:\n*@{invite['name'].split()[0].lower()} 500 dinner*")
+                await conn.commit()
+                out.text(phone, f"✅ You're linked! You can now log shared expenses to *{invite['name']}* using:\n*@{invite['name'].split()[0].lower()} 500 dinner*")
             except Exception as e:
-                conn.rollback()
+                await conn.rollback()
                 print(f"Join Group Error: {e}")
                 traceback.print_exc()
-                await send_whatsapp_text(phone, "⚠️ Failed to join group.")
+                out.text(phone, "⚠️ Failed to join group.")
             finally:
-                cursor.close()
-                conn.close()
+                await cursor.close()
         return True
 
     # 3. REFRESH CODE
     if text_lower.startswith("new code "):
         group_alias = text_lower[9:].strip()
-        async with db_semaphore:
-            conn = get_db()
-            std_cursor = conn.cursor()
-            user_id = get_user_id(std_cursor, phone)
-            std_cursor.close()
+        async with outbox() as out, db() as conn:
+            std_cursor = await conn.cursor()
+            user_id = await get_user_id(std_cursor, phone)
+            await std_cursor.close()
             
             if not user_id: return True
 
-            cursor = conn.cursor(dictionary=True)
+            cursor = await conn.cursor(dictionary=True)
             try:
-                cursor.execute("""
+                await cursor.execute("""
                     SELECT g.id, g.name FROM expense_groups g
                     JOIN group_members gm ON g.id = gm.group_id
                     WHERE gm.user_id = %s AND LOWER(g.name) LIKE %s LIMIT 1
                 """, (user_id, f"%{group_alias}%"))
-                group = cursor.fetchone()
+                group = await cursor.fetchone()
 
                 if not group:
-                    await send_whatsapp_text(phone, f"❌ You don't belong to any group matching '{group_alias}'.")
+                    out.text(phone, f"❌ You don't belong to any group matching '{group_alias}'.")
                     return True
 
                 new_code = generate_invite_code()
                 expires_at = datetime.now() + timedelta(minutes=30)
 
-                cursor.execute("UPDATE invite_codes SET expires_at = NOW() WHERE group_id = %s", (group['id'],))
-                cursor.execute("INSERT INTO invite_codes (group_id, code, created_by, expires_at) VALUES (%s, %s, %s, %s)", (group['id'], new_code, user_id, expires_at))
-                conn.commit()
+                await cursor.execute("UPDATE invite_codes SET expires_at = NOW() WHERE group_id = %s", (group['id'],))
+                await cursor.execute("INSERT INTO invite_codes (group_id, code, created_by, expires_at) VALUES (%s, %s, %s, %s)", (group['id'], new_code, user_id, expires_at))
+                await conn.commit()
                 
-                await send_whatsapp_text(phone, f"🔄 New code generated for *{group['name']}*:\n👉 *join {new_code}*\n\n_(Expires in 30 minutes)_")
+                out.text(phone, f"🔄 New code generated for *{group['name']}*:\n👉 *join {new_code}*\n\n_(Expires in 30 minutes)_")
             except Exception as e:
-                conn.rollback()
+                await conn.rollback()
                 print(f"Refresh Code Error: {e}")
-                await send_whatsapp_text(phone, "⚠️ Failed to generate new code.")
+                out.text(phone, "⚠️ Failed to generate new code.")
             finally:
-                cursor.close()
-                conn.close()
+                await cursor.close()
         return True
 
     # 4. SETTLE COMMAND: @group settle @username
@@ -179,40 +172,39 @@ async def handle_group_commands(phone: str, text: str) -> bool:
         group_alias = match_settle.group(1)
         target_name = match_settle.group(2)
         
-        async with db_semaphore:
-            conn = get_db()
-            std_cursor = conn.cursor()
-            user_id = get_user_id(std_cursor, phone)
-            std_cursor.close()
+        async with outbox() as out, db() as conn:
+            std_cursor = await conn.cursor()
+            user_id = await get_user_id(std_cursor, phone)
+            await std_cursor.close()
             if not user_id: return True
 
-            cursor = conn.cursor(dictionary=True)
+            cursor = await conn.cursor(dictionary=True)
             try:
                 # Get Group & Members
-                cursor.execute("""
+                await cursor.execute("""
                     SELECT g.id, g.name, u.name as my_name FROM expense_groups g
                     JOIN group_members gm ON g.id = gm.group_id
                     JOIN users u ON u.id = gm.user_id
                     WHERE gm.user_id = %s AND g.status = 'active' AND LOWER(g.name) LIKE %s LIMIT 1
                 """, (user_id, f"%{group_alias}%"))
-                group = cursor.fetchone()
+                group = await cursor.fetchone()
                 if not group:
-                    await send_whatsapp_text(phone, f"❌ You are not in an active group matching '{group_alias}'.")
+                    out.text(phone, f"❌ You are not in an active group matching '{group_alias}'.")
                     return True
 
-                cursor.execute("""
+                await cursor.execute("""
                     SELECT u.id, u.name, u.nickname, u.mobile FROM group_members gm 
                     JOIN users u ON u.id = gm.user_id WHERE gm.group_id = %s
                 """, (group['id'],))
-                members = cursor.fetchall()
+                members = await cursor.fetchall()
                 
                 target_user = next((m for m in members if m['name'].lower().split()[0] == target_name or m.get('nickname', '').lower() == target_name), None)
                 if not target_user:
-                    await send_whatsapp_text(phone, f"❌ @{target_name} is not in this group.")
+                    out.text(phone, f"❌ @{target_name} is not in this group.")
                     return True
 
-                cursor.execute("SELECT amount, logged_by, split_details FROM group_transactions WHERE group_id = %s", (group['id'],))
-                txns = cursor.fetchall()
+                await cursor.execute("SELECT amount, logged_by, split_details FROM group_transactions WHERE group_id = %s", (group['id'],))
+                txns = await cursor.fetchall()
                 
                 my_balance = 0.0
                 target_balance = 0.0
@@ -237,29 +229,28 @@ async def handle_group_commands(phone: str, text: str) -> bool:
                 amount_i_owe = abs(my_balance) if my_balance < 0 else 0
                 
                 if amount_i_owe < 0.01:
-                    await send_whatsapp_text(phone, f"✅ You are already settled up with {target_user['name'].split()[0]}.")
+                    out.text(phone, f"✅ You are already settled up with {target_user['name'].split()[0]}.")
                     return True
 
                 settle_details = {str(target_user['id']): amount_i_owe}
-                cursor.execute("""
+                await cursor.execute("""
                     INSERT INTO group_transactions (group_id, amount, description, logged_by, split_type, split_details)
                     VALUES (%s, %s, 'Settlement', %s, 'settlement', %s)
                 """, (group['id'], amount_i_owe, user_id, json.dumps(settle_details)))
-                conn.commit()
+                await conn.commit()
                 
-                await send_whatsapp_text(phone, f"✅ Marked as settled with @{target_name}. Total cleared: ₹{amount_i_owe:g}")
+                out.text(phone, f"✅ Marked as settled with @{target_name}. Total cleared: ₹{amount_i_owe:g}")
                 
                 if target_user['mobile']:
-                    await send_whatsapp_text(target_user['mobile'], f"💸 @{group['my_name'].split()[0]} marked ₹{amount_i_owe:g} as settled in *{group['name']}*.")
+                    out.text(target_user['mobile'], f"💸 @{group['my_name'].split()[0]} marked ₹{amount_i_owe:g} as settled in *{group['name']}*.")
 
             except Exception as e:
-                conn.rollback()
+                await conn.rollback()
                 print(f"Settlement Error: {e}")
                 traceback.print_exc()
-                await send_whatsapp_text(phone, "⚠️ Failed to settle transaction.")
+                out.text(phone, "⚠️ Failed to settle transaction.")
             finally:
-                cursor.close()
-                conn.close()
+                await cursor.close()
         return True
 
     # 5. LOG TRANSACTION (@alias 500 coffee 60% @alakh)
@@ -273,52 +264,51 @@ async def handle_group_commands(phone: str, text: str) -> bool:
             
         remaining_text = match_log.group(3).strip()
         
-        async with db_semaphore:
-            conn = get_db()
-            std_cursor = conn.cursor()
-            user_id = get_user_id(std_cursor, phone)
-            std_cursor.close()
+        async with outbox() as out, db() as conn:
+            std_cursor = await conn.cursor()
+            user_id = await get_user_id(std_cursor, phone)
+            await std_cursor.close()
             
             if not user_id: return True
 
-            cursor = conn.cursor(dictionary=True)
+            cursor = await conn.cursor(dictionary=True)
             try:
-                cursor.execute("""
+                await cursor.execute("""
                     SELECT g.id, g.name, u.name as my_name FROM expense_groups g
                     JOIN group_members gm ON g.id = gm.group_id
                     JOIN users u ON u.id = gm.user_id
                     WHERE gm.user_id = %s AND g.status = 'active' AND LOWER(g.name) LIKE %s LIMIT 1
                 """, (user_id, f"%{group_alias}%"))
-                group = cursor.fetchone()
+                group = await cursor.fetchone()
 
                 if not group:
-                    await send_whatsapp_text(phone, f"❌ You are not in an active group matching '{group_alias}'.")
+                    out.text(phone, f"❌ You are not in an active group matching '{group_alias}'.")
                     return True
 
-                cursor.execute("""
+                await cursor.execute("""
                     SELECT u.id, u.name, u.nickname, u.mobile 
                     FROM group_members gm JOIN users u ON u.id = gm.user_id 
                     WHERE gm.group_id = %s
                 """, (group['id'],))
-                members = cursor.fetchall()
+                members = await cursor.fetchall()
                 
                 # Use Parser Engine
                 try:
                     desc, split_type, shares = parse_and_compute_split(amount, remaining_text, members, user_id)
                 except SplitError as e:
-                    await send_whatsapp_text(phone, f"❌ {str(e)}")
+                    out.text(phone, f"❌ {str(e)}")
                     return True
                 
                 details_json = json.dumps(shares)
-                cursor.execute("""
+                await cursor.execute("""
                     INSERT INTO group_transactions (group_id, amount, description, logged_by, split_type, split_details)
                     VALUES (%s, %s, %s, %s, %s, %s)
                 """, (group['id'], amount, desc, user_id, split_type, details_json))
                 
-                conn.commit()
+                await conn.commit()
                 
                 # Notify sender
-                await send_whatsapp_text(phone, f"✅ Logged to *{group['name']}*:\n*{desc}* — ₹{amount:g} ({split_type.capitalize()} split)")
+                out.text(phone, f"✅ Logged to *{group['name']}*:\n*{desc}* — ₹{amount:g} ({split_type.capitalize()} split)")
                 
                 # Notify members who owe money
                 payer_name = group['my_name'].split()[0]
@@ -328,16 +318,15 @@ async def handle_group_commands(phone: str, text: str) -> bool:
                         target = next((m for m in members if m['id'] == uid), None)
                         if target and target['mobile']:
                             notif = f"🔔 *{payer_name}* split ₹{amount:g} for *{desc}* in *{group['name']}*.\n\nYour share: ₹{share_amt:g}\n👉 Reply `@{group['name'].split()[0].lower()} settle @{payer_name.lower()}` to mark as paid."
-                            asyncio.create_task(send_whatsapp_text(target['mobile'], notif))
+                            out.text(target['mobile'], notif)
                             
             except Exception as e:
-                conn.rollback()
+                await conn.rollback()
                 print(f"Log Group Txn Error: {e}")
                 traceback.print_exc()
-                await send_whatsapp_text(phone, "⚠️ Failed to log group transaction.")
+                out.text(phone, "⚠️ Failed to log group transaction.")
             finally:
-                cursor.close()
-                conn.close()
+                await cursor.close()
         return True
 
     # 6. EXECUTE DELETE
@@ -345,45 +334,43 @@ async def handle_group_commands(phone: str, text: str) -> bool:
     if match_rm:
         tx_id = int(match_rm.group(1))
         print(f"Executing Deletion: Attempting to remove Tx ID {tx_id} for user {phone}")
-        async with db_semaphore:
-            conn = get_db()
-            std_cursor = conn.cursor()
-            user_id = get_user_id(std_cursor, phone)
-            std_cursor.close()
+        async with outbox() as out, db() as conn:
+            std_cursor = await conn.cursor()
+            user_id = await get_user_id(std_cursor, phone)
+            await std_cursor.close()
             
             if not user_id: return True
 
-            cursor = conn.cursor(dictionary=True)
+            cursor = await conn.cursor(dictionary=True)
             try:
-                cursor.execute("""
+                await cursor.execute("""
                     SELECT gt.id, gt.description, gt.amount, g.name as group_name
                     FROM group_transactions gt
                     JOIN expense_groups g ON g.id = gt.group_id
                     WHERE gt.id = %s AND gt.logged_by = %s
                 """, (tx_id, user_id))
-                txn = cursor.fetchone()
+                txn = await cursor.fetchone()
 
                 if not txn:
                     print(f"Deletion Failed: Tx {tx_id} not found or permission denied.")
-                    await send_whatsapp_text(phone, "❌ Transaction not found or you don't have permission to delete it.")
+                    out.text(phone, "❌ Transaction not found or you don't have permission to delete it.")
                     return True
 
-                cursor.execute("DELETE FROM group_transactions WHERE id = %s", (tx_id,))
-                conn.commit()
+                await cursor.execute("DELETE FROM group_transactions WHERE id = %s", (tx_id,))
+                await conn.commit()
                 
                 if cursor.rowcount > 0:
                     desc_text = txn['description'] or "Transaction"
-                    await send_whatsapp_text(phone, f"🗑️ Successfully deleted: *{desc_text}* (₹{txn['amount']:g}) from *{txn['group_name']}*")
+                    out.text(phone, f"🗑️ Successfully deleted: *{desc_text}* (₹{txn['amount']:g}) from *{txn['group_name']}*")
                 else:
-                    await send_whatsapp_text(phone, "⚠️ Error: Could not verify deletion from database.")
+                    out.text(phone, "⚠️ Error: Could not verify deletion from database.")
             except Exception as e:
-                conn.rollback()
+                await conn.rollback()
                 print(f"Group RM Error: {e}")
                 traceback.print_exc()
-                await send_whatsapp_text(phone, "⚠️ Failed to delete transaction.")
+                out.text(phone, "⚠️ Failed to delete transaction.")
             finally:
-                cursor.close()
-                conn.close()
+                await cursor.close()
         return True
 
     # 7. ALL OTHER COMMANDS (Total, Search, History, Pagination)
@@ -397,11 +384,10 @@ async def handle_group_commands(phone: str, text: str) -> bool:
 
         # A) Total Command
         if base_cmd == "total":
-            async with db_semaphore:
-                conn = get_db()
-                cursor = conn.cursor(dictionary=True)
+            async with outbox() as out, db() as conn:
+                cursor = await conn.cursor(dictionary=True)
                 try:
-                    cursor.execute("""
+                    await cursor.execute("""
                         SELECT g.name, SUM(gt.amount) as total_spend
                         FROM expense_groups g
                         JOIN group_members gm ON g.id = gm.group_id
@@ -410,14 +396,13 @@ async def handle_group_commands(phone: str, text: str) -> bool:
                         AND g.status = 'active' AND LOWER(g.name) LIKE %s
                         GROUP BY g.id
                     """, (phone, f"%{group_alias}%"))
-                    res = cursor.fetchone()
+                    res = await cursor.fetchone()
                     if not res:
-                        await send_whatsapp_text(phone, f"❌ Group matching '{group_alias}' not found.")
+                        out.text(phone, f"❌ Group matching '{group_alias}' not found.")
                     else:
-                        await send_whatsapp_text(phone, f"💰 *Total Spends for {res['name']}*\n\nTotal: ₹{float(res['total_spend'] or 0):g}")
+                        out.text(phone, f"💰 *Total Spends for {res['name']}*\n\nTotal: ₹{float(res['total_spend'] or 0):g}")
                 finally:
-                    cursor.close()
-                    conn.close()
+                    await cursor.close()
             return True
 
         # B) Search/Find Command
@@ -455,37 +440,36 @@ async def process_group_query(phone: str, group_alias: str, cmd: str, page: int
     limit = 50 if is_all else 10
     offset = (page - 1) * limit
     
-    async with db_semaphore:
-        conn = get_db()
-        std_cursor = conn.cursor()
-        user_id = get_user_id(std_cursor, phone)
-        std_cursor.close()
+    async with outbox() as out, db() as conn:
+        std_cursor = await conn.cursor()
+        user_id = await get_user_id(std_cursor, phone)
+        await std_cursor.close()
         
         if not user_id: return
 
-        cursor = conn.cursor(dictionary=True)
+        cursor = await conn.cursor(dictionary=True)
         try:
-            cursor.execute("""
+            await cursor.execute("""
                 SELECT g.id, g.name FROM expense_groups g
                 JOIN group_members gm ON g.id = gm.group_id
                 WHERE gm.user_id = %s AND g.status = 'active' AND LOWER(g.name) LIKE %s LIMIT 1
             """, (user_id, f"%{group_alias}%"))
-            group = cursor.fetchone()
+            group = await cursor.fetchone()
             
             if not group:
-                await send_whatsapp_text(phone, f"❌ You are not in a group matching '{group_alias}'.")
+                out.text(phone, f"❌ You are not in a group matching '{group_alias}'.")
                 return
 
             if cmd == "undo":
-                cursor.execute("""
+                await cursor.execute("""
                     SELECT id, amount, description FROM group_transactions
                     WHERE group_id = %s AND logged_by = %s AND DATE(logged_at) = CURDATE()
                     ORDER BY logged_at DESC LIMIT 2
                 """, (group['id'], user_id))
-                txns = cursor.fetchall()
+                txns = await cursor.fetchall()
                 
                 if not txns:
-                    await send_whatsapp_text(phone, f"❌ No group transactions logged today to undo.")
+                    out.text(phone, f"❌ No group transactions logged today to undo.")
                     return
                 
                 btns = []
@@ -494,7 +478,7 @@ async def process_group_query(phone: str, group_alias: str, cmd: str, page: int
                     title = f"❌ {float(t['amount']):g} {desc_text}"
                     btns.append({"id": f"group rm {t['id']}", "title": title[:20]}) 
                     
-                await send_whatsapp_interactive_buttons(phone, f"Which entry in *{group['name']}* do you want to delete?", btns)
+                out.buttons(phone, f"Which entry in *{group['name']}* do you want to delete?", btns)
                 return
 
             date_filter = ""
@@ -503,18 +487,18 @@ async def process_group_query(phone: str, group_alias: str, cmd: str, page: int
             elif cmd == "week": date_filter = "AND gt.logged_at >= CURDATE() - INTERVAL 7 DAY"
             elif cmd == "month": date_filter = "AND MONTH(gt.logged_at) = MONTH(CURDATE()) AND YEAR(gt.logged_at) = YEAR(CURDATE())"
 
-            cursor.execute(f"""
+            await cursor.execute(f"""
                 SELECT gt.amount, gt.description, u.name as logged_by_name, gt.logged_at
                 FROM group_transactions gt
                 JOIN users u ON u.id = gt.logged_by
                 WHERE gt.group_id = %s {date_filter}
                 ORDER BY gt.logged_at DESC LIMIT {limit} OFFSET {offset}
             """, (group['id'],))
-            rows = cursor.fetchall()
+            rows = await cursor.fetchall()
 
             if not rows:
                 msg = "🏁 No more transactions to show." if page > 1 else f"📭 No transactions found."
-                await send_whatsapp_text(phone, msg)
+                out.text(phone, msg)
                 return
 
             page_total = sum(float(r['amount']) for r in rows)
@@ -529,19 +513,18 @@ async def process_group_query(phone: str, group_alias: str, cmd: str, page: int
             
             msg_lines.append(f"\n*Total:* ₹{page_total:g}")
 
-            cursor.execute(f"SELECT COUNT(*) as total_count FROM group_transactions gt WHERE gt.group_id = %s {date_filter}", (group['id'],))
-            total_records = cursor.fetchone()['total_count']
+            await cursor.execute(f"SELECT COUNT(*) as total_count FROM group_transactions gt WHERE gt.group_id = %s {date_filter}", (group['id'],))
+            total_records = (await cursor.fetchone())['total_count']
 
             if total_records > (offset + limit):
                 btn_cmd = f"group @{group_alias} {cmd} {page + 1}"
-                await send_whatsapp_interactive_buttons(phone, "\n".join(msg_lines), [{"id": btn_cmd, "title": "Show More"}])
+                out.buttons(phone, "\n".join(msg_lines), [{"id": btn_cmd, "title": "Show More"}])
             else:
-                await send_whatsapp_text(phone, "\n".join(msg_lines))
+                out.text(phone, "\n".join(msg_lines))
 
         except Exception as e:
             print(f"Group Query Error: {e}")
             traceback.print_exc()
-            await send_whatsapp_text(phone, "⚠️ Failed to fetch group data.")
+            out.text(phone, "⚠️ Failed to fetch group data.")
         finally:
-            cursor.close()
-            conn.close()
\ No newline at end of file
+            await cursor.close()
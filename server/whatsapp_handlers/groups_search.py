@@ -1,32 +1,31 @@
 from datetime import datetime
-from database import get_db
-from whatsapp_service import send_whatsapp_text
-from whatsapp_handlers.bot_utils import get_user_id, db_semaphore
+from database import db
+from whatsapp_service import outbox
+from whatsapp_handlers.bot_utils import get_user_id
 
 async def handle_group_search_command(phone: str, group_alias: str, query: str) -> bool:
-    async with db_semaphore:
-        conn = get_db()
-        std_cursor = conn.cursor()
-        user_id = get_user_id(std_cursor, phone)
-        std_cursor.close()
+    async with outbox() as out, db() as conn:
+        std_cursor = await conn.cursor()
+        user_id = await get_user_id(std_cursor, phone)
+        await std_cursor.close()
 
         if not user_id: return True
 
-        cursor = conn.cursor(dictionary=True)
+        cursor = await conn.cursor(dictionary=True)
         try:
-            cursor.execute("""
+            await cursor.execute("""
                 SELECT g.id, g.name FROM expense_groups g
                 JOIN group_members gm ON g.id = gm.group_id
                 WHERE gm.user_id = %s AND g.status = 'active' AND LOWER(g.name) LIKE %s LIMIT 1
             """, (user_id, f"%{group_alias}%"))
-            group = cursor.fetchone()
+            group = await cursor.fetchone()
 
             if not group:
-                await send_whatsapp_text(phone, f"❌ You are not in an active group matching '{group_alias}'.")
+                out.text(phone, f"❌ You are not in an active group matching '{group_alias}'.")
                 return True
 
             search_term = f"%{query.lower()}%"
-            cursor.execute("""
+            await cursor.execute("""
                 SELECT gt.id, gt.amount, gt.description, DATE(gt.logged_at) as date, 
                        u.name as logged_by_name, gt.logged_by as paid_by_user_id
                 FROM group_transactions gt
@@ -35,10 +34,10 @@ async def handle_group_search_command(phone: str, group_alias: str, query: str)
                 ORDER BY gt.logged_at DESC LIMIT 15
             """, (group['id'], search_term))
             
-            rows = cursor.fetchall()
+            rows = await cursor.fetchall()
             
             if not rows:
-                await send_whatsapp_text(phone, f"📭 No transactions found matching '{query}' in *{group['name']}*.")
+                out.text(phone, f"📭 No transactions found matching '{query}' in *{group['name']}*.")
                 return True
 
             total_amount = sum(float(r['amount']) for r in rows)
@@ -55,12 +54,11 @@ async def handle_group_search_command(phone: str, group_alias: str, query: str)
             
             msg_lines.append(f"\n*Total Found:* ₹{total_amount:g}")
             
-            await send_whatsapp_text(phone, "\n".join(msg_lines))
+            out.text(phone, "\n".join(msg_lines))
             
         except Exception as e:
             print(f"Group Search Error: {e}")
-            await send_whatsapp_text(phone, "⚠️ Failed to search group transactions.")
+            out.text(phone, "⚠️ Failed to search group transactions.")
         finally:
-            cursor.close()
-            conn.close()
+            await cursor.close()
     return True
\ No newline at end of file
@@ -1,133 +1,135 @@
 import calendar
-from datetime import datetime, timedelta
-from database import get_db
+from datetime import date, datetime, timedelta
+from database import db
 from whatsapp_service import send_whatsapp_text, send_whatsapp_template, send_whatsapp_interactive_buttons
 from constants import TEMPLATE_OVERVIEW, TEMPLATE_WEEKLY
-from whatsapp_handlers.bot_utils import get_user_id, db_semaphore
+from outbound_scheduler import LANE_INTERACTIVE
+from utils import get_date_range
+
+REPORT_SQL = """
+    SELECT u.id, t.date, t.amount, t.note, t.type
+    FROM users u
+    LEFT JOIN transactions t ON t.user_id = u.id {type_filter} AND t.date >= %s AND t.date < %s
+    WHERE u.mobile = %s
+    ORDER BY t.id DESC
+"""
+DAILY_EXPENSE_SQL = """
+    SELECT u.id, d.day, SUM(d.total)
+    FROM users u
+    LEFT JOIN user_daily_totals d ON d.user_id = u.id AND d.type = 'expense' AND d.day >= %s AND d.day < %s
+    WHERE u.mobile = %s
+    GROUP BY u.id, d.day
+"""
+TOP_EXPENSE_SQL = """
+    SELECT note, amount FROM transactions
+    WHERE user_id = %s AND type = 'expense' AND date >= %s AND date < %s
+    ORDER BY amount DESC, id DESC LIMIT 1
+"""
+
+async def fetch_report_rows(phone: str, start: datetime, end: datetime, expense_only: bool = True) -> tuple[int | None, list[tuple]]:
+    """
+    Resolves the user by phone and returns their (date, amount, note, type)
+    transaction rows inside [start, end), newest first. Only for listings;
+    totals come from fetch_daily_expenses.
+    """
+    type_filter = "AND t.type = 'expense'" if expense_only else ""
+    async with db() as conn:
+        cursor = await conn.cursor()
+        await cursor.execute(REPORT_SQL.format(type_filter=type_filter), (start, end, phone))
+        rows = [tuple(r) for r in await cursor.fetchall()]
+        await cursor.close()
+        
+    if not rows:
+        return None, []
+    return rows[0][0], [r[1:] for r in rows if r[1] is not None]
+
+async def fetch_daily_expenses(phone: str, start: datetime, end: datetime, top_since: datetime | None = None) -> tuple[int | None, dict[date, float], tuple | None]:
+    """
+    Resolves the user by phone and returns their expense total per day inside
+    [start, end) from user_daily_totals, so report cost follows the number of
+    days rather than transactions. With top_since, also returns the largest
+    single expense in [top_since, end) as (note, amount).
+    """
+    top = None
+    async with db() as conn:
+        cursor = await conn.cursor()
+        await cursor.execute(DAILY_EXPENSE_SQL, (start, end, phone))
+        rows = [tuple(r) for r in await cursor.fetchall()]
+        if rows and top_since is not None:
+            await cursor.execute(TOP_EXPENSE_SQL, (rows[0][0], top_since, end))
+            top = await cursor.fetchone()
+        await cursor.close()
+
+    if not rows:
+        return None, {}, None
+    return rows[0][0], {r[1]: float(str(r[2])) for r in rows if r[1] is not None}, top
 
 async def handle_summary_request(phone: str):
-    conn = None
-    cursor = None
-    async with db_semaphore:
-        try:
-            conn = get_db()
-            cursor = conn.cursor()
-            user_id = get_user_id(cursor, phone)
-            
-            if not user_id:
-                await send_whatsapp_text(phone, "You haven't made any entries yet. Try sending `100 lunch` to start!")
-                return
-            
-            cursor.execute("SELECT SUM(amount) FROM transactions WHERE user_id=%s AND type='expense' AND DATE(date)=CURDATE()", (user_id,))
-            t_row = tuple(cursor.fetchone() or ())
-            today_total = float(str(t_row[0])) if t_row and t_row[0] else 0.0
-            
-            cursor.execute("SELECT SUM(amount) FROM transactions WHERE user_id=%s AND type='expense' AND YEARWEEK(date, 1)=YEARWEEK(CURDATE(), 1)", (user_id,))
-            w_row = tuple(cursor.fetchone() or ())
-            week_total = float(str(w_row[0])) if w_row and w_row[0] else 0.0
-            
-            cursor.execute("SELECT SUM(amount) FROM transactions WHERE user_id=%s AND type='expense' AND MONTH(date)=MONTH(CURDATE())", (user_id,))
-            m_row = tuple(cursor.fetchone() or ())
-            month_total = float(str(m_row[0])) if m_row and m_row[0] else 0.0
+    day_start, day_end = get_date_range("day")
+    week_start, week_end = get_date_range("week")
+    month_start, month_end = get_date_range("month")
+    
+    user_id, days, top = await fetch_daily_expenses(phone, min(week_start, month_start), max(week_end, month_end), top_since=month_start)
+    if not user_id:
+        await send_whatsapp_text(phone, "You haven't made any entries yet. Try sending `100 lunch` to start!")
+        return
+    
+    def total(start: datetime, end: datetime) -> float:
+        return sum(amt for day, amt in days.items() if start.date() <= day < end.date())
 
-            cursor.execute("SELECT note, amount FROM transactions WHERE user_id=%s AND type='expense' AND MONTH(date)=MONTH(CURDATE()) ORDER BY amount DESC LIMIT 1", (user_id,))
-            h_row = tuple(cursor.fetchone() or ())
-            highest_item = str(h_row[0]) if h_row and h_row[0] else "None"
-            highest_amount = float(str(h_row[1])) if h_row else 0.0
-        finally:
-            if cursor: 
-                try: cursor.close()
-                except: pass
-            if conn: 
-                try: conn.close()
-                except: pass
+    today_total, week_total, month_total = total(day_start, day_end), total(week_start, week_end), total(month_start, month_end)
+    highest_item, highest_amount = "None", 0.0
+    if top and float(str(top[1])) > 0:
+        highest_item, highest_amount = str(top[0]) if top[0] else "None", float(str(top[1]))
             
     await send_whatsapp_template(phone, TEMPLATE_OVERVIEW, [f"{today_total:g}", f"{week_total:g}", f"{month_total:g}", highest_item, f"{highest_amount:g}"])
 
 async def handle_weekly_request(phone: str):
-    conn = None
-    cursor = None
-    async with db_semaphore:
-        try:
-            conn = get_db()
-            cursor = conn.cursor()
-            user_id = get_user_id(cursor, phone)
-            if not user_id: return
-            
-            cursor.execute("SELECT WEEKDAY(date), SUM(amount) FROM transactions WHERE user_id = %s AND type = 'expense' AND YEARWEEK(date, 1) = YEARWEEK(CURDATE(), 1) GROUP BY WEEKDAY(date)", (user_id,))
-            days = [0.0] * 7 
-            for row in cursor.fetchall():
-                r = tuple(row)
-                days[int(str(r[0]))] = float(str(r[1]))
-        finally:
-            if cursor: 
-                try: cursor.close()
-                except: pass
-            if conn: 
-                try: conn.close()
-                except: pass
+    user_id, totals, _ = await fetch_daily_expenses(phone, *get_date_range("week"))
+    if not user_id: return
+    
+    days = [0.0] * 7 
+    for day, amount in totals.items():
+        days[day.weekday()] += amount
             
     week_total = sum(days)
     variables = [f"{week_total:g}"] + [f"{d:g}" for d in days]
     await send_whatsapp_template(phone, TEMPLATE_WEEKLY, variables)
 
-async def handle_monthly_request(phone: str, is_end_of_month: bool = False, template_name: str = "monthly_overview"):
-    conn = None
-    cursor = None
-    async with db_semaphore:
-        try:
-            conn = get_db()
-            cursor = conn.cursor()
-            user_id = get_user_id(cursor, phone)
-            if not user_id: return
-            
-            ist_now = datetime.utcnow() + timedelta(hours=5, minutes=30)
-            year = ist_now.year
-            month = ist_now.month
-            current_day = ist_now.day
-            
-            cal = calendar.monthcalendar(year, month)
-            day_to_week_idx = {}
-            current_week_idx = 4
-            
-            for week_idx, week_days in enumerate(cal):
-                for day in week_days:
-                    if day != 0:
-                        clamped_idx = min(week_idx, 4) 
-                        day_to_week_idx[day] = clamped_idx
-                        if not is_end_of_month and day == current_day:
-                            current_week_idx = clamped_idx
-            
-            cursor.execute("""
-                SELECT DAY(date), SUM(amount) 
-                FROM transactions 
-                WHERE user_id = %s AND type = 'expense' AND MONTH(date) = %s AND YEAR(date) = %s 
-                GROUP BY DAY(date)
-            """, (user_id, month, year))
-            
-            weeks = [0.0, 0.0, 0.0, 0.0, 0.0]
-            month_total = 0.0
-            
-            for row in cursor.fetchall():
-                r = tuple(row)
-                day, amt = int(str(r[0])), float(str(r[1]))
-                month_total += amt
-                if day in day_to_week_idx:
-                    w_idx = day_to_week_idx[day]
-                    weeks[w_idx] += amt
-        finally:
-            if cursor: 
-                try: cursor.close()
-                except: pass
-            if conn: 
-                try: conn.close()
-                except: pass
+async def handle_monthly_request(phone: str, is_end_of_month: bool = False, template_name: str = "monthly_overview", lane: str = LANE_INTERACTIVE):
+    user_id, totals, _ = await fetch_daily_expenses(phone, *get_date_range("month"))
+    if not user_id: return
+    
+    ist_now = datetime.utcnow() + timedelta(hours=5, minutes=30)
+    year = ist_now.year
+    month = ist_now.month
+    current_day = ist_now.day
+    
+    cal = calendar.monthcalendar(year, month)
+    day_to_week_idx = {}
+    current_week_idx = 4
+    
+    for week_idx, week_days in enumerate(cal):
+        for day in week_days:
+            if day != 0:
+                clamped_idx = min(week_idx, 4) 
+                day_to_week_idx[day] = clamped_idx
+                if not is_end_of_month and day == current_day:
+                    current_week_idx = clamped_idx
+    
+    weeks = [0.0, 0.0, 0.0, 0.0, 0.0]
+    month_total = 0.0
+    
+    for day, amount in totals.items():
+        month_total += amount
+        if day.day in day_to_week_idx:
+            weeks[day_to_week_idx[day.day]] += amount
             
     if is_end_of_month:
         _, days_in_month = calendar.monthrange(year, month)
         avg_daily = month_total / days_in_month if days_in_month > 0 else 0.0
         variables = [f"{month_total:g}", f"{weeks[0]:g}", f"{weeks[1]:g}", f"{weeks[2]:g}", f"{weeks[3]:g}", f"{weeks[4]:g}", f"{avg_daily:.0f}"]
-        await send_whatsapp_template(phone, template_name, variables)
+        await send_whatsapp_template(phone, template_name, variables, lane=lane)
         return
 
     avg_daily = month_total / current_day if current_day > 0 else 0.0
@@ -141,38 +143,17 @@ async def handle_monthly_request(phone: str, is_end_of_month: bool = False, temp
     lines.append(f"The average per day is ₹{avg_daily:.0f}.")
     lines.append("")
     lines.append("This reflects your notes up to today.")
-    await send_whatsapp_text(phone, "\n".join(lines))
+    await send_whatsapp_text(phone, "\n".join(lines), lane=lane)
 
 async def handle_today_request(phone: str):
-    conn = None
-    cursor = None
     transactions = []
-    async with db_semaphore:
-        try:
-            conn = get_db()
-            cursor = conn.cursor()
-            user_id = get_user_id(cursor, phone)
-            if not user_id:
-                await send_whatsapp_text(phone, "✨ *No transactions today!* Your wallet is happy.")
-                return
-            cursor.execute("""
-                SELECT amount, note, type 
-                FROM transactions 
-                WHERE user_id = %s AND DATE(date) = CURDATE()
-                ORDER BY id DESC
-            """, (user_id,))
-            transactions = cursor.fetchall()
-        except Exception as e:
-            print(f"Today Request Error: {e}")
-            await send_whatsapp_text(phone, "⚠️ Sorry, I couldn't fetch today's data.")
-            return
-        finally:
-            if cursor: 
-                try: cursor.close()
-                except: pass
-            if conn: 
-                try: conn.close()
-                except: pass
+    try:
+        _, rows = await fetch_report_rows(phone, *get_date_range("day"), expense_only=False)
+        transactions = [(amount, note, t_type) for _, amount, note, t_type in rows]
+    except Exception as e:
+        print(f"Today Request Error: {e}")
+        await send_whatsapp_text(phone, "⚠️ Sorry, I couldn't fetch today's data.")
+        return
             
     if not transactions:
         await send_whatsapp_text(phone, "✨ *No transactions today!* Your wallet is happy.")
@@ -1,246 +1,139 @@
 import re, traceback, asyncio, random
-from typing import Any
+from typing import Any, Optional
 from datetime import datetime, timedelta
-from database import get_db
-from whatsapp_service import send_whatsapp_template, send_whatsapp_text, send_whatsapp_interactive_buttons
+from database import db, mark_user_write_async
+from rollups import record_transaction_async, record_transactions_async, remove_transaction_async
+from user_directory import user_directory
+from rule_cache import rule_cache
+from category_matcher import CategoryMatcher
+from whatsapp_service import send_whatsapp_template, send_whatsapp_text, send_whatsapp_interactive_buttons, outbox
 from constants import INCOME_KEYWORDS, BUDGET_THRESHOLD_WARNING, TEMPLATE_ENTRY_RECORDED, TEMPLATE_DATED_ENTRY_RECORDED
-from whatsapp_handlers.bot_utils import get_user_id, db_semaphore, send_delayed_message, log_bot_command
+from whatsapp_handlers.bot_utils import get_user_id, send_delayed_message, log_bot_command
+from whatsapp_handlers.entry_parser import extract_entry_date, strip_date_fillers
 
 hint_tracker: dict[str, dict[str, Any]] = {}
 
-async def handle_transaction_entry(phone: str, amount: float, item: str, silent: bool = False, sender_name: str = "WhatsApp User", explicit_income: bool = False, payment_mode: str = "Cash") -> bool:
+def _prepare_entry(item: str, explicit_income: bool, ist_now: datetime) -> tuple[str, datetime, str]:
     clean_item = item.replace('\n', ', ').replace('\r', '')
     clean_item = re.sub(r'\s{2,}', ' ', clean_item)
     clean_item = clean_item.strip("- =:,+")
     clean_item = clean_item[:240] 
     
-    ist_now = datetime.utcnow() + timedelta(hours=5, minutes=30)
-    tx_date = ist_now.date()
-    
-    if re.search(r'\bday before yesterday\b', clean_item, re.IGNORECASE):
-        tx_date = tx_date - timedelta(days=2)
-        clean_item = re.sub(r'(?i)\bday before yesterday\b', '', clean_item)
-    elif re.search(r'\byesterday\b', clean_item, re.IGNORECASE):
-        tx_date = tx_date - timedelta(days=1)
-        clean_item = re.sub(r'(?i)\byesterday\b', '', clean_item)
-    elif re.search(r'\btoday\b', clean_item, re.IGNORECASE):
-        clean_item = re.sub(r'(?i)\btoday\b', '', clean_item)
-    else:
-        months_regex = r'(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*'
-        month_map = {'jan':1, 'feb':2, 'mar':3, 'apr':4, 'may':5, 'jun':6, 'jul':7, 'aug':8, 'sep':9, 'oct':10, 'nov':11, 'dec':12}
-        
-        def parse_year(y_str):
-            y = int(y_str)
-            return 2000 + y if y < 100 else y
-
-        matched = False
-
-        # Format A: YYYY-MM-DD or YYYY/MM/DD
-        m_rev = re.search(r'\b(\d{4})[-/](\d{1,2})[-/](\d{1,2})\b', clean_item)
-        if m_rev:
-            try:
-                tx_date = tx_date.replace(year=int(m_rev.group(1)), month=int(m_rev.group(2)), day=int(m_rev.group(3)))
-                clean_item = clean_item[:m_rev.start()] + clean_item[m_rev.end():]
-                matched = True
-            except ValueError: pass
-
-        # Format B: DD/MM/YYYY or DD-MM-YYYY or DD/MM/YY
-        if not matched:
-            m_fwd = re.search(r'\b(\d{1,2})[-/](\d{1,2})[-/](\d{2,4})\b', clean_item)
-            if m_fwd:
-                try:
-                    tx_date = tx_date.replace(year=parse_year(m_fwd.group(3)), month=int(m_fwd.group(2)), day=int(m_fwd.group(1)))
-                    clean_item = clean_item[:m_fwd.start()] + clean_item[m_fwd.end():]
-                    matched = True
-                except ValueError: pass
-
-        # Format C: DD Month YYYY (e.g., 15 Jan 2024)
-        if not matched:
-            m_txt_y1 = re.search(rf'\b(\d{{1,2}})(?:st|nd|rd|th)?\s+{months_regex}\s+(\d{{2,4}})\b', clean_item, re.IGNORECASE)
-            if m_txt_y1:
-                try:
-                    tx_date = tx_date.replace(year=parse_year(m_txt_y1.group(3)), month=month_map[m_txt_y1.group(2).lower()[:3]], day=int(m_txt_y1.group(1)))
-                    clean_item = clean_item[:m_txt_y1.start()] + clean_item[m_txt_y1.end():]
-                    matched = True
-                except ValueError: pass
-
-        # Format D: Month DD YYYY (e.g., Jan 15th 2024)
-        if not matched:
-            m_txt_y2 = re.search(rf'\b{months_regex}\s+(\d{{1,2}})(?:st|nd|rd|th)?\s*,?\s*(\d{{2,4}})\b', clean_item, re.IGNORECASE)
-            if m_txt_y2:
-                try:
-                    tx_date = tx_date.replace(year=parse_year(m_txt_y2.group(3)), month=month_map[m_txt_y2.group(1).lower()[:3]], day=int(m_txt_y2.group(2)))
-                    clean_item = clean_item[:m_txt_y2.start()] + clean_item[m_txt_y2.end():]
-                    matched = True
-                except ValueError: pass
-
-        # Format E: DD/MM (No Year)
-        if not matched:
-            m_short = re.search(r'\b(\d{1,2})[-/](\d{1,2})\b', clean_item)
-            if m_short:
-                try:
-                    tx_date = tx_date.replace(month=int(m_short.group(2)), day=int(m_short.group(1)))
-                    clean_item = clean_item[:m_short.start()] + clean_item[m_short.end():]
-                    if tx_date > ist_now.date(): tx_date = tx_date.replace(year=tx_date.year - 1)
-                    matched = True
-                except ValueError: pass
-
-        # Format F: DD Month (No Year)
-        if not matched:
-            m_txt_s1 = re.search(rf'\b(\d{{1,2}})(?:st|nd|rd|th)?\s+{months_regex}\b', clean_item, re.IGNORECASE)
-            if m_txt_s1:
-                try:
-                    tx_date = tx_date.replace(month=month_map[m_txt_s1.group(2).lower()[:3]], day=int(m_txt_s1.group(1)))
-                    clean_item = clean_item[:m_txt_s1.start()] + clean_item[m_txt_s1.end():]
-                    if tx_date > ist_now.date(): tx_date = tx_date.replace(year=tx_date.year - 1)
-                    matched = True
-                except ValueError: pass
-
-        # Format G: Month DD (No Year)
-        if not matched:
-            m_txt_s2 = re.search(rf'\b{months_regex}\s+(\d{{1,2}})(?:st|nd|rd|th)?\b', clean_item, re.IGNORECASE)
-            if m_txt_s2:
-                try:
-                    tx_date = tx_date.replace(month=month_map[m_txt_s2.group(1).lower()[:3]], day=int(m_txt_s2.group(2)))
-                    clean_item = clean_item[:m_txt_s2.start()] + clean_item[m_txt_s2.end():]
-                    if tx_date > ist_now.date(): tx_date = tx_date.replace(year=tx_date.year - 1)
-                    matched = True
-                except ValueError: pass
-
-    clean_item = re.sub(r'\bon\b\s*$', '', clean_item, flags=re.IGNORECASE)
-    clean_item = re.sub(r'^\s*\bon\b', '', clean_item, flags=re.IGNORECASE)
-    clean_item = re.sub(r'\s{2,}', ' ', clean_item).strip("- =:,+ ")
+    tx_date, clean_item = extract_entry_date(clean_item, ist_now.date())
+    clean_item = strip_date_fillers(clean_item)
     if not clean_item:
         clean_item = "Expense" if not explicit_income else "Income"
 
-    transaction_datetime = datetime.combine(tx_date, ist_now.time())
-
     item_lower = clean_item.lower()
     is_income = explicit_income or any(keyword in item_lower for keyword in INCOME_KEYWORDS)
-    tx_type = 'income' if is_income else 'expense'
+    return clean_item, datetime.combine(tx_date, ist_now.time()), 'income' if is_income else 'expense'
+
+def _resolve_category(matcher: CategoryMatcher, clean_item: str, tx_type: str) -> tuple[str, str, str, str]:
+    """Returns (note, category name, icon, color); a leading/trailing category name is cut from the note."""
+    item_lower = clean_item.lower()
+    if tx_type == "expense":
+        target_category_name = "Misc Expenses"
+        cat_icon = "🧾"
+        cat_color = "#94A3B8"
+    else:
+        target_category_name = "Misc Income"
+        cat_icon = "💵"
+        cat_color = "#10B981"
+    
+    words = clean_item.split(' ') if clean_item else []
+    first_word = words[0].lower() if len(words) > 0 else ""
+    last_word = words[-1].lower() if len(words) > 1 else ""
+    
+    explicit = matcher.match_explicit(first_word, last_word)
+    if explicit:
+        gc, matched_first = explicit
+        matched_word = words[0] if matched_first else words[-1]
+        original_text = clean_item 
+        clean_item = re.sub(r'\b' + re.escape(matched_word) + r'\b', '', clean_item, count=1, flags=re.IGNORECASE)
+        clean_item = clean_item.strip("- =:, +").strip()
+        
+        if not clean_item: 
+            clean_item = original_text 
+        return clean_item, gc['name'], gc['icon'], gc['color']
+    
+    gc = matcher.match_keywords(item_lower)
+    if gc:
+        return clean_item, gc['name'], gc['icon'] or "📝", gc['color'] or ("#6366F1" if tx_type == "expense" else "#10B981")
+    return clean_item, target_category_name, cat_icon, cat_color
+
+async def _create_category(cursor: Any, user_id: int, name: str, tx_type: str, icon: str, color: str) -> int:
+    await cursor.execute("""
+        INSERT INTO categories (user_id, name, type, icon, color, is_default) 
+        VALUES (%s, %s, %s, %s, %s, TRUE)
+    """, (user_id, name, tx_type, icon, color))
+    return cursor.lastrowid
+
+async def _recorded_lines(cursor: Any, source_message_id: Optional[str]) -> set[int]:
+    """Lines of source_message_id already saved by an earlier attempt at the same inbound job."""
+    if not source_message_id:
+        return set()
+    await cursor.execute("SELECT source_line FROM transactions WHERE source_message_id = %s", (source_message_id,))
+    return {int(r[0]) for r in await cursor.fetchall()}
+
+async def handle_transaction_entry(phone: str, amount: float, item: str, silent: bool = False, sender_name: str = "WhatsApp User", explicit_income: bool = False, payment_mode: str = "Cash", source_message_id: Optional[str] = None) -> bool:
+    ist_now = datetime.utcnow() + timedelta(hours=5, minutes=30)
+    clean_item, transaction_datetime, tx_type = _prepare_entry(item, explicit_income, ist_now)
+    tx_date = transaction_datetime.date()
+    is_income = tx_type == 'income'
 
-    conn = None
-    cursor = None
     today_total = 0.0
     budget_note = ""
     success = False
     dynamic_hints = []
 
-    async with db_semaphore:
-        try:
-            conn = get_db()
-            cursor = conn.cursor()
+    try:
+        async with db() as conn:
+            cursor = await conn.cursor()
             
-            cursor.execute("SELECT id, monthly_budget FROM users WHERE mobile = %s", (phone,))
-            user_data = cursor.fetchone()
-            u_data = tuple(user_data) if user_data else ()
+            u_data = await user_directory.get(phone, cursor)
             
             if not u_data:
-                cursor.execute("INSERT INTO users (mobile, name, is_verified) VALUES (%s, %s, TRUE)", (phone, sender_name))
-                conn.commit()
+                await cursor.execute("INSERT INTO users (mobile, name, is_verified) VALUES (%s, %s, TRUE)", (phone, sender_name))
+                await conn.commit()
                 user_id = cursor.lastrowid
                 budget_limit = 0.0
             else:
-                user_id = int(str(u_data[0]))
-                budget_limit = float(str(u_data[1])) if u_data[1] else 0.0
-
-            cursor.execute("SELECT trigger_keywords FROM auto_replies WHERE is_active = TRUE")
-            ar_rows = cursor.fetchall()
-            if ar_rows:
-                for ar in ar_rows:
-                    try:
-                        kws_str = str(ar[0]) if isinstance(ar, (tuple, list)) else str(ar.get('trigger_keywords', ''))
-                        first_kw = kws_str.split(',')[0].strip()
-                        if first_kw: dynamic_hints.append(f'Type "{first_kw}" to see a custom reply.')
-                    except: pass
-            
-            cursor.execute("SELECT name, keywords, icon, color FROM global_categories WHERE type = %s", (tx_type,))
-            global_cats = cursor.fetchall()
-            
-            if tx_type == "expense":
-                target_category_name = "Misc Expenses"
-                cat_icon = "🧾"
-                cat_color = "#94A3B8"
-            else:
-                target_category_name = "Misc Income"
-                cat_icon = "💵"
-                cat_color = "#10B981"
-            
-            explicit_category_found = False
-            words = clean_item.split(' ') if clean_item else []
-            first_word = words[0].lower() if len(words) > 0 else ""
-            last_word = words[-1].lower() if len(words) > 1 else ""
+                user_id = int(u_data['id'])
+                budget_limit = float(str(u_data['monthly_budget'])) if u_data['monthly_budget'] else 0.0
+
+            for ar in await rule_cache.auto_replies(cursor):
+                if ar['keywords']: dynamic_hints.append(f'Type "{ar["keywords"][0]}" to see a custom reply.')
             
-            if global_cats:
-                for gc in global_cats:
-                    gc_name = str(gc[0]) if isinstance(gc, tuple) else gc['name']
-                    aliases = [gc_name.lower()]
-                    if "&" in gc_name: aliases.extend([a.strip().lower() for a in gc_name.split("&")])
-                        
-                    matched_word = None
-                    if first_word in aliases: matched_word = words[0]
-                    elif last_word in aliases: matched_word = words[-1]
-                        
-                    if matched_word:
-                        target_category_name = gc_name
-                        cat_icon = str(gc[2]) if isinstance(gc, tuple) else gc['icon']
-                        cat_color = str(gc[3]) if isinstance(gc, tuple) else gc['color']
-                        explicit_category_found = True
-                        original_text = clean_item 
-                        clean_item = re.sub(r'\b' + re.escape(matched_word) + r'\b', '', clean_item, count=1, flags=re.IGNORECASE)
-                        clean_item = clean_item.strip("- =:, +").strip()
-                        
-                        if not clean_item: 
-                            clean_item = original_text 
-                        
-                        break
-                
-                if not explicit_category_found:
-                    for gc in global_cats:
-                        if isinstance(gc, tuple):
-                            gc_name, gc_keys, gc_icon, gc_color = str(gc[0]), str(gc[1]), str(gc[2]), str(gc[3])
-                        else:
-                            gc_name, gc_keys, gc_icon, gc_color = gc['name'], gc['keywords'], gc['icon'], gc['color']
-                        
-                        aliases = [gc_name.lower()]
-                        if "&" in gc_name: aliases.extend([a.strip().lower() for a in gc_name.split("&")])
-                            
-                        kws = aliases
-                        if gc_keys and gc_keys.lower() != 'none':
-                            kws.extend([k.strip().lower() for k in gc_keys.split(',')])
-                            
-                        if any(kw in item_lower for kw in kws):
-                            target_category_name = gc_name
-                            cat_icon = gc_icon or "📝"
-                            cat_color = gc_color or ("#6366F1" if tx_type == "expense" else "#10B981")
-                            break
+            matcher = await rule_cache.category_matcher(tx_type, cursor)
+            clean_item, target_category_name, cat_icon, cat_color = _resolve_category(matcher, clean_item, tx_type)
             
-            cursor.execute("""
+            await cursor.execute("""
                 SELECT id FROM categories 
                 WHERE (user_id = %s OR user_id IS NULL) AND name = %s AND type = %s 
                 ORDER BY user_id DESC LIMIT 1
             """, (user_id, target_category_name, tx_type))
-            cat_row = cursor.fetchone()
+            cat_row = await cursor.fetchone()
             
             if cat_row:
-                category_id = int(cat_row[0] if isinstance(cat_row, (tuple, list)) else cat_row['id'])
+                category_id = int(cat_row[0])
             else:
-                cursor.execute("""
-                    INSERT INTO categories (user_id, name, type, icon, color, is_default) 
-                    VALUES (%s, %s, %s, %s, %s, TRUE)
-                """, (user_id, target_category_name, tx_type, cat_icon, cat_color))
-                conn.commit()
-                category_id = cursor.lastrowid
+                category_id = await _create_category(cursor, user_id, target_category_name, tx_type, cat_icon, cat_color)
+                await conn.commit()
             
-            cursor.execute("""
-                INSERT INTO transactions (user_id, amount, type, note, date, category_id, payment_mode) 
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """, (user_id, amount, tx_type, clean_item, transaction_datetime, category_id, payment_mode))
-            conn.commit()
+            if 0 in await _recorded_lines(cursor, source_message_id):
+                print(f"↩️ Entry from {source_message_id} already saved, not inserting again")
+            else:
+                await cursor.execute("""
+                    INSERT INTO transactions (user_id, amount, type, note, date, category_id, payment_mode, source_message_id, source_line) 
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """, (user_id, amount, tx_type, clean_item, transaction_datetime, category_id, payment_mode, source_message_id, 0 if source_message_id else None))
+                await record_transaction_async(cursor, user_id, transaction_datetime, category_id, tx_type, amount)
+                await mark_user_write_async(cursor, user_id)
+                await conn.commit()
             
             if tx_type == 'expense' and budget_limit > 0:
-                cursor.execute("SELECT SUM(amount) FROM transactions WHERE user_id = %s AND type = 'expense' AND MONTH(date) = MONTH(CURDATE())", (user_id,))
-                month_row = tuple(cursor.fetchone() or (0,))
+                await cursor.execute("SELECT SUM(total) FROM user_daily_totals WHERE user_id = %s AND type = 'expense' AND day >= DATE_FORMAT(CURDATE(), '%Y-%m-01')", (user_id,))
+                month_row = tuple(await cursor.fetchone() or (0,))
                 month_total = float(str(month_row[0])) if month_row[0] else 0.0
                 
                 remaining = budget_limit - month_total
@@ -251,21 +144,14 @@ async def handle_transaction_entry(phone: str, amount: float, item: str, silent:
                 else: budget_note = f"💰 Budget: ₹{remaining:g} remaining."
                 
             if not silent and not is_income:
-                cursor.execute("SELECT SUM(amount) FROM transactions WHERE user_id = %s AND type = 'expense' AND DATE(date) = %s", (user_id, tx_date))
-                today_row = tuple(cursor.fetchone() or (0,))
+                await cursor.execute("SELECT SUM(amount) FROM transactions WHERE user_id = %s AND type = 'expense' AND DATE(date) = %s", (user_id, tx_date))
+                today_row = tuple(await cursor.fetchone() or (0,))
                 today_total = float(str(today_row[0])) if today_row[0] else 0.0
 
             success = True
-        except Exception as e: 
-            print(f"Transaction DB Error: {repr(e)}")
-            traceback.print_exc()
-        finally:
-            if cursor: 
-                try: cursor.close()
-                except: pass
-            if conn:
-                try: conn.close()
-                except: pass
+    except Exception as e: 
+        print(f"Transaction DB Error: {repr(e)}")
+        traceback.print_exc()
 
     if success and not silent:
         today_str = ist_now.strftime('%Y-%m-%d')
@@ -307,24 +193,89 @@ async def handle_transaction_entry(phone: str, amount: float, item: str, silent:
 
     return success
 
+async def handle_bulk_entries(phone: str, entries: list[tuple[float, str, bool, str]], sender_name: str = "WhatsApp User", source_message_id: Optional[str] = None) -> list[bool]:
+    """
+    Saves several parsed (amount, item, explicit_income, payment_mode) lines in
+    one transaction: categories are resolved once per distinct name and the
+    rows go in with a single executemany. Returns a saved flag per entry.
+    Lines already saved for source_message_id by an earlier attempt are skipped.
+    """
+    if not entries:
+        return []
+    ist_now = datetime.utcnow() + timedelta(hours=5, minutes=30)
+
+    try:
+        async with db() as conn:
+            cursor = await conn.cursor()
+            
+            u_data = await user_directory.get(phone, cursor)
+            if not u_data:
+                await cursor.execute("INSERT INTO users (mobile, name, is_verified) VALUES (%s, %s, TRUE)", (phone, sender_name))
+                await conn.commit()
+                user_id = cursor.lastrowid
+            else:
+                user_id = int(u_data['id'])
+
+            matchers = {tx_type: await rule_cache.category_matcher(tx_type, cursor) for tx_type in ('expense', 'income')}
+            resolved = []
+            for amount, item, explicit_income, payment_mode in entries:
+                clean_item, transaction_datetime, tx_type = _prepare_entry(item, explicit_income, ist_now)
+                clean_item, cat_name, cat_icon, cat_color = _resolve_category(matchers[tx_type], clean_item, tx_type)
+                resolved.append((amount, clean_item, transaction_datetime, tx_type, payment_mode, cat_name, cat_icon, cat_color))
+
+            wanted = {(r[5], r[3]): (r[6], r[7]) for r in resolved}
+            placeholders = ", ".join(["(%s, %s)"] * len(wanted))
+            params: list[Any] = [user_id]
+            for name, tx_type in wanted: params.extend([name, tx_type])
+            await cursor.execute(f"""
+                SELECT name, type, id FROM categories 
+                WHERE (user_id = %s OR user_id IS NULL) AND (name, type) IN ({placeholders}) 
+                ORDER BY user_id DESC
+            """, tuple(params))
+            # categories.name compares case-insensitively in MySQL, so key the lookup the same way
+            category_ids: dict[tuple[str, str], int] = {}
+            for name, tx_type, cat_id in await cursor.fetchall():
+                category_ids.setdefault((str(name).lower(), tx_type), int(cat_id))
+            for (name, tx_type), (icon, color) in wanted.items():
+                if (name.lower(), tx_type) not in category_ids:
+                    category_ids[(name.lower(), tx_type)] = await _create_category(cursor, user_id, name, tx_type, icon, color)
+
+            recorded = await _recorded_lines(cursor, source_message_id)
+            rows = [
+                (user_id, amount, tx_type, clean_item, transaction_datetime, category_ids[(cat_name.lower(), tx_type)], payment_mode,
+                 source_message_id, line if source_message_id else None)
+                for line, (amount, clean_item, transaction_datetime, tx_type, payment_mode, cat_name, _, _) in enumerate(resolved)
+                if line not in recorded
+            ]
+            if rows:
+                await cursor.executemany("""
+                    INSERT INTO transactions (user_id, amount, type, note, date, category_id, payment_mode, source_message_id, source_line) 
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """, rows)
+                await record_transactions_async(cursor, user_id, [(r[4], r[5], r[2], r[1]) for r in rows])
+                await mark_user_write_async(cursor, user_id)
+            await conn.commit()
+            return [True] * len(entries)
+    except Exception as e:
+        print(f"Bulk Transaction DB Error: {repr(e)}")
+        traceback.print_exc()
+        return [False] * len(entries)
+
 async def handle_undo_request(phone: str):
-    conn = None
-    cursor = None
     buttons = []
-    async with db_semaphore:
-        try:
-            conn = get_db()
-            cursor = conn.cursor()
-            user_id = get_user_id(cursor, phone)
+    try:
+        async with outbox() as out, db() as conn:
+            cursor = await conn.cursor()
+            user_id = await get_user_id(cursor, phone)
             if not user_id:
-                await send_whatsapp_text(phone, "You haven't made any entries today that can be undone.")
+                out.text(phone, "You haven't made any entries today that can be undone.")
                 return
                 
-            cursor.execute("SELECT id, amount, note FROM transactions WHERE user_id = %s AND DATE(date) = CURDATE() ORDER BY date DESC LIMIT 2", (user_id,))
-            rows = cursor.fetchall()
+            await cursor.execute("SELECT id, amount, note FROM transactions WHERE user_id = %s AND DATE(date) = CURDATE() ORDER BY date DESC LIMIT 2", (user_id,))
+            rows = await cursor.fetchall()
             
             if not rows:
-                await send_whatsapp_text(phone, "You haven't made any entries today that can be undone.")
+                out.text(phone, "You haven't made any entries today that can be undone.")
                 return
 
             used_titles = set()
@@ -341,45 +292,34 @@ async def handle_undo_request(phone: str):
                     
                 used_titles.add(title)
                 buttons.append({"id": f"del_{str(r[0])}", "title": title})
-        except Exception as e:
-            print(f"Undo Error: {e}")
-            return
-        finally:
-            if cursor: 
-                try: cursor.close()
-                except: pass
-            if conn: 
-                try: conn.close()
-                except: pass
-            
+    except Exception as e:
+        print(f"Undo Error: {e}")
+        return
+
     if buttons:
         await send_whatsapp_interactive_buttons(phone, "Which recent entry do you want to delete?", buttons)
 
 async def handle_undo_action(phone: str, tx_id: int):
-    conn = None
-    cursor = None
     rowcount = 0
-    async with db_semaphore:
-        try:
-            conn = get_db()
-            cursor = conn.cursor()
-            user_id = get_user_id(cursor, phone)
+    try:
+        async with db() as conn:
+            cursor = await conn.cursor()
+            user_id = await get_user_id(cursor, phone)
             if not user_id: return
             
-            cursor.execute("DELETE FROM transactions WHERE id = %s AND user_id = %s AND DATE(date) = CURDATE()", (tx_id, user_id))
-            conn.commit()
-            rowcount = cursor.rowcount
-        except Exception as e:
-            print(f"Undo Action Error: {e}")
-            return
-        finally:
-            if cursor: 
-                try: cursor.close()
-                except: pass
-            if conn: 
-                try: conn.close()
-                except: pass
+            await cursor.execute("SELECT date, category_id, type, amount FROM transactions WHERE id = %s AND user_id = %s AND DATE(date) = CURDATE() FOR UPDATE", (tx_id, user_id))
+            old_tx = await cursor.fetchone()
             
+            await cursor.execute("DELETE FROM transactions WHERE id = %s AND user_id = %s AND DATE(date) = CURDATE()", (tx_id, user_id))
+            rowcount = cursor.rowcount
+            if old_tx:
+                await remove_transaction_async(cursor, user_id, *old_tx)
+            await mark_user_write_async(cursor, user_id)
+            await conn.commit()
+    except Exception as e:
+        print(f"Undo Action Error: {e}")
+        return
+
     if rowcount > 0:
         await send_whatsapp_text(phone, "🗑️ Entry deleted successfully!")
     else:
@@ -402,29 +342,27 @@ async def handle_budget_set(phone: str, text: str):
         cat_str = re.sub(rf'\b{word}\b', '', cat_str)
     cat_str = cat_str.strip()
 
-    conn = None
-    cursor = None
-    async with db_semaphore:
-        try:
-            conn = get_db()
-            cursor = conn.cursor()
+    try:
+        async with outbox() as out, db() as conn:
+            cursor = await conn.cursor()
             
-            user_id = get_user_id(cursor, phone)
+            user_id = await get_user_id(cursor, phone)
             if not user_id: return
 
             if not cat_str:
-                cursor.execute("UPDATE users SET monthly_budget = %s WHERE id = %s", (new_budget, user_id))
-                conn.commit()
+                await cursor.execute("UPDATE users SET monthly_budget = %s WHERE id = %s", (new_budget, user_id))
+                await conn.commit()
+                user_directory.invalidate(phone=phone)
                 if new_budget > 0:
-                    await send_whatsapp_text(phone, f"✅ Global Budget Set!\nYour overall monthly limit is now *₹{new_budget:g}*.\n\nSideNote will notify you as you approach this limit.\n\n_(To remove it, type `set budget 0`)_")
+                    out.text(phone, f"✅ Global Budget Set!\nYour overall monthly limit is now *₹{new_budget:g}*.\n\nSideNote will notify you as you approach this limit.\n\n_(To remove it, type `set budget 0`)_")
                 else:
-                    await send_whatsapp_text(phone, "🗑️ Global budget limit removed.")
+                    out.text(phone, "🗑️ Global budget limit removed.")
             else:
-                cursor.execute("""
+                await cursor.execute("""
                     SELECT id, name FROM categories 
                     WHERE (user_id = %s OR user_id IS NULL) AND type = 'expense'
                 """, (user_id,))
-                categories = cursor.fetchall()
+                categories = await cursor.fetchall()
                 
                 matched_cat_id = None
                 matched_cat_name = None
@@ -444,67 +382,45 @@ async def handle_budget_set(phone: str, text: str):
                         break
                         
                 if not matched_cat_id:
-                    await send_whatsapp_text(phone, f"❌ I couldn't find a category matching '{cat_str.capitalize()}'.\nPlease use an existing category name like 'Food', 'Travel', or 'Shopping'.")
+                    out.text(phone, f"❌ I couldn't find a category matching '{cat_str.capitalize()}'.\nPlease use an existing category name like 'Food', 'Travel', or 'Shopping'.")
                     return
 
                 if new_budget > 0:
-                    cursor.execute("""
+                    await cursor.execute("""
                         INSERT INTO budgets (user_id, category_id, amount)
                         VALUES (%s, %s, %s)
                         ON DUPLICATE KEY UPDATE amount = %s
                     """, (user_id, matched_cat_id, new_budget, new_budget))
-                    conn.commit()
-                    await send_whatsapp_text(phone, f"✅ Limit Set!\nYour monthly budget for *{matched_cat_name}* is now *₹{new_budget:g}*.\n\n_(To remove it, type `set budget {cat_str} 0`)_")
+                    await conn.commit()
+                    out.text(phone, f"✅ Limit Set!\nYour monthly budget for *{matched_cat_name}* is now *₹{new_budget:g}*.\n\n_(To remove it, type `set budget {cat_str} 0`)_")
                 else:
-                    cursor.execute("DELETE FROM budgets WHERE user_id = %s AND category_id = %s", (user_id, matched_cat_id))
-                    conn.commit()
-                    await send_whatsapp_text(phone, f"🗑️ Budget limit for *{matched_cat_name}* has been removed.")
-
-        except Exception as e:
-            print(f"Budget Set Error: {e}")
-            await send_whatsapp_text(phone, "⚠️ Sorry, something went wrong while setting your budget.")
-            return
-        finally:
-            if cursor: 
-                try: cursor.close()
-                except: pass
-            if conn: 
-                try: conn.close()
-                except: pass
+                    await cursor.execute("DELETE FROM budgets WHERE user_id = %s AND category_id = %s", (user_id, matched_cat_id))
+                    await conn.commit()
+                    out.text(phone, f"🗑️ Budget limit for *{matched_cat_name}* has been removed.")
+
+    except Exception as e:
+        print(f"Budget Set Error: {e}")
+        await send_whatsapp_text(phone, "⚠️ Sorry, something went wrong while setting your budget.")
+        return
 
 async def handle_dynamic_replies(phone: str, incoming_text: str):
     incoming_text = incoming_text.lower().strip()
-    conn = None
-    cursor = None
-    async with db_semaphore:
-        try:
-            conn = get_db()
-            cursor = conn.cursor(dictionary=True)
-            cursor.execute("SELECT reply_text, trigger_keywords, buttons_json FROM auto_replies WHERE is_active = TRUE")
-            mappings = cursor.fetchall()
+    try:
+        for row in await rule_cache.auto_replies():
+            matched_keyword = next((k for k in row['keywords'] if k == incoming_text or f" {k} " in f" {incoming_text} "), None)
             
-            for row in mappings:
-                keywords = [k.strip() for k in row['trigger_keywords'].split(',')]
-                matched_keyword = next((k for k in keywords if k == incoming_text or f" {k} " in f" {incoming_text} "), None)
+            if matched_keyword:
+                reply_body = row['reply_text']
+                buttons = row['buttons']
                 
-                if matched_keyword:
-                    reply_body = row['reply_text']
-                    buttons = None
-                    if row['buttons_json']:
-                        import json
-                        try: buttons = json.loads(row['buttons_json'])
-                        except: pass
-                    
-                    if buttons: await send_whatsapp_interactive_buttons(phone, reply_body, buttons)
-                    else: await send_whatsapp_text(phone, reply_body)
-
-                    log_bot_command(phone, matched_keyword)
-                    return True
-        except Exception as e:
-            print(f"Dynamic Reply Error: {e}")
-        finally:
-            if conn: conn.close()
-            
+                if buttons: await send_whatsapp_interactive_buttons(phone, reply_body, buttons)
+                else: await send_whatsapp_text(phone, reply_body)
+
+                await log_bot_command(phone, matched_keyword)
+                return True
+    except Exception as e:
+        print(f"Dynamic Reply Error: {e}")
+
     return False
 
 async def handle_fallback(phone: str, text: str = ""):
@@ -540,38 +456,29 @@ async def handle_set_profile(phone: str, text: str):
         await send_whatsapp_text(phone, f"❌ Please provide a value. \nExample: `{example}`")
         return True
 
-    conn = None
-    cursor = None
-    async with db_semaphore:
-        try:
-            conn = get_db()
-            cursor = conn.cursor()
+    try:
+        async with outbox() as out, db() as conn:
+            cursor = await conn.cursor()
             
-            user_id = get_user_id(cursor, phone)
+            user_id = await get_user_id(cursor, phone)
             
             if not user_id:
                 initial_name = value if is_name else "WhatsApp User"
-                cursor.execute("INSERT INTO users (mobile, name, is_verified) VALUES (%s, %s, TRUE)", (phone, initial_name))
-                conn.commit()
+                await cursor.execute("INSERT INTO users (mobile, name, is_verified) VALUES (%s, %s, TRUE)", (phone, initial_name))
+                await conn.commit()
                 user_id = cursor.lastrowid
                 
             if is_nickname:
-                cursor.execute("UPDATE users SET nickname = %s WHERE id = %s", (value, user_id))
+                await cursor.execute("UPDATE users SET nickname = %s WHERE id = %s", (value, user_id))
             else:
-                cursor.execute("UPDATE users SET name = %s WHERE id = %s", (value, user_id))
+                await cursor.execute("UPDATE users SET name = %s WHERE id = %s", (value, user_id))
                 
-            conn.commit()
-            await send_whatsapp_text(phone, f"✅ {column_label} successfully updated to *{value}*!")
+            await conn.commit()
+            user_directory.invalidate(phone=phone)
+            out.text(phone, f"✅ {column_label} successfully updated to *{value}*!")
             
-        except Exception as e:
-            print(f"Profile Set Error: {e}")
-            await send_whatsapp_text(phone, "⚠️ Sorry, something went wrong while updating your profile.")
-        finally:
-            if cursor: 
-                try: cursor.close()
-                except: pass
-            if conn: 
-                try: conn.close()
-                except: pass
-                
+    except Exception as e:
+        print(f"Profile Set Error: {e}")
+        await send_whatsapp_text(phone, "⚠️ Sorry, something went wrong while updating your profile.")
+
     return True
\ No newline at end of file
@@ -2,9 +2,14 @@ import httpx
 import os
 import logging
 import asyncio
+import json
+import time
 from typing import Any, Optional
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from database import get_db
+from database import db
+from telemetry import registry
+from outbound_scheduler import outbound_scheduler, retry_reason, LANE_INTERACTIVE, OUTBOUND_MAX_ATTEMPTS
 
 load_dotenv()
 
@@ -15,7 +20,40 @@ WA_URL = f"https://graph.facebook.com/v23.0/{WA_PHONE_ID}/messages"
 logger = logging.getLogger("uvicorn")
 limits = httpx.Limits(max_keepalive_connections=20, max_connections=50)
 timeout = httpx.Timeout(10.0, read=30.0)
-transport = httpx.AsyncHTTPTransport(retries=3)
+
+graph_requests = registry.counter("sidenote_whatsapp_requests", "Graph API calls by kind and outcome.", ("kind", "outcome"))
+graph_request_duration = registry.histogram("sidenote_whatsapp_request_duration_seconds", "Graph API call latency by kind.", ("kind",))
+
+def _request_kind(request: httpx.Request) -> str:
+    if request.url.path.endswith("/messages"):
+        try: return str(json.loads(request.content).get("type", "unknown"))
+        except Exception: return "unknown"
+    if request.url.path.endswith("/media"):
+        return "media_upload"
+    return "media_fetch"
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """Times every Graph API call and counts it by message type and outcome."""
+    def __init__(self, inner: httpx.AsyncBaseTransport):
+        self.inner = inner
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        kind = _request_kind(request)
+        started = time.monotonic()
+        try:
+            response = await self.inner.handle_async_request(request)
+        except Exception:
+            graph_requests.inc(kind=kind, outcome="network_error")
+            raise
+        finally:
+            graph_request_duration.observe(time.monotonic() - started, kind=kind)
+        graph_requests.inc(kind=kind, outcome="ok" if response.status_code < 400 else f"http_{response.status_code}")
+        return response
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+transport = InstrumentedTransport(httpx.AsyncHTTPTransport(retries=3))
 
 http_client = httpx.AsyncClient(
     transport=transport,
@@ -24,27 +62,45 @@ http_client = httpx.AsyncClient(
 )
 outbound_semaphore = asyncio.Semaphore(10)
 
-def log_outbound_message(wamid: str, phone: str, msg_type: str, msg_body: str):
+async def post_message(payload: dict, headers: dict, lane: str = LANE_INTERACTIVE) -> httpx.Response:
+    """
+    POSTs to /messages once the outbound scheduler grants a token, retrying
+    rate-limit and 5xx responses with jittered backoff. Connection errors are
+    retried by the transport; timeouts are not, as the message may have gone out.
+    """
+    for attempt in range(OUTBOUND_MAX_ATTEMPTS):
+        await outbound_scheduler.acquire(lane)
+        async with outbound_semaphore:
+            response = await http_client.post(WA_URL, json=payload, headers=headers)
+        try: body = response.json()
+        except ValueError: body = None
+        reason = retry_reason(response.status_code, body)
+        if reason is None or attempt == OUTBOUND_MAX_ATTEMPTS - 1:
+            return response
+        delay = outbound_scheduler.backoff(reason, attempt, response.headers.get("Retry-After"))
+        logger.warning(f"WhatsApp send to {payload.get('to')} {reason} (HTTP {response.status_code}), retrying in {delay:.1f}s")
+        await asyncio.sleep(delay)
+    return response
+
+async def log_outbound_message(wamid: str, phone: str, msg_type: str, msg_body: str):
     if not wamid: return
-    conn = get_db()
-    cursor = conn.cursor()
     try:
-        cursor.execute("""
-            INSERT INTO whatsapp_messages 
-            (whatsapp_message_id, phone_number, direction, message_type, message_body, status, timestamp)
-            VALUES (%s, %s, 'outbound', %s, %s, 'queued', NOW())
-            ON DUPLICATE KEY UPDATE
-                message_type = VALUES(message_type),
-                message_body = VALUES(message_body)
-        """, (wamid, phone, msg_type, msg_body))
-        conn.commit()
+        async with db() as conn:
+            cursor = await conn.cursor()
+            await cursor.execute("""
+                INSERT INTO whatsapp_messages 
+                (whatsapp_message_id, phone_number, direction, message_type, message_body, status, timestamp)
+                VALUES (%s, %s, 'outbound', %s, %s, 'queued', NOW())
+                ON DUPLICATE KEY UPDATE
+                    message_type = VALUES(message_type),
+                    message_body = VALUES(message_body)
+            """, (wamid, phone, msg_type, msg_body))
+            await conn.commit()
     except Exception as e:
         logger.error(f"Failed to log outbound message content: {e}")
-    finally:
-        conn.close()
 
 
-async def send_whatsapp_template(to_number: str, template_name: str, variables: list[str]):
+async def send_whatsapp_template(to_number: str, template_name: str, variables: list[str], lane: str = LANE_INTERACTIVE):
     headers = {"Authorization": f"Bearer {WA_TOKEN}", "Content-Type": "application/json"}
     parameters = [{"type": "text", "text": str(var)} for var in variables]
     template_data: dict[str, Any] = {"name": template_name, "language": {"code": "en_US"}}
@@ -59,26 +115,25 @@ async def send_whatsapp_template(to_number: str, template_name: str, variables:
         "template": template_data
     }
 
-    async with outbound_semaphore:
-        try:
-            response = await http_client.post(WA_URL, json=payload, headers=headers)
-            response.raise_for_status()
-            res_data = response.json()
-            if "messages" in res_data:
-                wamid = res_data["messages"][0]["id"]
-                log_outbound_message(wamid, to_number, "template", f"{template_name} {variables}")
-                
-            logger.info(f"Template '{template_name}' sent to {to_number}")
-            return {"status": "success"}
-        except httpx.HTTPStatusError as e:
-            logger.error(f"WhatsApp Template Error: {e.response.text}")
-            return {"status": "error", "detail": e.response.text}
-        except Exception as e:
-            logger.error(f"WhatsApp Template Network Error: {repr(e)}")
-            return {"status": "error", "detail": str(e)}
+    try:
+        response = await post_message(payload, headers, lane)
+        response.raise_for_status()
+        res_data = response.json()
+        if "messages" in res_data:
+            wamid = res_data["messages"][0]["id"]
+            await log_outbound_message(wamid, to_number, "template", f"{template_name} {variables}")
+            
+        logger.info(f"Template '{template_name}' sent to {to_number}")
+        return {"status": "success"}
+    except httpx.HTTPStatusError as e:
+        logger.error(f"WhatsApp Template Error: {e.response.text}")
+        return {"status": "error", "detail": e.response.text}
+    except Exception as e:
+        logger.error(f"WhatsApp Template Network Error: {repr(e)}")
+        return {"status": "error", "detail": str(e)}
 
 
-async def send_whatsapp_text(to_number: str, text_message: str):
+async def send_whatsapp_text(to_number: str, text_message: str, lane: str = LANE_INTERACTIVE):
     headers = {"Authorization": f"Bearer {WA_TOKEN}", "Content-Type": "application/json"}
     payload = {
         "messaging_product": "whatsapp",
@@ -88,25 +143,24 @@ async def send_whatsapp_text(to_number: str, text_message: str):
         "text": {"body": text_message}
     }
 
-    async with outbound_semaphore:
-        try:
-            response = await http_client.post(WA_URL, json=payload, headers=headers)
-            response.raise_for_status()
-            res_data = response.json()
-            if "messages" in res_data:
-                wamid = res_data["messages"][0]["id"]
-                log_outbound_message(wamid, to_number, "text", text_message)
-                
-            return {"status": "success"}
-        except httpx.HTTPStatusError as e:
-            logger.error(f"WhatsApp Text Error: {e.response.text}")
-            return {"status": "error"}
-        except Exception as e:
-            logger.error(f"WhatsApp Text Network Error: {repr(e)}")
-            return {"status": "error"}
+    try:
+        response = await post_message(payload, headers, lane)
+        response.raise_for_status()
+        res_data = response.json()
+        if "messages" in res_data:
+            wamid = res_data["messages"][0]["id"]
+            await log_outbound_message(wamid, to_number, "text", text_message)
+            
+        return {"status": "success"}
+    except httpx.HTTPStatusError as e:
+        logger.error(f"WhatsApp Text Error: {e.response.text}")
+        return {"status": "error"}
+    except Exception as e:
+        logger.error(f"WhatsApp Text Network Error: {repr(e)}")
+        return {"status": "error"}
 
 
-async def send_whatsapp_interactive_buttons(to_number: str, body_text: str, buttons: list[dict[str, str]]):
+async def send_whatsapp_interactive_buttons(to_number: str, body_text: str, buttons: list[dict[str, str]], lane: str = LANE_INTERACTIVE):
     headers = {"Authorization": f"Bearer {WA_TOKEN}", "Content-Type": "application/json"}
     
     action_buttons = [
@@ -128,23 +182,22 @@ async def send_whatsapp_interactive_buttons(to_number: str, body_text: str, butt
         }
     }
 
-    async with outbound_semaphore:
-        try:
-            response = await http_client.post(WA_URL, json=payload, headers=headers)
-            response.raise_for_status()
-            res_data = response.json()
-            if "messages" in res_data:
-                wamid = res_data["messages"][0]["id"]
-                log_outbound_message(wamid, to_number, "interactive", body_text)
-                
-            logger.info(f"Interactive buttons sent to {to_number}")
-            return {"status": "success"}
-        except httpx.HTTPStatusError as e:
-            logger.error(f"WhatsApp Button Error: {e.response.text}")
-            return {"status": "error"}
-        except Exception as e:
-            logger.error(f"WhatsApp Button Network Error: {repr(e)}")
-            return {"status": "error"}
+    try:
+        response = await post_message(payload, headers, lane)
+        response.raise_for_status()
+        res_data = response.json()
+        if "messages" in res_data:
+            wamid = res_data["messages"][0]["id"]
+            await log_outbound_message(wamid, to_number, "interactive", body_text)
+            
+        logger.info(f"Interactive buttons sent to {to_number}")
+        return {"status": "success"}
+    except httpx.HTTPStatusError as e:
+        logger.error(f"WhatsApp Button Error: {e.response.text}")
+        return {"status": "error"}
+    except Exception as e:
+        logger.error(f"WhatsApp Button Network Error: {repr(e)}")
+        return {"status": "error"}
 
 
 async def send_whatsapp_media(
@@ -153,7 +206,8 @@ async def send_whatsapp_media(
     media_link: Optional[str] = None, 
     media_id: Optional[str] = None, 
     caption: Optional[str] = None,
-    filename: Optional[str] = None
+    filename: Optional[str] = None,
+    lane: str = LANE_INTERACTIVE
 ):
     if not media_link and not media_id:
         logger.error("Failed to send media: Must provide either media_link or media_id")
@@ -186,23 +240,22 @@ async def send_whatsapp_media(
         media_type: media_object
     }
 
-    async with outbound_semaphore:
-        try:
-            response = await http_client.post(WA_URL, json=payload, headers=headers)
-            response.raise_for_status()
-            res_data = response.json()
-            if "messages" in res_data:
-                wamid = res_data["messages"][0]["id"]
-                log_outbound_message(wamid, to_number, media_type, caption or media_link or media_id)
-                
-            logger.info(f"Media ({media_type}) sent to {to_number}")
-            return {"status": "success"}
-        except httpx.HTTPStatusError as e:
-            logger.error(f"WhatsApp Media Error ({media_type}): {e.response.text}")
-            return {"status": "error", "detail": e.response.text}
-        except Exception as e:
-            logger.error(f"WhatsApp Media Network Error ({media_type}): {repr(e)}")
-            return {"status": "error", "detail": str(e)}
+    try:
+        response = await post_message(payload, headers, lane)
+        response.raise_for_status()
+        res_data = response.json()
+        if "messages" in res_data:
+            wamid = res_data["messages"][0]["id"]
+            await log_outbound_message(wamid, to_number, media_type, caption or media_link or media_id)
+            
+        logger.info(f"Media ({media_type}) sent to {to_number}")
+        return {"status": "success"}
+    except httpx.HTTPStatusError as e:
+        logger.error(f"WhatsApp Media Error ({media_type}): {e.response.text}")
+        return {"status": "error", "detail": e.response.text}
+    except Exception as e:
+        logger.error(f"WhatsApp Media Network Error ({media_type}): {repr(e)}")
+        return {"status": "error", "detail": str(e)}
 
 
 async def get_whatsapp_media_url(media_id: str) -> str | None:
@@ -272,4 +325,46 @@ async def send_policy_consent_prompt(to_number: str):
         {"id": "decline_tnc", "title": "No"}
     ]
     
-    return await send_whatsapp_interactive_buttons(to_number, body_text, buttons)
\ No newline at end of file
+    return await send_whatsapp_interactive_buttons(to_number, body_text, buttons)
+
+
+class Outbox:
+    """Sends (or any follow-up coroutine) queued while a DB connection is held, run in order by flush()."""
+    def __init__(self):
+        self._calls: list[tuple] = []
+
+    def add(self, fn, *args, **kwargs):
+        self._calls.append((fn, args, kwargs))
+
+    def text(self, to_number: str, text_message: str):
+        self.add(send_whatsapp_text, to_number, text_message)
+
+    def buttons(self, to_number: str, body_text: str, buttons: list[dict[str, str]]):
+        self.add(send_whatsapp_interactive_buttons, to_number, body_text, buttons)
+
+    async def flush(self):
+        calls, self._calls = self._calls, []
+        for fn, args, kwargs in calls:
+            await fn(*args, **kwargs)
+
+@asynccontextmanager
+async def outbox():
+    """
+    Defers sends until the enclosed db() block has released its connection:
+
+        async with outbox() as out, db() as conn:
+            ...
+            out.text(phone, "Saved!")
+
+    Network sends can take seconds (rate limiting, retries) and log through the
+    same async pool, so they must never run while a connection is checked out.
+    """
+    box = Outbox()
+    try:
+        yield box
+    except asyncio.CancelledError:
+        box._calls.clear()
+        raise
+    finally:
+        await box.flush()
+
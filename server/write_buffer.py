@@ -0,0 +1,106 @@
+import os
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable
+from database import db
+from telemetry import registry
+
+logger = logging.getLogger(__name__)
+
+WRITE_BUFFER_FLUSH_SIZE = int(os.getenv("WRITE_BUFFER_FLUSH_SIZE", 200))
+WRITE_BUFFER_FLUSH_SECONDS = float(os.getenv("WRITE_BUFFER_FLUSH_SECONDS", 1.0))
+WRITE_BUFFER_MAX_ROWS = int(os.getenv("WRITE_BUFFER_MAX_ROWS", 20000))
+
+_buffers: list["WriteBuffer"] = []
+
+class WriteBuffer:
+    """
+    Write-behind buffer for high-volume, fire-and-forget rows. add() only
+    appends; a background task hands everything buffered to writer(cursor, rows)
+    once flush_size rows are waiting or every flush_seconds, in one transaction.
+    At most max_rows are held: past that the oldest rows are dropped and
+    counted. stop() drains what is left.
+    """
+    def __init__(self, name: str, writer: Callable[[Any, list], Awaitable[None]],
+                 flush_size: int = WRITE_BUFFER_FLUSH_SIZE, flush_seconds: float = WRITE_BUFFER_FLUSH_SECONDS,
+                 max_rows: int = WRITE_BUFFER_MAX_ROWS):
+        self.name = name
+        self.writer = writer
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self._rows: deque = deque(maxlen=max_rows)
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.written = 0
+        self.dropped = 0
+        self.failed_flushes = 0
+        _buffers.append(self)
+
+    def add(self, row: tuple):
+        if len(self._rows) == self._rows.maxlen:
+            self.dropped += 1
+        self._rows.append(row)
+        if len(self._rows) >= self.flush_size:
+            self._wakeup.set()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        while self._rows:
+            if not await self.flush():
+                break
+
+    async def _run(self):
+        while True:
+            try: await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_seconds)
+            except asyncio.TimeoutError: pass
+            self._wakeup.clear()
+            while self._rows:
+                if not await self.flush() or len(self._rows) < self.flush_size:
+                    break
+
+    async def flush(self) -> bool:
+        batch = [self._rows.popleft() for _ in range(min(len(self._rows), self.flush_size))]
+        if not batch:
+            return True
+        try:
+            async with db() as conn:
+                cursor = await conn.cursor()
+                await self.writer(cursor, batch)
+                await conn.commit()
+            self.written += len(batch)
+            return True
+        except Exception as e:
+            self.failed_flushes += 1
+            logger.error(f"Write buffer [{self.name}] flush of {len(batch)} rows failed: {e}")
+            # put the batch back in front for the next attempt, within the cap;
+            # like add(), overflow drops the oldest rows and keeps the newest
+            room = self._rows.maxlen - len(self._rows)
+            self.dropped += max(len(batch) - room, 0)
+            self._rows.extendleft(reversed(batch[max(len(batch) - room, 0):]))
+            return False
+
+    def snapshot(self) -> dict:
+        return {
+            "buffer": self.name,
+            "pending": len(self._rows),
+            "max_rows": self._rows.maxlen,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed_flushes": self.failed_flushes
+        }
+
+def buffer_stats() -> list[dict]:
+    return [b.snapshot() for b in _buffers]
+
+registry.gauge_callback("sidenote_write_buffer_pending", "Rows waiting in each write-behind buffer.", ("buffer",), lambda: [((b.name,), len(b._rows)) for b in _buffers])
+registry.counter_callback(
+    "sidenote_write_buffer_rows", "Write-behind buffer rows by outcome.", ("buffer", "outcome"),
+    lambda: [((b.name, outcome), n) for b in _buffers for outcome, n in (("written", b.written), ("dropped", b.dropped))]
+)